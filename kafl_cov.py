@@ -36,6 +36,7 @@ from kafl_fuzzer.common.self_check import self_check, post_self_check
 from kafl_fuzzer.common.logger import setup_logging
 from kafl_fuzzer.common.util import prepare_working_dir, read_binary_file, qemu_sweep, print_banner
 from kafl_fuzzer.worker.execution_result import ExecutionResult
+from kafl_fuzzer.manager.statistics import WorkerStatsSegment
 from kafl_fuzzer.worker.qemu import qemu
 
 import csv
@@ -182,10 +183,7 @@ def afl_workdir_iterator(work_dir):
 def kafl_workdir_iterator(work_dir):
     input_id_time = list()
     start_time = time.time()
-    for stats_file in glob.glob(work_dir + "/worker_stats_*"):
-        if not stats_file:
-            return None
-        worker_stats = msgpack.unpackb(read_binary_file(stats_file), strict_map_key=False)
+    for worker_stats in WorkerStatsSegment(work_dir).read_all():
         start_time = min(start_time, worker_stats['start_time'])
 
     # enumerate inputs from corpus/ and match against metainfo in metadata/
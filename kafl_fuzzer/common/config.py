@@ -98,6 +98,10 @@ def add_args_fuzzer(parser):
                         help='import dictionary file for use in havoc stage.', default=None)
     parser.add_argument('--funky', required=False, help='perform extra validation and store funky inputs.',
                         action='store_true', default=False)
+    parser.add_argument('--manager-listen', required=False, metavar='<host:port>', type=str, default=None,
+                        help='also accept remote Workers and relays on this TCP address')
+    parser.add_argument('--relay', required=False, metavar='<host:port>', type=str, default=None,
+                        help='run local Workers against the Manager at this TCP address')
 
     parser.add_argument('-D', '--afl-dumb-mode', required=False, help='skip deterministic stage (dumb mode)',
                         action='store_true', default=False)
@@ -109,6 +113,8 @@ def add_args_fuzzer(parser):
                         action='append', help=hidden('skip byte range during deterministic stage'))
     parser.add_argument('--afl-arith-max', metavar='<n>', help=hidden("max arithmetic range for afl_arith_n mutation"),
                         type=int, required=False, default=35)
+    parser.add_argument('--det-shard', metavar='<n>', help=hidden('split deterministic stage of payloads larger than <n> bytes into shards of <n> offsets for parallel Workers (default 0 = off)'),
+                        type=int, required=False, default=0)
 
     parser.add_argument('--radamsa', required=False, help='enable Radamsa as additional havoc stage',
                         action='store_true', default=False)
@@ -130,10 +136,28 @@ def add_args_fuzzer(parser):
                         type=int, required=False, default=None)
     parser.add_argument('-ts', '--t-soft', dest='timeout_soft', required=False, metavar='<n>', help="soft execution timeout (in seconds)",
                         type=float, default=1/1000)
+    parser.add_argument('--t-quantile', metavar='<q>', help=hidden('calibrate soft timeout to twice the <q> quantile of regular runtimes, e.g. 0.99 (default 0 = off)'),
+                        type=float, required=False, default=0)
     parser.add_argument('-tc', '--t-check', dest='timeout_check', required=False, help="validate timeouts against hard limit (slower)",
                         action='store_true', default=False)
     parser.add_argument('--kickstart', metavar='<n>', help="kickstart fuzzing with <n> byte random strings (default 256, 0 to disable)",
                         type=int, required=False, default=256)
+    parser.add_argument('--meta-flush', metavar='<n>', help=hidden('write node metadata in batches every <n> seconds (default 0 = off)'),
+                        type=float, required=False, default=0)
+    parser.add_argument('--prefetch', metavar='<n>', help=hidden('queue up to <n> tasks per Worker (default 1 = no prefetching)'),
+                        type=int, required=False, default=1)
+    parser.add_argument('--node-cache', metavar='<n>', help=hidden('send node metadata with each task and cache up to <n> payloads per Worker (default 0 = read from disk)'),
+                        type=int, required=False, default=0)
+    parser.add_argument('--splice-cache', metavar='<n>', help=hidden('cache up to <n> splice partner payloads per Worker (default 1024)'),
+                        type=int, required=False, default=1024)
+    parser.add_argument('--havoc-seed', metavar='<n>', help=hidden('replay havoc stage with fixed seed, as recorded in node metadata'),
+                        type=int, required=False, default=None)
+    parser.add_argument('--exec-batch', metavar='<n>', help=hidden('execute havoc inputs in batches of <n> if supported by Qemu backend (default 0 = off)'),
+                        type=int, required=False, default=0)
+    parser.add_argument('--bitmap-sync', help=hidden('Workers keep private bitmap copies, updated by the Manager with each task'),
+                        action='store_true', default=False)
+    parser.add_argument('--corpus-store', help=hidden('store payloads and metadata in append-only segment files instead of corpus/ and metadata/'),
+                        action='store_true', default=False)
     parser.add_argument('--radamsa-path', metavar='<file>', help=hidden('path to radamsa executable'),
                         type=parse_is_file, action=ExpandVars, required=False, default=None)
 
@@ -167,6 +191,10 @@ def add_args_qemu(parser):
                         type=str, required=False, default=None)
     parser.add_argument('--qemu-path', metavar='<file>', action=ExpandVars, help=hidden('path to Qemu-Nyx executable'),
                         type=parse_is_file, required=True, default=None)
+    parser.add_argument('--qemu-launch', metavar='<n>', help=hidden('launch up to <n> Qemu instances in parallel after snapshot creation (default 8)'),
+                        type=int, required=False, default=8)
+    parser.add_argument('--qemu-ready-timeout', metavar='<n>', help=hidden('max seconds to wait for the snapshot before launching further Qemu instances (default 600)'),
+                        type=float, required=False, default=600)
 
     parser.add_argument('-ip0', required=False, default=None, metavar='<n-m>', type=parse_range_ip_filter,
                         help='set IP trace filter range 0 (should be page-aligned)')
@@ -181,6 +209,8 @@ def add_args_qemu(parser):
                         type=parse_is_dir, help='path to the page buffer share directory.')
     parser.add_argument('-R', '--reload', metavar='<n>', help='snapshot-reload every N execs (default: 1)',
                         type=int, required=False, default=1)
+    parser.add_argument('--reload-max', metavar='<n>', help=hidden('auto-tune reload interval between 1 and <n> based on funky/crash rate and exec speed (default 0 = static -R)'),
+                        type=int, required=False, default=0)
     parser.add_argument('--gdbserver', required=False, help=hidden('enable Qemu gdbserver (use via kafl_debug.py!'),
                         action='store_true', default=False)
     parser.add_argument('--log-hprintf', required=False, help="redirect hprintf logging to workdir/hprintf_NN.log",
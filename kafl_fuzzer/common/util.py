@@ -87,14 +87,29 @@ def read_binary_file(filename):
         return f.read()
 
 def find_diffs(data_a, data_b):
-    first_diff = 0
-    last_diff = 0
-    for i in range(min(len(data_a), len(data_b))):
-        if data_a[i] != data_b:
-            if first_diff == 0:
-                first_diff = i
-            last_diff = i
-    return first_diff, last_diff
+    # first and last differing offset within the common length, (-1, -1) if equal
+    # binary search on slice comparisons, to keep the byte-wise work in C
+    size = min(len(data_a), len(data_b))
+    if data_a[:size] == data_b[:size]:
+        return -1, -1
+
+    lo, hi = 0, size - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if data_a[:mid+1] == data_b[:mid+1]:
+            lo = mid + 1
+        else:
+            hi = mid
+    first_diff = lo
+
+    lo, hi = first_diff, size - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if data_a[mid:size] == data_b[mid:size]:
+            hi = mid - 1
+        else:
+            lo = mid
+    return first_diff, lo
 
 def prepare_working_dir(config):
 
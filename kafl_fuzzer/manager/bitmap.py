@@ -7,26 +7,42 @@
 kAFL Fuzzer Bitmap
 """
 
+import array
 import ctypes
+import itertools
 import mmap
 import os
+from collections import deque
 
 from kafl_fuzzer.native import loader as native_loader
 
+# number of bitmap updates kept for delta sync before falling back to full snapshots
+SYNC_LOG_MAX = 4096
+
 class GlobalBitmap:
     bitmap_native_so = None
 
-    def __init__(self, name, config, read_only=True):
+    def __init__(self, name, config, read_only=True, private=False):
         if not GlobalBitmap.bitmap_native_so:
             GlobalBitmap.bitmap_native_so = ctypes.CDLL(native_loader.bitmap_path())
             GlobalBitmap.bitmap_native_so.are_new_bits_present_no_apply_lut.restype = ctypes.c_uint64
             GlobalBitmap.bitmap_native_so.are_new_bits_present_do_apply_lut.restype = ctypes.c_uint64
+            GlobalBitmap.bitmap_native_so.bitmap_new_offsets.restype = ctypes.c_uint64
+            GlobalBitmap.bitmap_native_so.sparse_new_offsets.restype = ctypes.c_uint64
 
         self.bitmap_size = config.bitmap_size
-        self.create_bitmap(name, config.work_dir)
+        if private:
+            # in-memory copy, only updated by the owner
+            self.bitmap = bytearray(self.bitmap_size)
+            read_only = False
+        else:
+            self.create_bitmap(name, config.work_dir)
         self.c_bitmap = (ctypes.c_uint8 * self.bitmap_size).from_buffer(self.bitmap)
         self.read_only = read_only
-        if not read_only:
+        # scratch space for native diff, allocated on first use
+        self.new_byte_idx = None
+        self.new_bit_idx = None
+        if not read_only and not private:
             self.flush_bitmap()
 
     def flush_bitmap(self):
@@ -41,23 +57,22 @@ class GlobalBitmap:
         self.bitmap = mmap.mmap(self.bitmap_fd, self.bitmap_size, mmap.MAP_SHARED, mmap.PROT_WRITE | mmap.PROT_READ)
 
     def get_new_byte_and_bit_counts(self, local_bitmap):
-        c_new_bitmap = local_bitmap.cbuffer
-        assert c_new_bitmap
-        if local_bitmap.is_lut_applied():
-            result = GlobalBitmap.bitmap_native_so.are_new_bits_present_no_apply_lut(self.c_bitmap, c_new_bitmap,
-                                                                                     ctypes.c_uint64(self.bitmap_size))
-        else:
-            result = GlobalBitmap.bitmap_native_so.are_new_bits_present_do_apply_lut(self.c_bitmap, c_new_bitmap,
-                                                                                     ctypes.c_uint64(self.bitmap_size))
-            local_bitmap.lut_applied = True
+        if local_bitmap.is_sparse():
+            new_bytes, new_bits = self.determine_new_bytes_sparse(local_bitmap)
+            return len(new_bytes), len(new_bits)
 
-        byte_count = result >> 32
-        bit_count = result & 0xFFFFFFFF
-        return byte_count, bit_count
+        assert local_bitmap.cbuffer
+        return local_bitmap.classify(self.c_bitmap)
 
     def get_new_byte_and_bit_offsets(self, local_bitmap):
         # TODO ensure that local_bitmap doesn't need a copy to increase performance
         # when working on a shared version, ensure that all subsequent tests on the bitmap get a properly bucketized bitmap (Trim, Redqueen etc)...
+        if local_bitmap.is_sparse():
+            new_bytes, new_bits = self.determine_new_bytes_sparse(local_bitmap)
+            if not new_bytes and not new_bits:
+                return None, None
+            return new_bytes, new_bits
+
         byte_count, bit_count = self.get_new_byte_and_bit_counts(local_bitmap)
 
         c_new_bitmap = local_bitmap.cbuffer
@@ -81,32 +96,138 @@ class GlobalBitmap:
         c_new_bitmap = new_bitmap.cbuffer
         return all([c_new_bitmap[index] == byteval for (index, byteval) in old_bits.items()])
 
+    def alloc_offset_buffers(self):
+        if not self.new_byte_idx:
+            self.new_byte_idx = (ctypes.c_uint32 * self.bitmap_size)()
+            self.new_bit_idx = (ctypes.c_uint32 * self.bitmap_size)()
+
     def determine_new_bytes(self, exec_result):
-        new_bytes = {}
-        new_bits = {}
         assert (len(exec_result) == len(self.c_bitmap))
-        for index in range(self.bitmap_size):
-            global_byte = self.c_bitmap[index]
-            local_byte = exec_result[index]
-            if (global_byte | local_byte) != global_byte:
-                if global_byte == 0:
-                    new_bytes[index] = local_byte
-                else:
-                    new_bits[index] = local_byte
+        self.alloc_offset_buffers()
+
+        result = GlobalBitmap.bitmap_native_so.bitmap_new_offsets(self.c_bitmap, exec_result,
+                                                                  ctypes.c_uint64(self.bitmap_size),
+                                                                  self.new_byte_idx, self.new_bit_idx)
+        byte_count = result >> 32
+        bit_count = result & 0xFFFFFFFF
+
+        new_bytes = {index: exec_result[index] for index in self.new_byte_idx[:byte_count]}
+        new_bits = {index: exec_result[index] for index in self.new_bit_idx[:bit_count]}
+        return new_bytes, new_bits
+
+    def determine_new_bytes_sparse(self, exec_result):
+        assert (exec_result.bitmap_size == self.bitmap_size)
+        self.alloc_offset_buffers()
+
+        result = GlobalBitmap.bitmap_native_so.sparse_new_offsets(self.c_bitmap,
+                                                                  exec_result.c_indices, exec_result.c_values,
+                                                                  ctypes.c_uint64(exec_result.num_entries),
+                                                                  ctypes.c_uint64(self.bitmap_size),
+                                                                  self.new_byte_idx, self.new_bit_idx)
+        byte_count = result >> 32
+        bit_count = result & 0xFFFFFFFF
+
+        # native code returns positions into the sparse arrays
+        indices = exec_result.c_indices
+        values = exec_result.c_values
+        new_bytes = {indices[pos]: values[pos] for pos in self.new_byte_idx[:byte_count]}
+        new_bits = {indices[pos]: values[pos] for pos in self.new_bit_idx[:bit_count]}
         return new_bytes, new_bits
 
     def update_with(self, exec_result):
         assert (not self.read_only)
+        if exec_result.is_sparse():
+            GlobalBitmap.bitmap_native_so.sparse_update_global_bitmap(self.c_bitmap,
+                                                                      exec_result.c_indices, exec_result.c_values,
+                                                                      ctypes.c_uint64(exec_result.num_entries),
+                                                                      ctypes.c_uint64(self.bitmap_size))
+            return
         GlobalBitmap.bitmap_native_so.update_global_bitmap(self.c_bitmap, exec_result.cbuffer,
                                                            ctypes.c_uint64(self.bitmap_size))
 
+    def update_sparse(self, indices, values):
+        # OR packed uint32 indices + uint8 values into bitmap
+        assert (not self.read_only)
+        num = len(values)
+        c_indices = (ctypes.c_uint32 * num).from_buffer_copy(indices)
+        c_values = (ctypes.c_uint8 * num).from_buffer_copy(values)
+        GlobalBitmap.bitmap_native_so.sparse_update_global_bitmap(self.c_bitmap, c_indices, c_values,
+                                                                  ctypes.c_uint64(num),
+                                                                  ctypes.c_uint64(self.bitmap_size))
+
+    def update_dense(self, data):
+        # OR full bitmap copy into bitmap
+        assert (not self.read_only)
+        assert (len(data) == self.bitmap_size)
+        c_data = (ctypes.c_uint8 * self.bitmap_size).from_buffer_copy(data)
+        GlobalBitmap.bitmap_native_so.update_global_bitmap(self.c_bitmap, c_data,
+                                                           ctypes.c_uint64(self.bitmap_size))
+
+
+class BitmapSyncLog:
+    """
+    Versioned log of global bitmap updates.
+
+    Version N means that the first N updates have been applied. A copy at
+    version N is brought up to date by OR-ing the delta records since N, or
+    a full snapshot if those records have already been dropped from the log.
+    Since bitmaps only ever gain bits, applying an update twice is harmless.
+    """
+
+    def __init__(self, max_records=SYNC_LOG_MAX):
+        self.records = deque()  # [exit_reason, packed uint32 indices, uint8 values]
+        self.max_records = max_records
+        self.base = 0           # version before the oldest record in the log
+        self.version = 0
+
+    def append(self, exit_reason, changes):
+        indices = array.array('I', changes.keys()).tobytes()
+        values = bytes(changes.values())
+        self.records.append([exit_reason, indices, values])
+        self.version += 1
+        if len(self.records) > self.max_records:
+            self.records.popleft()
+            self.base += 1
+
+    def delta(self, since):
+        # records to bring a copy from version since to current, None if too old
+        if since < self.base:
+            return None
+        return list(itertools.islice(self.records, since - self.base, None))
+
 
 class BitmapStorage:
-    def __init__(self, config, prefix, read_only=True):
-        self.normal_bitmap = GlobalBitmap(prefix + "_normal_bitmap", config, read_only)
-        self.crash_bitmap = GlobalBitmap(prefix + "_crash_bitmap", config, read_only)
-        self.kasan_bitmap = GlobalBitmap(prefix + "_kasan_bitmap", config, read_only)
-        self.timeout_bitmap = GlobalBitmap(prefix + "_timeout_bitmap", config, read_only)
+    def __init__(self, config, prefix, read_only=True, private=False):
+        self.normal_bitmap = GlobalBitmap(prefix + "_normal_bitmap", config, read_only, private)
+        self.crash_bitmap = GlobalBitmap(prefix + "_crash_bitmap", config, read_only, private)
+        self.kasan_bitmap = GlobalBitmap(prefix + "_kasan_bitmap", config, read_only, private)
+        self.timeout_bitmap = GlobalBitmap(prefix + "_timeout_bitmap", config, read_only, private)
+        self.private = private
+        self.version = 0
+        self.sync_log = None
+        if getattr(config, "bitmap_sync", False) and not read_only and not private:
+            self.sync_log = BitmapSyncLog()
+
+    def get_sync(self, since):
+        # bitmap update for a copy at version since, None if it is up to date
+        log = self.sync_log
+        if log is None or since == log.version:
+            return None
+        delta = log.delta(since)
+        if delta is not None:
+            return {"version": log.version, "delta": delta}
+        full = {exit_reason: bytes(self.get_bitmap_for_node_type(exit_reason).c_bitmap)
+                for exit_reason in ["regular", "timeout", "crash", "kasan"]}
+        return {"version": log.version, "full": full}
+
+    def apply_sync(self, sync):
+        if "full" in sync:
+            for exit_reason, data in sync["full"].items():
+                self.get_bitmap_for_node_type(exit_reason).update_dense(data)
+        else:
+            for exit_reason, indices, values in sync["delta"]:
+                self.get_bitmap_for_node_type(exit_reason).update_sparse(indices, values)
+        self.version = sync["version"]
 
     def get_bitmap_for_node_type(self, exit_reason):
         if exit_reason == "regular":
@@ -143,5 +264,9 @@ class BitmapStorage:
         accepted = self.check_storage_logic(exec_result, new_bytes, new_bits)
         if accepted:
             relevant_bitmap.update_with(exec_result)
+            if self.sync_log is not None:
+                changes = dict(new_bytes or {})
+                changes.update(new_bits or {})
+                self.sync_log.append(exec_result.exit_reason, changes)
 
         return accepted, new_bytes, new_bits
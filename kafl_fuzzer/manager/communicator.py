@@ -5,13 +5,22 @@
 
 """
 Abstractions for kAFL Manager/Worker communicaton.
+
+Messages are msgpack-encoded and framed with a 4-byte length prefix. The
+Manager multiplexes all Worker connections with a selector (epoll on Linux).
+Local Workers connect via AF_UNIX socket in the workdir. Remote Workers and
+relays (see relay.py) connect via TCP.
 """
 
-import select
+import os
+import socket
+import struct
+import itertools
+import selectors
 
 import logging
 import msgpack
-from multiprocessing.connection import Listener, Client
+from collections import OrderedDict
 
 MSG_READY = 0
 MSG_IMPORT = 1
@@ -20,70 +29,324 @@ MSG_NODE_DONE = 3
 MSG_NODE_ABORT = 6
 MSG_NEW_INPUT = 4
 MSG_BUSY = 5
+MSG_NEW_INPUT_SPARSE = 7
 
 KAFL_NAMED_SOCKET = '/kafl_socket'
 
+FRAME_HDR = struct.Struct("<I")
+RECV_SIZE = 1 << 16
+
+
+def parse_address(address):
+    # <host>:<port> for TCP, anything else is a path to an AF_UNIX socket
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return socket.AF_INET, (host or "0.0.0.0", int(port))
+    return socket.AF_UNIX, address
+
+def create_socket(family):
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class FramedConnection:
+    """
+    Length-prefixed message framing over a stream socket.
+
+    Sends are blocking, unless the connection is served by a ServerConnection.
+    Those queue outgoing frames with queue_bytes() and write them with flush()
+    whenever the selector reports the socket as writable. recv_frames()
+    performs a single recv() and returns all messages completed by it, so it
+    can be used after a selector reports the socket as readable.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.pending = bytearray()    # queued frames not yet accepted by the socket
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+
+    def send_bytes(self, data):
+        self.sock.sendall(FRAME_HDR.pack(len(data)) + data)
+
+    def queue_bytes(self, data):
+        self.pending += FRAME_HDR.pack(len(data))
+        self.pending += data
+
+    def flush(self):
+        # write queued frames without blocking, returns False if some are left
+        while self.pending:
+            try:
+                sent = self.sock.send(self.pending)
+            except BlockingIOError:
+                return False
+            del self.pending[:sent]
+        return True
+
+    def recv_frames(self):
+        try:
+            data = self.sock.recv(RECV_SIZE)
+        except BlockingIOError:
+            return []
+        if not data:
+            raise EOFError("Connection closed by peer")
+        self.buffer += data
+
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HDR.size:
+            length, = FRAME_HDR.unpack_from(self.buffer, offset)
+            if len(self.buffer) - offset - FRAME_HDR.size < length:
+                break
+            offset += FRAME_HDR.size
+            frames.append(bytes(self.buffer[offset:offset+length]))
+            offset += length
+        del self.buffer[:offset]
+        return frames
+
+    def recv_bytes(self):
+        # blocking receive of exactly one message
+        while True:
+            if len(self.buffer) >= FRAME_HDR.size:
+                length, = FRAME_HDR.unpack_from(self.buffer)
+                end = FRAME_HDR.size + length
+                if len(self.buffer) >= end:
+                    data = bytes(self.buffer[FRAME_HDR.size:end])
+                    del self.buffer[:end]
+                    return data
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionResetError("Connection closed by peer")
+            self.buffer += data
+
+
+class PayloadCache:
+    """
+    LRU of node payloads held by a Worker, keyed by (node ID, payload version).
+
+    The Manager keeps a mirror of each Worker's cache, without the payloads, to
+    decide if a payload must be sent inline with the next task. Both sides apply
+    the same sequence of lookups and inserts, so the mirror stays in sync.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def lookup(self, key):
+        value = self.entries.get(key, None)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def insert(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
 class ServerConnection:
     def __init__(self, config):
-        Listener.fileno = lambda self: self._listener._socket.fileno()
-        self.address = config.work_dir + KAFL_NAMED_SOCKET
-        self.listener = Listener(self.address, 'AF_UNIX', backlog=1000)
-        self.clients = [self.listener]
+        self.selector = selectors.DefaultSelector()
+        self.listeners = []
+        self.listen(config.work_dir + KAFL_NAMED_SOCKET)
+        if getattr(config, "manager_listen", None):
+            self.listen(config.manager_listen)
+
+        self.clients = set()
         self.clients_seen = 0
+        self.disconnected = []
+        self.payload_cache_size = config.node_cache
+        self.payload_cache_sizes = dict()
+        self.payload_caches = dict()
+        self.bitmap_storage = None    # set to attach bitmap updates to tasks
+        self.bitmap_versions = dict()
+        self.splice_ids = None        # set to a bounded deque to attach new regular node IDs to tasks
+        self.splice_count = 0
+        self.splice_sent = dict()
+        self.splice_payload = None    # set to read splice payloads for remote Workers
+        self.remote_clients = set()
         self.logger = logging.getLogger(__name__)
 
+    def listen(self, address):
+        family, addr = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)
+        listener = create_socket(family)
+        if family == socket.AF_INET:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(addr)
+        listener.listen(1000)
+        self.selector.register(listener, selectors.EVENT_READ)
+        self.listeners.append(listener)
+        return listener
+
+    def add_connection(self, conn):
+        # additional connection to be served by wait(), e.g. upstream to a central Manager
+        self.register(conn)
+
+    def register(self, conn):
+        # all sends are queued and written from wait(), so a slow peer cannot block us
+        conn.sock.setblocking(False)
+        self.selector.register(conn, selectors.EVENT_READ)
+
+    def send_bytes(self, conn, data):
+        if conn.closed:
+            return
+        conn.queue_bytes(data)
+        try:
+            self.flush(conn)
+        except IOError:
+            # connection is dropped by wait(), once the error is reported by recv
+            conn.pending.clear()
+
+    def flush(self, conn):
+        events = selectors.EVENT_READ
+        if not conn.flush():
+            events |= selectors.EVENT_WRITE
+        if self.selector.get_key(conn).events != events:
+            self.selector.modify(conn, events)
+
+    def drop(self, client):
+        self.selector.unregister(client)
+        client.close()
+        if client not in self.clients:
+            raise SystemExit("Lost connection to Manager.")
+        self.clients.remove(client)
+        self.payload_caches.pop(client, None)
+        self.payload_cache_sizes.pop(client, None)
+        self.bitmap_versions.pop(client, None)
+        self.splice_sent.pop(client, None)
+        self.remote_clients.discard(client)
+        self.disconnected.append(client)
+        self.logger.info("Worker disconnected (remaining %d/%d)." % (len(self.clients), self.clients_seen))
+        if len(self.clients) == 0:
+            raise SystemExit("All Workers exited.")
+
     def wait(self, timeout=None):
         results = []
-        r, w, e = select.select(self.clients, (), (), timeout)
-        for sock_ready in r:
-            if sock_ready == self.listener:
-                c = self.listener.accept()
-                self.clients.append(c)
+        for key, events in self.selector.select(timeout):
+            if key.fileobj in self.listeners:
+                sock, _ = key.fileobj.accept()
+                if sock.family == socket.AF_INET:
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                client = FramedConnection(sock)
+                self.register(client)
+                self.clients.add(client)
                 self.clients_seen += 1
-            else:
-                try:
-                    msg = sock_ready.recv_bytes()
-                    msg = msgpack.unpackb(msg, strict_map_key=False)
-                    results.append((sock_ready, msg))
-                except (EOFError, IOError):
-                    sock_ready.close()
-                    self.clients.remove(sock_ready)
-                    self.logger.info("Worker disconnected (remaining %d/%d)." % (len(self.clients)-1, self.clients_seen))
-                    if len(self.clients) == 1:
-                        raise SystemExit("All Workers exited.")
+                continue
+
+            client = key.fileobj
+            if client.closed:
+                continue
+            try:
+                if events & selectors.EVENT_WRITE:
+                    self.flush(client)
+                if events & selectors.EVENT_READ:
+                    for msg in client.recv_frames():
+                        results.append((client, msgpack.unpackb(msg, strict_map_key=False)))
+            except (EOFError, IOError):
+                self.drop(client)
         return results
 
+    def send_task(self, client, msg):
+        # bring the Worker's bitmap copy up to date along with every task
+        if self.bitmap_storage:
+            sync = self.bitmap_storage.get_sync(self.bitmap_versions.get(client, 0))
+            if sync:
+                msg["bitmap_sync"] = sync
+                self.bitmap_versions[client] = sync["version"]
+        # same for the Worker's pool of splice partners
+        if self.splice_ids is not None:
+            # only the newest IDs are kept, older ones are skipped for Workers lagging behind
+            new = min(self.splice_count - self.splice_sent.get(client, 0), len(self.splice_ids))
+            if new > 0:
+                msg["splice_ids"] = list(itertools.islice(self.splice_ids, len(self.splice_ids) - new, None))
+                if client in self.remote_clients and self.splice_payload:
+                    msg["splice_payloads"] = [self.splice_payload(nid) for nid in msg["splice_ids"]]
+                self.splice_sent[client] = self.splice_count
+        self.send_bytes(client, msgpack.packb(msg))
+
+    def add_splice_id(self, nid):
+        self.splice_ids.append(nid)
+        self.splice_count += 1
+
     def send_import(self, client, task_data):
-        client.send_bytes(msgpack.packb({"type": MSG_IMPORT, "task": task_data}))
+        self.send_task(client, {"type": MSG_IMPORT, "task": task_data})
+
+    def set_payload_cache(self, client, size):
+        # Workers announce their PayloadCache size, e.g. remote Workers using the relay's config
+        if size is not None:
+            self.payload_cache_sizes.setdefault(client, size)
+
+    def set_remote(self, client, remote):
+        # remote Workers have no access to our workdir
+        if remote:
+            self.remote_clients.add(client)
+
+    def wants_inline(self, client):
+        return self.payload_cache_sizes.get(client, self.payload_cache_size) > 0
+
+    def worker_has_payload(self, client, key):
+        # check and update mirror of the Worker's PayloadCache
+        cache = self.payload_caches.get(client, None)
+        if cache is None:
+            size = self.payload_cache_sizes.get(client, self.payload_cache_size)
+            cache = self.payload_caches[client] = PayloadCache(size)
+        if cache.lookup(key):
+            return True
+        cache.insert(key, True)
+        return False
 
     def send_node(self, client, task_data):
-        client.send_bytes(msgpack.packb({"type": MSG_RUN_NODE, "task": task_data}))
+        self.send_task(client, {"type": MSG_RUN_NODE, "task": task_data})
 
     def send_busy(self, client):
-        client.send_bytes(msgpack.packb({"type": MSG_BUSY}))
+        self.send_task(client, {"type": MSG_BUSY})
 
 
 class ClientConnection:
-    def __init__(self, pid, config):
+    def __init__(self, pid, config, address=None):
         self.pid = pid
-        self.address = config.work_dir + KAFL_NAMED_SOCKET
+        self.address = address or config.work_dir + KAFL_NAMED_SOCKET
+        self.node_cache = config.node_cache
+        self.remote = bool(getattr(config, "relay", None))
         self.sock = self.connect()
 
     def connect(self):
-        sock = Client(self.address, 'AF_UNIX')
-        return sock
+        family, addr = parse_address(self.address)
+        sock = create_socket(family)
+        sock.connect(addr)
+        return FramedConnection(sock)
 
     def recv(self):
         data = self.sock.recv_bytes()
         return msgpack.unpackb(data, strict_map_key=False)
 
     def send_ready(self):
-        self.sock.send_bytes(msgpack.packb({"type": MSG_READY, "worker_id": self.pid}))
+        self.sock.send_bytes(msgpack.packb({"type": MSG_READY, "worker_id": self.pid, "node_cache": self.node_cache,
+                                            "remote": self.remote}))
 
     def send_new_input(self, data, bitmap, info):
         self.sock.send_bytes(msgpack.packb(
             {"type": MSG_NEW_INPUT, "input": {"payload": data, "bitmap": bitmap, "info": info}}))
 
+    def send_new_input_sparse(self, data, indices, values, bitmap_size, info):
+        # bitmap as packed uint32 indices + uint8 values of its non-zero entries
+        self.sock.send_bytes(msgpack.packb(
+            {"type": MSG_NEW_INPUT_SPARSE, "input": {"payload": data, "indices": indices, "values": values,
+                                                     "bitmap_size": bitmap_size, "info": info}}))
+
     def send_node_done(self, node_id, results, new_payload):
         self.sock.send_bytes(msgpack.packb(
             {"type": MSG_NODE_DONE, "node_id": node_id, "results": results, "new_payload": new_payload}))
@@ -8,7 +8,8 @@ Startup routines for kAFL Fuzzer.
 
 Spawn a Manager and one or more Worker processes, where Manager implements the
 global fuzzing queue and scheduler and Workers implement mutation stages and
-Qemu/KVM execution.
+Qemu/KVM execution. With --relay, a RelayTask connects the Workers of this host
+to the Manager on another host instead.
 
 Prepare the kAFL workdir and copy any provided seeds to be picked up by the scheduler.
 """
@@ -24,6 +25,8 @@ from kafl_fuzzer.common.self_check import post_self_check
 from kafl_fuzzer.common.util import prepare_working_dir, copy_seed_files, qemu_sweep, filter_available_cpus
 from kafl_fuzzer.common.logger import setup_logging
 from kafl_fuzzer.manager.manager import ManagerTask
+from kafl_fuzzer.manager.relay import RelayTask
+from kafl_fuzzer.worker.startup import LaunchCoordinator
 from kafl_fuzzer.worker.worker import worker_loader
 
 logger = logging.getLogger(__name__)
@@ -89,7 +92,22 @@ def start(config):
     elif not config.cpu_offset:
         os.sched_setaffinity(0, avail-used)
 
-    manager = ManagerTask(config)
+    if config.corpus_store and not config.splice_cache:
+        # without corpus files, splice partners and Radamsa samples are only found via node IDs
+        logger.error("Corpus store requires --splice-cache > 0. Exit.")
+        return 1
+
+    if config.relay:
+        # remote Workers depend on node/payload data sent with each task
+        if not config.node_cache:
+            logger.error("Relay mode requires --node-cache > 0. Exit.")
+            return 1
+        manager = RelayTask(config)
+    else:
+        manager = ManagerTask(config)
+
+    # Worker 0 signals when its snapshot is ready for the others to load
+    LaunchCoordinator.reset(work_dir)
 
     workers = []
     for i in range(num_worker):
@@ -103,6 +121,7 @@ def start(config):
     except SystemExit as e:
         logger.info("Manager exit: " + str(e))
     finally:
+        manager.shutdown()
         graceful_exit(workers)
 
     time.sleep(1)
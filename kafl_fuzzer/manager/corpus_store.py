@@ -0,0 +1,206 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Log-structured storage for node payloads and metadata.
+
+Instead of creating one file per payload and metadata update, records are
+appended to a few large segment files. An index file, mapped into memory by
+the Manager and all Workers, holds the location of the latest payload and
+metadata record of each node ID. The Manager is the only writer.
+
+Use export() or scripts/kafl_export.py to convert the store back into the
+classic corpus/ and metadata/ layout expected by other tools.
+"""
+
+import os
+import glob
+import mmap
+import struct
+import logging
+
+import msgpack
+
+from kafl_fuzzer.common.util import atomic_write
+
+logger = logging.getLogger(__name__)
+
+KIND_PAYLOAD = 0
+KIND_METADATA = 1
+
+RECORD_MAGIC = 0x6b41464c
+RECORD_HDR = struct.Struct("<IIII")        # magic, node ID, kind, length
+INDEX_ENTRY = struct.Struct("<IQIIQI")     # (segment, offset, length) for payload and metadata
+INDEX_GROW = 16384                         # grow index by this number of entries
+SEGMENT_MAX = 256 << 20
+
+
+class CorpusStore:
+
+    def __init__(self, workdir, read_only=True):
+        self.path = workdir + "/corpus/store"
+        self.index_path = self.path + "/index"
+        self.read_only = read_only
+        self.segments = dict()   # segment number => fd
+        self.index = None
+        self.index_fd = None
+        self.index_entries = 0
+        self.segment = 0
+        self.segment_offset = 0
+
+        if not read_only:
+            os.makedirs(self.path, exist_ok=True)
+            rebuild = not os.path.exists(self.index_path)
+            self.index_fd = os.open(self.index_path, os.O_RDWR | os.O_CREAT, 0o644)
+            self.__map_index(0)
+            if rebuild:
+                self.rebuild_index()
+            # never append after a possibly truncated record
+            self.__open_next_segment()
+
+    @staticmethod
+    def __segment_filename(path, segment):
+        return "%s/segment_%04d" % (path, segment)
+
+    def __list_segments(self):
+        segments = []
+        for name in glob.glob(self.path + "/segment_*"):
+            segments.append(int(name.rsplit("_", 1)[1]))
+        return sorted(segments)
+
+    def __segment_fd(self, segment):
+        fd = self.segments.get(segment, None)
+        if fd is None:
+            fd = os.open(CorpusStore.__segment_filename(self.path, segment), os.O_RDONLY)
+            self.segments[segment] = fd
+        return fd
+
+    def __open_next_segment(self):
+        segments = self.__list_segments()
+        self.segment = (segments[-1] if segments else 0) + 1
+        self.segment_offset = 0
+        fd = os.open(CorpusStore.__segment_filename(self.path, self.segment),
+                     os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segments[self.segment] = fd
+
+    def __map_index(self, min_entries):
+        # (re-)map index large enough to hold min_entries
+        if self.index_fd is None:
+            if not os.path.exists(self.index_path):
+                return False
+            self.index_fd = os.open(self.index_path, os.O_RDONLY)
+
+        size = os.fstat(self.index_fd).st_size
+        if size < min_entries * INDEX_ENTRY.size:
+            if self.read_only:
+                return False
+            entries = (min_entries // INDEX_GROW + 1) * INDEX_GROW
+            size = entries * INDEX_ENTRY.size
+            os.ftruncate(self.index_fd, size)
+
+        if size == 0:
+            return False
+
+        if self.index:
+            self.index.close()
+        access = mmap.ACCESS_READ if self.read_only else mmap.ACCESS_WRITE
+        self.index = mmap.mmap(self.index_fd, size, access=access)
+        self.index_entries = size // INDEX_ENTRY.size
+        return True
+
+    def __get_entry(self, node_id):
+        if node_id >= self.index_entries:
+            if not self.__map_index(node_id + 1):
+                return (0, 0, 0, 0, 0, 0)
+        return INDEX_ENTRY.unpack_from(self.index, node_id * INDEX_ENTRY.size)
+
+    def __set_location(self, node_id, kind, segment, offset, length):
+        if node_id >= self.index_entries:
+            self.__map_index(node_id + 1)
+        entry = list(INDEX_ENTRY.unpack_from(self.index, node_id * INDEX_ENTRY.size))
+        entry[3*kind:3*kind+3] = (segment, offset, length)
+        INDEX_ENTRY.pack_into(self.index, node_id * INDEX_ENTRY.size, *entry)
+
+    def __append(self, node_id, kind, data):
+        assert not self.read_only, "Attempt to write to read-only corpus store"
+        if self.segment_offset > SEGMENT_MAX:
+            self.__open_next_segment()
+
+        offset = self.segment_offset
+        record = RECORD_HDR.pack(RECORD_MAGIC, node_id, kind, len(data)) + data
+        os.write(self.segments[self.segment], record)
+        self.segment_offset += len(record)
+
+        # update index only after the record is complete
+        self.__set_location(node_id, kind, self.segment, offset, len(data))
+
+    def __read(self, node_id, kind):
+        # Manager may update the index concurrently - retry on torn entries
+        for _ in range(8):
+            segment, offset, length = self.__get_entry(node_id)[3*kind:3*kind+3]
+            if segment == 0:
+                raise KeyError("No %s for node %d in corpus store" %
+                               ("payload" if kind == KIND_PAYLOAD else "metadata", node_id))
+            record = os.pread(self.__segment_fd(segment), RECORD_HDR.size + length, offset)
+            if len(record) == RECORD_HDR.size + length and \
+               RECORD_HDR.unpack_from(record) == (RECORD_MAGIC, node_id, kind, length):
+                return record[RECORD_HDR.size:]
+        raise IOError("Corrupt corpus store record for node %d" % node_id)
+
+    def write_payload(self, node_id, payload):
+        self.__append(node_id, KIND_PAYLOAD, payload)
+
+    def write_metadata(self, node_id, data):
+        self.__append(node_id, KIND_METADATA, data)
+
+    def read_payload(self, node_id):
+        return self.__read(node_id, KIND_PAYLOAD)
+
+    def read_metadata(self, node_id):
+        return self.__read(node_id, KIND_METADATA)
+
+    def node_ids(self):
+        self.__map_index(self.index_entries)
+        for node_id in range(self.index_entries):
+            if self.__get_entry(node_id)[3] != 0:
+                yield node_id
+
+    def rebuild_index(self):
+        # recover index from segments, e.g. after the index file was lost
+        num_records = 0
+        for segment in self.__list_segments():
+            fd = self.__segment_fd(segment)
+            size = os.fstat(fd).st_size
+            offset = 0
+            while offset + RECORD_HDR.size <= size:
+                magic, node_id, kind, length = RECORD_HDR.unpack(os.pread(fd, RECORD_HDR.size, offset))
+                if magic != RECORD_MAGIC or offset + RECORD_HDR.size + length > size:
+                    logger.warning("Skipping truncated record at %s:%d" %
+                                   (CorpusStore.__segment_filename(self.path, segment), offset))
+                    break
+                self.__set_location(node_id, kind, segment, offset, length)
+                offset += RECORD_HDR.size + length
+                num_records += 1
+        if num_records:
+            logger.info("Rebuilt corpus store index from %d records." % num_records)
+
+    def sync(self):
+        if self.read_only:
+            return
+        os.fsync(self.segments[self.segment])
+        self.index.flush()
+
+    def export(self, workdir):
+        # write classic corpus/<exit>/payload_N and metadata/node_N layout
+        num_nodes = 0
+        for node_id in self.node_ids():
+            data = self.read_metadata(node_id)
+            exit_reason = msgpack.unpackb(data, strict_map_key=False)["info"]["exit_reason"]
+            os.makedirs("%s/corpus/%s" % (workdir, exit_reason), exist_ok=True)
+            os.makedirs("%s/metadata" % workdir, exist_ok=True)
+            atomic_write("%s/corpus/%s/payload_%05d" % (workdir, exit_reason, node_id),
+                         self.read_payload(node_id))
+            atomic_write("%s/metadata/node_%05d" % (workdir, node_id), data)
+            num_nodes += 1
+        return num_nodes
@@ -0,0 +1,155 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Distribute the deterministic stage of large nodes across Workers.
+
+Each sub-stage of the deterministic stage is cut into offset ranges of
+shard_size bytes, which are handed out to any Worker asking for work ahead
+of the regular queue. The node stays busy until all shards of its last
+sub-stage are done, and the accumulated Worker results are then reported
+to the queue as a single update.
+
+Shards that a Worker could not finish within its stage timeout come back
+with an updated offset cursor, and the remainder is handed out again. The
+effector map built by flip_8/1 shards is merged here before moving on.
+"""
+
+import itertools
+from collections import deque
+
+from kafl_fuzzer.manager.node import QueueNode
+from kafl_fuzzer.technique import deterministic
+
+
+class DetShards:
+
+    def __init__(self, config, shard_size):
+        self.config = config
+        self.shard_size = max(1, shard_size)
+        self.nodes = dict()      # node ID => progress of nodes being sharded
+        self.pending = deque()   # (node, shard) not yet handed out
+        self.serial = itertools.count(1)
+
+    @staticmethod
+    def is_shard(results):
+        return results is not None and "end" in results.get("afl_det_info", {})
+
+    def split(self, node):
+        # take over deterministic stage of large nodes, returns False for all others
+        if self.config.afl_dumb_mode or node.get_state() != "deterministic":
+            return False
+        payload_len = node.get_payload_len()
+        if payload_len <= self.shard_size:
+            return False
+        det_info = deterministic.resume_info(node.data.get("afl_det_info", None))
+        if det_info["stage"] == "done":
+            return False
+
+        progress = {"node": node,
+                    "serial": next(self.serial),
+                    "det_info": det_info,
+                    "limiter_map": deterministic.create_limiter_map(self.config, payload_len),
+                    "outstanding": 0,
+                    "results": dict()}
+        if det_info["stage"] == "flip_8/1":
+            self.init_effector_map(progress)
+        self.nodes[node.get_id()] = progress
+        self.add_stage(progress)
+        return True
+
+    def abort(self, nid, results):
+        # Worker died while processing a shard, hand out the shard again
+        progress = self.release(nid, results.pop("afl_det_info"))
+        if progress:
+            progress["results"] = QueueNode.apply_metadata_update(progress["results"], results)
+
+    def release(self, nid, shard):
+        # shard will not be completed, e.g. Worker disconnected - hand it out again
+        progress = self.nodes.get(nid, None)
+        if not progress or progress["serial"] != shard["serial"]:
+            return None
+        progress["outstanding"] -= 1
+        self.add_shard(progress, shard["offset"], shard["end"])
+        return progress
+
+    def next(self):
+        # next shard to hand out as (node, shard info), or None
+        while self.pending:
+            node, shard = self.pending.popleft()
+            progress = self.nodes.get(node.get_id(), None)
+            if progress and progress["serial"] == shard["serial"]:
+                # pass on effector map baseline once reported by any shard
+                if shard["stage"] == "flip_8/1" and "eff_base" in progress["det_info"]:
+                    shard["eff_base"] = progress["det_info"]["eff_base"]
+                return node, shard
+        return None
+
+    def init_effector_map(self, progress):
+        det_info = progress["det_info"]
+        if deterministic.use_effector_map(self.config, progress["node"].get_payload_len()):
+            det_info["eff_map"] = bytearray(det_info.get("eff_map", progress["limiter_map"]))
+
+    def add_shard(self, progress, start, end):
+        det_info = progress["det_info"]
+        shard = {"stage": det_info["stage"],
+                 "serial": progress["serial"],
+                 "start": start,
+                 "offset": start,
+                 "end": end}
+        # Workers building the effector map start from their limiter map
+        if "eff_map" in det_info and det_info["stage"] != "flip_8/1":
+            shard["eff_map"] = det_info["eff_map"]
+        self.pending.append((progress["node"], shard))
+        progress["outstanding"] += 1
+
+    def add_stage(self, progress):
+        # hand out remaining offsets of current sub-stage, or move on to the next one
+        det_info = progress["det_info"]
+        payload_len = progress["node"].get_payload_len()
+        while det_info["stage"] != "done" and det_info["offset"] >= payload_len:
+            if det_info["stage"] == "flip_8/1":
+                deterministic.finish_effector_map(det_info, progress["limiter_map"])
+                det_info.pop("eff_base", None)
+            det_info["stage"] = deterministic.next_stage(det_info["stage"])
+            det_info["offset"] = 0
+            if det_info["stage"] == "flip_8/1":
+                self.init_effector_map(progress)
+        if det_info["stage"] == "done":
+            return
+
+        for start in range(det_info["offset"], payload_len, self.shard_size):
+            self.add_shard(progress, start, min(payload_len, start + self.shard_size))
+        det_info["offset"] = payload_len
+
+    def complete(self, nid, results):
+        # account shard results, returns combined results once the deterministic stage is done
+        progress = self.nodes.get(nid, None)
+        shard = results.pop("afl_det_info")
+        if not progress or progress["serial"] != shard["serial"]:
+            return None
+
+        det_info = progress["det_info"]
+        if "eff_base" in shard and det_info["stage"] == "flip_8/1":
+            det_info.setdefault("eff_base", shard["eff_base"])
+        if "eff_map" in det_info and "eff_map" in shard:
+            det_info["eff_map"][shard["start"]:shard["offset"]] = shard["eff_map"][shard["start"]:shard["offset"]]
+        progress["results"] = QueueNode.apply_metadata_update(progress["results"], results)
+        progress["outstanding"] -= 1
+
+        if shard["offset"] < shard["end"]:
+            # Worker ran out of time, hand out the remainder
+            self.add_shard(progress, shard["offset"], shard["end"])
+        if progress["outstanding"] == 0:
+            self.add_stage(progress)
+        if progress["outstanding"] > 0:
+            return None
+
+        del self.nodes[nid]
+        results = progress["results"]
+        results["state"] = {"name": "havoc"}
+        results["afl_det_info"] = {"stage": "done", "offset": 0}
+        if "eff_map" in det_info:
+            results["afl_det_info"]["eff_map"] = det_info["eff_map"]
+        return results
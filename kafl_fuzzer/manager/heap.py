@@ -0,0 +1,91 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Indexed max-heap used to keep the fuzzing queue ordered by scheduler priority.
+
+Entries are identified by a key (the node ID) so that their priority can be
+updated or removed in O(log n) when the node changes, instead of re-sorting
+the full queue.
+"""
+
+
+class IndexedHeap:
+
+    def __init__(self):
+        self.heap = []  # list of [prio, key]
+        self.pos = {}   # key => index into self.heap
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key):
+        return key in self.pos
+
+    def push(self, key, prio):
+        if key in self.pos:
+            return self.update(key, prio)
+        self.heap.append([prio, key])
+        self.pos[key] = len(self.heap) - 1
+        self.__sift_up(len(self.heap) - 1)
+
+    def update(self, key, prio):
+        idx = self.pos[key]
+        old_prio = self.heap[idx][0]
+        self.heap[idx][0] = prio
+        if prio > old_prio:
+            self.__sift_up(idx)
+        elif prio < old_prio:
+            self.__sift_down(idx)
+
+    def peek(self):
+        return self.heap[0][1] if self.heap else None
+
+    def pop(self):
+        if not self.heap:
+            return None
+        key = self.heap[0][1]
+        self.remove(key)
+        return key
+
+    def remove(self, key):
+        idx = self.pos.pop(key)
+        last = self.heap.pop()
+        if idx == len(self.heap):
+            return
+        self.heap[idx] = last
+        self.pos[last[1]] = idx
+        self.__sift_up(idx)
+        self.__sift_down(self.pos[last[1]])
+
+    def __swap(self, i, j):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.pos[heap[i][1]] = i
+        self.pos[heap[j][1]] = j
+
+    def __sift_up(self, idx):
+        heap = self.heap
+        while idx > 0:
+            parent = (idx - 1) >> 1
+            if heap[idx][0] <= heap[parent][0]:
+                break
+            self.__swap(idx, parent)
+            idx = parent
+
+    def __sift_down(self, idx):
+        heap = self.heap
+        size = len(heap)
+        while True:
+            largest = idx
+            left = 2*idx + 1
+            right = left + 1
+            if left < size and heap[left][0] > heap[largest][0]:
+                largest = left
+            if right < size and heap[right][0] > heap[largest][0]:
+                largest = right
+            if largest == idx:
+                break
+            self.__swap(idx, largest)
+            idx = largest
@@ -17,14 +17,18 @@ import mmh3
 import shutil
 import msgpack
 import lz4.frame as lz4
+from collections import deque
 
 from kafl_fuzzer.common.util import read_binary_file
 from kafl_fuzzer.manager.communicator import ServerConnection
-from kafl_fuzzer.manager.communicator import MSG_NODE_DONE, MSG_NEW_INPUT, MSG_READY, MSG_NODE_ABORT
+from kafl_fuzzer.manager.communicator import MSG_NODE_DONE, MSG_NEW_INPUT, MSG_NEW_INPUT_SPARSE, MSG_READY, MSG_NODE_ABORT
 from kafl_fuzzer.manager.queue import InputQueue
 from kafl_fuzzer.manager.statistics import ManagerStatistics
+from kafl_fuzzer.manager.timeout import TimeoutModel
+from kafl_fuzzer.manager.det_shards import DetShards
 from kafl_fuzzer.manager.bitmap import BitmapStorage
-from kafl_fuzzer.manager.node import QueueNode
+from kafl_fuzzer.manager.node import QueueNode, MetadataStore
+from kafl_fuzzer.manager.corpus_store import CorpusStore
 from kafl_fuzzer.technique.redqueen.cmp import redqueen_global_config
 from kafl_fuzzer.worker.execution_result import ExecutionResult
 
@@ -39,11 +43,36 @@ class ManagerTask:
         self.comm = ServerConnection(self.config)
 
         self.busy_events = 0
+        self.tasks_pending = dict()
+        self.nodes_pending = dict()   # conn => [(node ID, det shard)] sent but not yet done
         self.empty_hash = mmh3.hash(("\x00" * config.bitmap_size), signed=False)
 
+        self.corpus_store = None
+        if config.corpus_store:
+            self.corpus_store = CorpusStore(config.work_dir, read_only=False)
+            QueueNode.corpus_store = self.corpus_store
+
+        self.metadata_store = None
+        if config.meta_flush:
+            self.metadata_store = MetadataStore(config.work_dir, config.meta_flush)
+            QueueNode.metadata_store = self.metadata_store
+
         self.statistics = ManagerStatistics(config)
         self.queue = InputQueue(self.config, self.statistics)
         self.bitmap_storage = BitmapStorage(config, "main", read_only=False)
+        if config.bitmap_sync:
+            self.comm.bitmap_storage = self.bitmap_storage
+        self.comm.splice_ids = deque(maxlen=config.splice_cache)
+        self.comm.splice_payload = self.get_splice_payload
+
+        self.timeout_model = None
+        if config.t_quantile:
+            self.timeout_model = TimeoutModel(config.timeout_soft, config.timeout_hard,
+                                              quantile=config.t_quantile)
+
+        self.det_shards = None
+        if config.det_shard:
+            self.det_shards = DetShards(config, config.det_shard)
 
         helper_init()
 
@@ -58,7 +87,37 @@ class ManagerTask:
             fd.write(msgpack.packb(vars(self.config)))
 
 
-    def send_next_task(self, conn):
+    def send_node_inline(self, conn, node, det_shard=None):
+        # node_struct does not include fav_bits, which are not used by Workers
+        node_struct = node.node_struct
+        task = {"type": "node",
+                "nid": node.get_id(),
+                "version": node.payload_version,
+                "node": node_struct}
+        if self.timeout_model:
+            task["timeout"] = self.timeout_model.node_timeout(node.get_performance())
+        if det_shard:
+            task["det_shard"] = det_shard
+        if not self.comm.worker_has_payload(conn, (node.get_id(), node.payload_version)):
+            task["payload"] = QueueNode.get_payload(self.config.work_dir, node_struct)
+        return self.comm.send_node(conn, task)
+
+    def send_node(self, conn, node, det_shard=None):
+        self.nodes_pending.setdefault(conn, []).append((node.get_id(), det_shard))
+        if self.comm.wants_inline(conn):
+            return self.send_node_inline(conn, node, det_shard)
+        # Worker reads node metadata from disk
+        if self.metadata_store:
+            self.metadata_store.flush_node(node.get_id())
+        task = {"type": "node", "nid": node.get_id()}
+        if self.timeout_model:
+            task["timeout"] = self.timeout_model.node_timeout(node.get_performance())
+        if det_shard:
+            task["det_shard"] = det_shard
+        return self.comm.send_node(conn, task)
+
+    def send_next_task(self, conn, allow_busy=True):
+        # Returns False if there was no work and a busy message was not allowed.
         # Inputs placed to imports/ folder have priority.
         # This can also be used to inject additional seeds at runtime.
         imports = glob.glob(self.config.work_dir + "/imports/*")
@@ -67,11 +126,25 @@ class ManagerTask:
             logger.debug("Importing payload from %s" % path)
             seed = read_binary_file(path)
             os.remove(path)
-            return self.comm.send_import(conn, {"type": "import", "payload": seed})
+            self.comm.send_import(conn, {"type": "import", "payload": seed})
+            return True
+        # Shards of deterministic stages in progress come next..
+        if self.det_shards:
+            shard = self.det_shards.next()
+            if shard:
+                self.send_node(conn, *shard)
+                return True
         # Process items from queue..
         node = self.queue.get_next()
         if node:
-            return self.comm.send_node(conn, {"type": "node", "nid": node.get_id()})
+            if self.det_shards and self.det_shards.split(node):
+                self.send_node(conn, *self.det_shards.next())
+                return True
+            self.send_node(conn, node)
+            return True
+
+        if not allow_busy:
+            return False
 
         # No work in queue. Tell Worker to wait a little or attempt blind fuzzing.
         # If all Workers are waiting, check if we are getting any coverage..
@@ -82,6 +155,35 @@ class ManagerTask:
             main_bitmap = self.bitmap_storage.get_bitmap_for_node_type("regular").c_bitmap
             if mmh3.hash(main_bitmap) == self.empty_hash:
                 logger.warn("Coverage bitmap is empty?! Check -ip0 or try better seeds.")
+        return True
+
+    def task_done(self, conn):
+        # Worker finished a task - keep up to config.prefetch tasks queued at each Worker,
+        # so it can continue while we are busy processing its results
+        pending = max(0, self.tasks_pending.get(conn, 0) - 1)
+        while pending < max(1, self.config.prefetch):
+            # send busy only if Worker has nothing else to do
+            if not self.send_next_task(conn, allow_busy=(pending == 0)):
+                break
+            pending += 1
+        self.tasks_pending[conn] = pending
+
+    def node_done(self, conn, nid):
+        pending = self.nodes_pending.get(conn, [])
+        for i, (pending_nid, _) in enumerate(pending):
+            if pending_nid == nid:
+                del pending[i]
+                return
+
+    def worker_lost(self, conn):
+        # hand out nodes and shards again that were sent to a disconnected Worker
+        self.tasks_pending.pop(conn, None)
+        for nid, det_shard in self.nodes_pending.pop(conn, []):
+            logger.debug("Releasing node %d of disconnected Worker." % nid)
+            if det_shard:
+                self.det_shards.release(nid, det_shard)
+            else:
+                self.queue.release_node(nid)
 
     def loop(self):
         workers_ready = set()
@@ -91,14 +193,25 @@ class ManagerTask:
             for conn, msg in self.comm.wait(self.statistics.plot_thres):
                 if msg["type"] == MSG_NODE_DONE:
                     # Worker execution done, update queue item + send new task
-                    if msg["node_id"]:
-                        self.queue.update_node_results(msg["node_id"], msg["results"], msg["new_payload"])
-                    self.send_next_task(conn)
+                    results = msg["results"]
+                    self.node_done(conn, msg["node_id"])
+                    if msg["node_id"] and self.det_shards and DetShards.is_shard(results):
+                        # node results are only updated once all shards are done
+                        results = self.det_shards.complete(msg["node_id"], results)
+                    if msg["node_id"] and results:
+                        self.queue.update_node_results(msg["node_id"], results, msg["new_payload"])
+                        if self.timeout_model:
+                            self.timeout_model.add(results.get("performance", None))
+                    self.task_done(conn)
                 elif msg["type"] == MSG_NODE_ABORT:
                     # Worker execution aborted, update queue item + DONT send new task
                     logger.warn(f"Worker {msg['worker_id']} sent ABORT..")
                     workers_aborted.add(msg["worker_id"])
-                    if msg["node_id"]:
+                    self.node_done(conn, msg["node_id"])
+                    if msg["node_id"] and self.det_shards and DetShards.is_shard(msg["results"]):
+                        # node stays busy until other Workers have finished all shards
+                        self.det_shards.abort(msg["node_id"], msg["results"])
+                    elif msg["node_id"]:
                         self.queue.update_node_results(msg["node_id"], msg["results"], None)
                 elif msg["type"] == MSG_NEW_INPUT:
                     # Worker reports new interesting input
@@ -108,25 +221,45 @@ class ManagerTask:
                            repr(msg["input"]["payload"][:24])))
                     node_struct = {"info": msg["input"]["info"], "state": {"name": "initial"}}
                     self.maybe_insert_node(msg["input"]["payload"], msg["input"]["bitmap"], node_struct)
+                elif msg["type"] == MSG_NEW_INPUT_SPARSE:
+                    # same as above, but bitmap is sent as index/value lists
+                    node_struct = {"info": msg["input"]["info"], "state": {"name": "initial"}}
+                    self.maybe_insert_sparse_node(msg["input"], node_struct)
                 elif msg["type"] == MSG_READY:
-                    # Worker is ready for new input (initial hello or import done)
+                    # Worker is ready for new input (initial hello or import/busy done)
                     logger.debug(f"Worker {msg['worker_id']} sent READY..")
                     workers_ready.add(msg["worker_id"])
-                    self.send_next_task(conn)
+                    self.comm.set_payload_cache(conn, msg.get("node_cache", None))
+                    self.comm.set_remote(conn, msg.get("remote", False))
+                    self.task_done(conn)
                 else:
                     raise ValueError("unknown message type {}".format(msg))
 
+            while self.comm.disconnected:
+                self.worker_lost(self.comm.disconnected.pop())
+
             # start printing status when first instance is ready - or exit when they died
             if workers_ready:
                 if (len(workers_ready - workers_aborted)) == 0:
                     raise SystemExit("All Workers have died, or aborted before they became ready. :-/")
+                if self.timeout_model:
+                    self.statistics.data["t_soft"] = self.timeout_model.recommend()
                 self.statistics.maybe_write_stats()
+                if self.metadata_store:
+                    self.metadata_store.maybe_flush()
             elif workers_aborted:
                 raise SystemExit("Workers aborted before becoming ready. Likely broken VM or agent setup.")
 
             self.check_abort_condition()
 
 
+    def shutdown(self):
+        self.queue.flush_fav_bits()
+        if self.metadata_store:
+            self.metadata_store.flush()
+        if self.corpus_store:
+            self.corpus_store.sync()
+
     def check_abort_condition(self):
         import time
 
@@ -140,6 +273,18 @@ class ManagerTask:
             if n_limit < self.statistics.data['total_execs']:
                 raise SystemExit("Exit on max execs.")
 
+    def observe_runtime(self, info):
+        # only regular inputs tell us about the expected runtime
+        if self.timeout_model and info["exit_reason"] == "regular":
+            self.timeout_model.add(info["performance"])
+
+    def get_splice_payload(self, nid):
+        return QueueNode.get_payload(self.config.work_dir, {"id": nid, "info": {"exit_reason": "regular"}})
+
+    def add_splice_partner(self, node):
+        if node.get_exit_reason() == "regular":
+            self.comm.add_splice_id(node.get_id())
+
     def store_trace(self, node, tmp_trace):
         if tmp_trace and os.path.exists(tmp_trace):
             trace_dump_out = "%s/traces/fuzz_%05d.bin" % (self.config.work_dir, node.get_id())
@@ -149,27 +294,43 @@ class ManagerTask:
                     shutil.copyfileobj(f_in, f_out)
             os.remove(tmp_trace)
 
+    def maybe_insert_sparse_node(self, msg_input, node_struct):
+        bitmap = ExecutionResult.bitmap_from_sparse(msg_input["indices"], msg_input["values"],
+                                                    msg_input["bitmap_size"],
+                                                    node_struct["info"]["exit_reason"],
+                                                    node_struct["info"]["performance"])
+        self.__insert_node(msg_input["payload"], bitmap, None, node_struct)
+
     def maybe_insert_node(self, payload, bitmap_array, node_struct):
         bitmap = ExecutionResult.bitmap_from_bytearray(bitmap_array, node_struct["info"]["exit_reason"],
                                                        node_struct["info"]["performance"])
         bitmap.lut_applied = True  # since we received the bitmap from Worker, the lut was already applied
-        backup_data = bitmap.copy_to_array()
+        backup_data = bitmap.snapshot() if self.config.debug else None
+        if not self.__insert_node(payload, bitmap, bitmap_array, node_struct) and self.config.debug:
+            i = bitmap.compare(backup_data)
+            if i != bitmap.bitmap_size:
+                assert(False), "Bitmap mangled at {} {} {}".format(i, repr(backup_data[i]), repr(bitmap.cbuffer[i]))
+
+    def __insert_node(self, payload, bitmap, bitmap_array, node_struct):
+        # store node if bitmap has new coverage, returns False for duplicates
         should_store, new_bytes, new_bits = self.bitmap_storage.should_store_in_queue(bitmap)
-        new_data = bitmap.copy_to_array()
         trace_dump_tmp = node_struct["info"].get("pt_dump", None)
         if should_store:
+            # dense bitmap is only needed for debug mode
+            if bitmap_array is None and self.config.debug:
+                bitmap_array = bitmap.copy_to_array()
             node = QueueNode(self.config, payload, bitmap_array, node_struct, write=False)
             node.set_new_bytes(new_bytes, write=False)
             node.set_new_bits(new_bits, write=False)
             self.queue.insert_input(node, bitmap)
             self.store_trace(node, trace_dump_tmp)
-            return
+            self.observe_runtime(node_struct["info"])
+            self.add_splice_partner(node)
+            return True
 
         if trace_dump_tmp and os.path.exists(trace_dump_tmp):
             os.remove(trace_dump_tmp)
 
         if self.config.debug:
             logger.debug("Received duplicate payload with exit=%s, discarding." % node_struct["info"]["exit_reason"])
-            for i in range(len(bitmap_array)):
-                if backup_data[i] != new_data[i]:
-                    assert(False), "Bitmap mangled at {} {} {}".format(i, repr(backup_data[i]), repr(new_data[i]))
+        return False
@@ -5,40 +5,131 @@
 
 """
 Fuzz inputs are managed as nodes in a queue. Any persistent metadata is stored here as node attributes.
+
+Fields used for scheduling are kept in a NodeTable shared by all nodes, the
+remaining metadata in a per-node dict. node_struct combines both.
 """
 
+import os
+import time
+import array
+import logging
 import lz4.frame
 import msgpack
 
 from kafl_fuzzer.common.util import read_binary_file, atomic_write
 
+logger = logging.getLogger(__name__)
+
+
+# node states and exit reasons, stored by index in NodeTable
+STATE_NAMES = ["initial", "redq/grim", "deterministic", "havoc", "final"]
+STATE_CODES = {name: code for code, name in enumerate(STATE_NAMES)}
+EXIT_REASONS = ["regular", "timeout", "crash", "kasan"]
+EXIT_CODES = {name: code for code, name in enumerate(EXIT_REASONS)}
+
+
+class NodeTable:
+    """
+    Scheduling fields of all nodes, as parallel arrays indexed by node ID.
+
+    The queue reads these on every priority update, so they are kept out of
+    the per-node metadata dict. QueueNode.node_struct merges them back in.
+    """
+
+    def __init__(self):
+        self.score = array.array('d')
+        self.fav_factor = array.array('d')
+        self.attention_secs = array.array('d')
+        self.state = array.array('B')
+        self.exit_reason = array.array('B')
+        self.busy = array.array('B')
+        self.fav_count = array.array('I')
+
+    def __len__(self):
+        return len(self.score)
+
+    def reserve(self, node_id):
+        size = len(self.score)
+        if node_id < size:
+            return
+        grow = max(node_id + 1, 2*size) - size
+        for column in [self.score, self.fav_factor, self.attention_secs,
+                       self.state, self.exit_reason, self.busy, self.fav_count]:
+            column.frombytes(bytes(grow * column.itemsize))
+
 
 class QueueNode:
+    __slots__ = ["id", "data", "workdir", "payload_version"]
+
     NextID = 1
+    # hot fields of all nodes, see NodeTable
+    table = NodeTable()
+    # owner of fav bits, see FavIndex
+    fav_index = None
+    # optional write-behind store for metadata updates, see MetadataStore
+    metadata_store = None
+    # optional log-structured store for payloads and metadata, see CorpusStore
+    corpus_store = None
 
     def __init__(self, config, payload, bitmap, node_struct, write=True):
-        self.node_struct = node_struct
-        self.busy = False
-        self.workdir = config.work_dir
-
         self.set_id(QueueNode.NextID, write=False)
         QueueNode.NextID += 1
 
+        self.node_struct = node_struct
+        QueueNode.table.busy[self.id] = False
+        QueueNode.table.fav_count[self.id] = 0
+        self.workdir = config.work_dir
+        # identifies payload in Worker caches, see PayloadCache
+        self.payload_version = 0
+
         self.set_payload(payload, write=write)
         # store individual bitmaps only in debug mode
         if bitmap and config.debug:
             self.write_bitmap(bitmap)
 
-        self.node_struct["attention_execs"] = 0
-        self.node_struct["attention_secs"] = 0
+        self.data["attention_execs"] = 0
+        QueueNode.table.attention_secs[self.id] = 0
         self.set_state("initial", write=False)
 
+    @property
+    def node_struct(self):
+        # metadata dict for Workers, see pack_metadata() for the persistent version
+        table = QueueNode.table
+        nid = self.id
+        node_struct = dict(self.data)
+        node_struct["id"] = nid
+        node_struct["state"] = {"name": STATE_NAMES[table.state[nid]]}
+        node_struct["score"] = table.score[nid]
+        node_struct["fav_factor"] = table.fav_factor[nid]
+        node_struct["attention_secs"] = table.attention_secs[nid]
+        return node_struct
+
+    @node_struct.setter
+    def node_struct(self, node_struct):
+        # split hot fields into table, keep the rest as dict
+        table = QueueNode.table
+        nid = self.id
+        data = dict(node_struct)
+        data.pop("id", None)
+        data.pop("fav_bits", None)
+        table.state[nid] = STATE_CODES[data.pop("state", {"name": "initial"})["name"]]
+        table.score[nid] = data.pop("score", 0)
+        table.fav_factor[nid] = data.pop("fav_factor", 0)
+        table.attention_secs[nid] = data.pop("attention_secs", 0)
+        table.exit_reason[nid] = EXIT_CODES[data["info"]["exit_reason"]]
+        self.data = data
+
     @staticmethod
     def get_metadata(workdir, node_id):
-        return msgpack.unpackb(read_binary_file(QueueNode.__get_metadata_filename(workdir, node_id)), strict_map_key=False)
+        if QueueNode.corpus_store:
+            return msgpack.unpackb(QueueNode.corpus_store.read_metadata(node_id), strict_map_key=False)
+        return msgpack.unpackb(read_binary_file(QueueNode.get_metadata_filename(workdir, node_id)), strict_map_key=False)
 
     @staticmethod
     def get_payload(workdir, node_struct):
+        if QueueNode.corpus_store:
+            return QueueNode.corpus_store.read_payload(node_struct['id'])
         return read_binary_file(QueueNode.__get_payload_filename(workdir, node_struct['info']['exit_reason'], node_struct['id']))
 
     @staticmethod
@@ -46,13 +137,31 @@ class QueueNode:
         return "%s/corpus/%s/payload_%05d" % (workdir, exit_reason, node_id)
 
     @staticmethod
-    def __get_metadata_filename(workdir, node_id):
+    def get_metadata_filename(workdir, node_id):
         return "%s/metadata/node_%05d" % (workdir, node_id)
 
     def update_file(self, write=True):
         if write:
-            node_path = QueueNode.__get_metadata_filename(self.workdir, self.get_id())
-            atomic_write(node_path, msgpack.packb(self.node_struct))
+            if QueueNode.metadata_store:
+                QueueNode.metadata_store.mark_dirty(self)
+            else:
+                self.write_metadata()
+
+    def pack_metadata(self):
+        # fav bits are only looked up when persisting
+        node_struct = self.node_struct
+        node_struct["fav_bits"] = self.get_fav_bits()
+        return msgpack.packb(node_struct)
+
+    def write_metadata(self):
+        QueueNode.store_metadata(self.workdir, self.get_id(), self.pack_metadata())
+
+    @staticmethod
+    def store_metadata(workdir, node_id, data):
+        if QueueNode.corpus_store:
+            QueueNode.corpus_store.write_metadata(node_id, data)
+        else:
+            atomic_write(QueueNode.get_metadata_filename(workdir, node_id), data)
 
     def write_bitmap(self, bitmap):
         bitmap_path = "%s/bitmaps/payload_%05d.lz4" % (self.workdir, self.get_id())
@@ -89,113 +198,194 @@ class QueueNode:
 
     def set_payload(self, payload, write=True):
         self.set_payload_len(len(payload), write=False)
+        self.payload_version += 1
+        if QueueNode.corpus_store:
+            QueueNode.corpus_store.write_payload(self.get_id(), payload)
+            return
         atomic_write(QueueNode.__get_payload_filename(self.workdir, self.get_exit_reason(), self.get_id()), payload)
 
     def get_payload_len(self):
-        return self.node_struct["payload_len"]
+        return self.data["payload_len"]
 
     def set_payload_len(self, val, write=True):
-        self.node_struct["payload_len"] = val
+        self.data["payload_len"] = val
         self.update_file(write)
 
     def get_id(self):
-        return self.node_struct["id"]
+        return self.id
 
     def set_id(self, val, write=True):
-        self.node_struct["id"] = val
+        QueueNode.table.reserve(val)
+        self.id = val
         self.update_file(write)
 
     def get_new_bytes(self):
-        return self.node_struct["new_bytes"]
+        return self.data["new_bytes"]
 
     def set_new_bytes(self, val, write=True):
-        self.node_struct["new_bytes"] = val
+        self.data["new_bytes"] = val
         self.update_file(write)
 
     def get_new_bits(self):
-        return self.node_struct["new_bits"]
-
-    def clear_fav_bits(self, write=True):
-        self.node_struct["fav_bits"] = {}
-        self.update_file(write)
+        return self.data["new_bits"]
 
     def get_fav_bits(self):
-        return self.node_struct["fav_bits"]
+        if not QueueNode.fav_index or not self.is_favorite():
+            return {}
+        return QueueNode.fav_index.get_fav_bits(self.id)
 
-    def add_fav_bit(self, index, write=True):
-        self.node_struct["fav_bits"][index] = 0
-        self.update_file(write)
-
-    def remove_fav_bit(self, index, write=True):
-        assert index in self.node_struct["fav_bits"]
-        self.node_struct["fav_bits"].pop(index)
-        self.update_file(write)
+    def get_fav_count(self):
+        return QueueNode.table.fav_count[self.id]
 
     def set_new_bits(self, val, write=True):
-        self.node_struct["new_bits"] = val
+        self.data["new_bits"] = val
         self.update_file(write)
 
     def get_level(self):
-        return self.node_struct["level"]
+        return self.data["level"]
 
     def set_level(self, val, write=True):
-        self.node_struct["level"] = val
+        self.data["level"] = val
         self.update_file(write)
 
     def is_favorite(self):
-        return len(self.node_struct["fav_bits"]) > 0
+        return QueueNode.table.fav_count[self.id] > 0
 
     def get_parent_id(self):
-        return self.node_struct["info"]["parent"]
+        return self.data["info"]["parent"]
 
     def get_timestamp(self):
-        return self.node_struct["info"]["time"]
+        return self.data["info"]["time"]
 
     def get_method(self):
-        return self.node_struct["info"]["method"]
+        return self.data["info"]["method"]
 
     def get_initial_performance(self):
-        return self.node_struct["info"]["performance"]
+        return self.data["info"]["performance"]
 
     def get_performance(self):
-        return self.node_struct["performance"]
+        return self.data["performance"]
 
     def set_performance(self, val, write=True):
-        self.node_struct["performance"] = val
+        self.data["performance"] = val
+        self.update_file(write)
+
+    def set_trimmed(self, write=True):
+        self.data["info"]["trimmed"] = True
         self.update_file(write)
 
     def get_state(self):
-        return self.node_struct["state"]["name"]
+        return STATE_NAMES[QueueNode.table.state[self.id]]
 
     def set_state(self, val, write=True):
-        self.node_struct["state"]["name"] = val
+        QueueNode.table.state[self.id] = STATE_CODES[val]
         self.update_file(write)
 
     def get_exit_reason(self):
-        return self.node_struct["info"]["exit_reason"]
+        return EXIT_REASONS[QueueNode.table.exit_reason[self.id]]
 
     def set_exit_reason(self, val, write=True):
-        self.node_struct["info"]["exit_reason"] = val
+        self.data["info"]["exit_reason"] = val
+        QueueNode.table.exit_reason[self.id] = EXIT_CODES[val]
         self.update_file(write)
 
+    def get_attention_secs(self):
+        return QueueNode.table.attention_secs[self.id]
+
     def get_fav_factor(self):
-        return self.node_struct["fav_factor"]
+        return QueueNode.table.fav_factor[self.id]
 
     def set_score(self, val):
-        self.node_struct["score"] = val
+        QueueNode.table.score[self.id] = val
 
     def get_score(self):
-        return self.node_struct["score"]
+        return QueueNode.table.score[self.id]
 
     def set_fav_factor(self, val, write=True):
-        self.node_struct["fav_factor"] = val
+        QueueNode.table.fav_factor[self.id] = val
         self.update_file(write)
 
     def set_free(self):
-        self.busy = False
+        QueueNode.table.busy[self.id] = False
 
     def set_busy(self):
-        self.busy = True
+        QueueNode.table.busy[self.id] = True
 
     def is_busy(self):
-        return self.busy
+        return QueueNode.table.busy[self.id] != 0
+
+
+class MetadataStore:
+    """
+    Write-behind store for node metadata.
+
+    Nodes marked dirty are written out in batches by flush(). Each batch is
+    first appended to a journal and synced, so that a flush interrupted by a
+    crash can be completed by replay_journal() on next startup.
+    """
+
+    def __init__(self, workdir, flush_interval):
+        self.workdir = workdir
+        self.journal = workdir + "/metadata/journal"
+        self.flush_interval = flush_interval
+        self.flush_last = time.time()
+        self.dirty = {}
+
+        MetadataStore.replay_journal(workdir)
+
+    def mark_dirty(self, node):
+        self.dirty[node.get_id()] = node
+
+    def is_dirty(self, node_id):
+        return node_id in self.dirty
+
+    def flush_node(self, node_id):
+        # write a single node immediately, e.g. before a Worker reads it
+        node = self.dirty.pop(node_id, None)
+        if node:
+            node.write_metadata()
+
+    def maybe_flush(self):
+        if time.time() - self.flush_last > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.flush_last = time.time()
+        if not self.dirty:
+            return
+
+        batch = [(nid, node.pack_metadata()) for nid, node in self.dirty.items()]
+        self.dirty = {}
+
+        with open(self.journal, 'ab') as f:
+            f.write(msgpack.packb(batch))
+            f.flush()
+            os.fsync(f.fileno())
+
+        MetadataStore.write_batch(self.workdir, batch)
+        os.truncate(self.journal, 0)
+
+    @staticmethod
+    def write_batch(workdir, batch):
+        for nid, data in batch:
+            QueueNode.store_metadata(workdir, nid, data)
+
+    @staticmethod
+    def replay_journal(workdir):
+        journal = workdir + "/metadata/journal"
+        if not os.path.exists(journal) or os.path.getsize(journal) == 0:
+            return
+
+        unpacker = msgpack.Unpacker(strict_map_key=False)
+        unpacker.feed(read_binary_file(journal))
+        num_batches = 0
+        try:
+            for batch in unpacker:
+                MetadataStore.write_batch(workdir, batch)
+                num_batches += 1
+        except (ValueError, msgpack.UnpackException):
+            # truncated batch at the end of journal was never written out
+            pass
+
+        logger.info("Replayed %d metadata batches from journal." % num_batches)
+        os.truncate(journal, 0)
@@ -6,91 +6,152 @@
 """
 Queue of fuzz inputs (nodes). Interface with scheduler to determine next input to be fuzzed.
 """
+import ctypes
 import logging
+from kafl_fuzzer.manager.heap import IndexedHeap
+from kafl_fuzzer.manager.node import QueueNode
 from kafl_fuzzer.manager.scheduler import Scheduler
+from kafl_fuzzer.native import loader as native_loader
 
 logger = logging.getLogger(__name__)
 
+PUSHBACK_FAV_BITS = 20   # initial nodes with more fav bits are handed out first
+
+
+class FavIndex:
+    """
+    Favorite node of each bitmap entry, as dense arrays of owner node ID (0 for
+    none) and bucket value. Per-node fav counts are kept in NodeTable.fav_count,
+    and the owned entries of each favorite node in a set for get_fav_bits().
+    """
+    native_so = None
+
+    def __init__(self, bitmap_size):
+        if not FavIndex.native_so:
+            FavIndex.native_so = ctypes.CDLL(native_loader.bitmap_path())
+            FavIndex.native_so.fav_index_update.restype = ctypes.c_uint64
+
+        self.bitmap_size = bitmap_size
+        self.owner = (ctypes.c_uint32 * bitmap_size)()
+        self.value = (ctypes.c_uint8 * bitmap_size)()
+        self.scratch = (ctypes.c_uint32 * bitmap_size)()
+        self.scratch_idx = (ctypes.c_uint32 * bitmap_size)()
+        self.fav_bits = dict()   # node ID => set of owned bitmap indices
+
+    def get(self, index):
+        return self.owner[index], self.value[index]
+
+    def update(self, node, bitmap):
+        # make node favorite of all entries where it is better, return IDs of nodes that lost entries
+        indices, values = bitmap.copy_to_sparse()
+        num = len(values)
+        table = QueueNode.table
+        # temporary views, must not outlive this call or the table cannot grow
+        scores = (ctypes.c_double * len(table)).from_buffer(table.score)
+        fav_count = (ctypes.c_uint32 * len(table)).from_buffer(table.fav_count)
+        taken = FavIndex.native_so.fav_index_update(self.owner, self.value, ctypes.c_uint64(self.bitmap_size),
+                                                    (ctypes.c_uint32 * num).from_buffer_copy(indices),
+                                                    (ctypes.c_uint8 * num).from_buffer_copy(values),
+                                                    ctypes.c_uint64(num), ctypes.c_uint32(node.get_id()),
+                                                    scores, fav_count, self.scratch, self.scratch_idx)
+        del scores, fav_count
+        losers = set()
+        taken_idx = self.scratch_idx[:taken]
+        if taken:
+            self.fav_bits.setdefault(node.get_id(), set()).update(taken_idx)
+        for index, old in zip(taken_idx, self.scratch[:taken]):
+            if old:
+                losers.add(old)
+                self.fav_bits[old].discard(index)
+        for old in losers:
+            if not self.fav_bits[old]:
+                del self.fav_bits[old]
+        return losers
+
+    def get_fav_bits(self, nid):
+        return {index: 0 for index in sorted(self.fav_bits.get(nid, ()))}
+
 class InputQueue:
     def __init__(self, config, statistics):
         self.num_workers = config.processes
         self.scheduler = Scheduler()
         self.id_to_node = {}
-        self.current_cycle = []
-        self.bitmap_index_to_fav_node = {}
+        self.heap = IndexedHeap()
+        self.cycle_nodes = {}
+        self.cycle_picks = 0
+        self.fav_index = FavIndex(config.bitmap_size)
+        QueueNode.fav_index = self.fav_index
+        # nodes with changed fav bits, persisted once per cycle
+        self.fav_dirty = set()
         self.num_cycles = 0
         self.statistics = statistics
 
-    def get_next(self, retry=False):
+    def get_next(self):
+        # Fun experimental fuzzing scheduler.
+        #
+        # Nodes are kept in a max-heap ordered by scheduler priority, which
+        # is updated in place whenever a node changes. We hand out the top
+        # entries, removing them from the heap until they are done (busy) or
+        # until the current cycle ends (final nodes, which are never busy and
+        # may be processed by multiple Workers). This fuzzes the top-most N
+        # entries of the queue per cycle, similar to the original approach of
+        # frequently sorting the full queue, but at O(log n) per update.
+        #
+        # As in the original maybe_pushback_to_cycle(), regular nodes in the
+        # initial stage with many fav bits go straight to the head of the queue
+        # and do not count towards the current cycle.
         if len(self.id_to_node) == 0:
             return None
 
-        while self.current_cycle:
-            node = self.current_cycle.pop()
-            if not node.is_busy():
-                if node.get_state() != "final":
-                    node.set_busy()
-                return node
+        fav_items = self.statistics.data['favs_total']
+        cycle_size = int(min(1.5*fav_items, 4*self.num_workers)) or len(self.id_to_node)
 
-        self.update_current_cycle()
+        if self.cycle_picks >= cycle_size or len(self.heap) == 0:
+            self.update_current_cycle()
 
-        if retry:
+        nid = self.heap.pop()
+        if nid is None:
             return None
+
+        node = self.id_to_node[nid]
+        if not self.is_pushback(node):
+            self.cycle_picks += 1
+        if node.get_state() != "final":
+            node.set_busy()
         else:
-            return self.get_next(retry=True)
+            self.cycle_nodes[nid] = node
+        return node
 
     def update_current_cycle(self):
-        # Fun experimental fuzzing scheduler.
-        #
-        # Idea is to perform a frequent overall sorting of the queue and
-        # just fuzz the top-most N entries. This seems effective especially
-        # for slow targets since we don't have good queue culling and early
-        # Redqueen/Grimoire stages seem to be the most efficient.
-        #
-        # Issues
-        # - Sorting the queue is relatively expensive, can turn the Manager into a bottleneck
-        # - If we have very few items, we will end up sorting all the time
-        #
-        # Alternatives?
-        # - keep a sorted queue
-        # - let scheduler pick randomly, with weighted distribution
-
-        fav_items = self.statistics.data['favs_total']
-        cycle_size = int(min(1.5*fav_items, 4*self.num_workers))
-
-        full_queue = sorted(self.id_to_node.values(),
-                            key=lambda n: self.scheduler.score_priority_favs(n))
+        # return nodes handed out in the last cycle to the heap
+        cycle_nodes = self.cycle_nodes
+        self.cycle_nodes = {}
+        for node in cycle_nodes.values():
+            self.update_priority(node)
+        self.cycle_picks = 0
+        self.flush_fav_bits()
 
         self.num_cycles += 1
-        self.current_cycle = full_queue[-cycle_size:]
         self.statistics.event_queue_cycle(self)
 
-        #for i in self.current_cycle:
-        #    busy = "*" if i.is_busy() else " "
-        #    score = i.get_score()
-        #    if i.get_state() == "final":
-        #        score = score/i.node_struct.get("state_time_havoc")
-        #    print("node %02d%s, prio=%2.1f, score=%.2f, perf=%d, stage=%s" %(
-        #        i.get_id(),
-        #        busy,
-        #        i.get_score(),
-        #        score,
-        #        i.get_fav_factor(),
-        #        i.get_state(),
-        #        ))
-
-    def maybe_pushback_to_cycle(self, node):
-        # put nodes in early stages directly at head of queue, to reduce global sorting
-        if node.get_exit_reason() == "regular" and node.get_state() in ["initial"]:
-            if len(node.get_fav_bits()) > 20:
-                self.current_cycle.append(node)
+    def is_pushback(self, node):
+        return (node.get_exit_reason() == "regular" and node.get_state() == "initial" and
+                node.get_fav_count() > PUSHBACK_FAV_BITS)
+
+    def update_priority(self, node):
+        # busy nodes and nodes handed out in current cycle are pushed back later
+        if node.is_busy():
+            return
+        if node.get_id() in self.cycle_nodes:
+            return
+        self.heap.push(node.get_id(), (self.is_pushback(node), self.scheduler.score_priority_favs(node)))
 
     def update_node_results(self, nid, results, new_payload):
         node = self.id_to_node[nid]
         self.statistics.event_node_update(node, results)
         if new_payload:
             node.set_payload(new_payload)
-            node.node_struct["info"]["trimmed"] = True
+            node.set_trimmed(write=False)
             node.set_score(self.scheduler.score_speed(node))
         if results.get("performance"):
             oldperf = node.get_initial_performance()
@@ -101,13 +162,19 @@ class InputQueue:
         node.set_fav_factor(self.scheduler.score_impact(node), write=False)
         node.update_metadata(results)
         node.set_free()
-        self.maybe_pushback_to_cycle(node)
+        self.update_priority(node)
+
+    def release_node(self, nid):
+        # node was handed out but no results will come, e.g. Worker disconnected
+        node = self.id_to_node[nid]
+        if node.is_busy():
+            node.set_free()
+            self.update_priority(node)
 
     def insert_input(self, node, bitmap):
         parent = node.get_parent_id()
         node.set_level(self.id_to_node[parent].get_level() + 1 if parent else 0, write=False)
         node.set_performance(node.get_initial_performance(), write=False)
-        node.clear_fav_bits(write=False)
         node.set_score(self.scheduler.score_speed(node))
 
         self.id_to_node[node.get_id()] = node
@@ -115,38 +182,22 @@ class InputQueue:
         # only regular nodes with new bytes can become favorites
         if node.get_exit_reason() == "regular":
             if len(node.get_new_bytes()) > 0:
-                self.update_best_input_for_bitmap_entry(node, bitmap)  # TODO improve performance!
-                self.maybe_pushback_to_cycle(node)
+                self.update_best_input_for_bitmap_entry(node, bitmap)
 
         node.set_fav_factor(self.scheduler.score_impact(node), write=True)
+        self.update_priority(node)
         #node.update_file()
         self.statistics.event_node_new(node)
 
-    def should_overwrite_old_entry(self, index, val, node):
-        entry = self.bitmap_index_to_fav_node.get(index)
-        if not entry:
-            return True, None
-        old_node, old_val = entry
-        better_bits = val > old_val and node.get_score() <= old_node.get_score()
-        better_score = val == old_val and node.get_score() < old_node.get_score()
-        if better_bits or better_score:
-            return True, old_node
-        return False, None
-
     def update_best_input_for_bitmap_entry(self, new_node, bitmap):
-        changed_nodes = set()
-        for (index, val) in enumerate(bitmap.cbuffer):
-            if val == 0x0:
-                continue
-            overwrite, old_node = self.should_overwrite_old_entry(index, val, new_node)
-            if overwrite:
-                self.bitmap_index_to_fav_node[index] = (new_node, val)
-                new_node.add_fav_bit(index, write=False)
-                #changed_nodes.add(new_node)
-                if old_node:
-                    old_node.remove_fav_bit(index, write=False)
-                    changed_nodes.add(old_node)
-                    self.statistics.event_node_remove_fav_bit(old_node)
-        for node in changed_nodes:
+        for nid in self.fav_index.update(new_node, bitmap):
+            node = self.id_to_node[nid]
+            self.statistics.event_node_remove_fav_bit(node)
             node.set_fav_factor(self.scheduler.score_impact(node), write=False)
+            self.fav_dirty.add(node)
+            self.update_priority(node)
+
+    def flush_fav_bits(self):
+        for node in self.fav_dirty:
             node.update_file()
+        self.fav_dirty = set()
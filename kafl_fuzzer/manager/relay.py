@@ -0,0 +1,113 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+kAFL Relay Implementation.
+
+Serve the Workers of one host in place of the Manager and forward their
+traffic to a central Manager via TCP. Each local Worker gets its own upstream
+connection, so the Manager treats it like any other Worker.
+
+New inputs are checked against a local copy of the global bitmaps first and
+only novel ones are forwarded. The same bitmaps are mapped by local Workers.
+With --bitmap-sync, the local copy also receives the Manager's bitmap updates
+attached to each task.
+
+Remote Workers have no access to the Manager's workdir. They announce their
+payload cache with each READY message, so that the Manager sends node data
+and payloads inline regardless of its own --node-cache setting.
+"""
+
+import os
+import socket
+import logging
+import msgpack
+
+from kafl_fuzzer.manager.communicator import ServerConnection, ClientConnection
+from kafl_fuzzer.manager.communicator import MSG_NEW_INPUT, MSG_NEW_INPUT_SPARSE
+from kafl_fuzzer.manager.statistics import ManagerStatistics
+from kafl_fuzzer.manager.bitmap import BitmapStorage
+from kafl_fuzzer.worker.execution_result import ExecutionResult
+
+logger = logging.getLogger(__name__)
+
+class RelayTask:
+
+    def __init__(self, config):
+        self.config = config
+        self.comm = ServerConnection(self.config)
+        self.statistics = ManagerStatistics(config)
+        self.bitmap_storage = BitmapStorage(config, "main", read_only=False)
+        self.hostname = socket.gethostname()
+
+        self.upstream = dict()    # local Worker => upstream connection
+        self.downstream = dict()  # upstream connection => local Worker
+        self.num_forwarded = 0
+        self.num_dropped = 0
+
+        logger.debug("Starting relay to %s (pid: %d)" % (config.relay, os.getpid()))
+
+    def connect_upstream(self, conn, worker_id):
+        upstream = ClientConnection(worker_id, self.config, address=self.config.relay).sock
+        self.comm.add_connection(upstream)
+        self.upstream[conn] = upstream
+        self.downstream[upstream] = conn
+        return upstream
+
+    def disconnect_upstream(self, conn):
+        upstream = self.upstream.pop(conn, None)
+        if upstream:
+            self.comm.selector.unregister(upstream)
+            self.downstream.pop(upstream)
+            upstream.close()
+
+    def is_novel(self, msg):
+        # check + update local bitmaps, same as ManagerTask.maybe_insert_node()
+        msg_input = msg["input"]
+        info = msg_input["info"]
+        if msg["type"] == MSG_NEW_INPUT_SPARSE:
+            bitmap = ExecutionResult.bitmap_from_sparse(msg_input["indices"], msg_input["values"],
+                                                        msg_input["bitmap_size"],
+                                                        info["exit_reason"], info["performance"])
+        else:
+            bitmap = ExecutionResult.bitmap_from_bytearray(msg_input["bitmap"], info["exit_reason"],
+                                                           info["performance"])
+            bitmap.lut_applied = True
+        accepted, _, _ = self.bitmap_storage.should_store_in_queue(bitmap)
+        return accepted
+
+    def handle_worker_msg(self, conn, msg):
+        if msg["type"] in [MSG_NEW_INPUT, MSG_NEW_INPUT_SPARSE]:
+            if not self.is_novel(msg):
+                self.num_dropped += 1
+                return
+            self.num_forwarded += 1
+
+        # Worker IDs are only unique per host
+        if "worker_id" in msg:
+            msg["worker_id"] = "%s/%s" % (self.hostname, msg["worker_id"])
+
+        upstream = self.upstream.get(conn, None)
+        if not upstream:
+            upstream = self.connect_upstream(conn, msg.get("worker_id", None))
+        self.comm.send_bytes(upstream, msgpack.packb(msg))
+
+    def loop(self):
+        while True:
+            for conn, msg in self.comm.wait(self.statistics.plot_thres):
+                if conn in self.downstream:
+                    # task from Manager
+                    if "bitmap_sync" in msg:
+                        self.bitmap_storage.apply_sync(msg["bitmap_sync"])
+                    self.comm.send_bytes(self.downstream[conn], msgpack.packb(msg))
+                else:
+                    self.handle_worker_msg(conn, msg)
+
+            while self.comm.disconnected:
+                self.disconnect_upstream(self.comm.disconnected.pop())
+
+            self.statistics.maybe_write_stats()
+
+    def shutdown(self):
+        logger.info("Relay forwarded %d new inputs, dropped %d duplicates." % (self.num_forwarded, self.num_dropped))
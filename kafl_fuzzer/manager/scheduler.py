@@ -19,8 +19,8 @@ performance/impact score. Also slow nodes that easily lead to timeouts/crashes
 will be de-emphasized faster as their attention time compensates for the early
 stage buff.
 
-Queue sorting can become a bottleneck on large queues or very fast
-execution/finding rate.
+Priorities are kept in an indexed heap by the queue and recomputed only for
+nodes that changed, so the queue is never fully re-sorted.
 """
 
 from math import log, log2, log10, ceil
@@ -41,7 +41,7 @@ class Scheduler:
 
     def score_impact(self, node):
         # compute payload priority based on fav bits and perf score
-        return 10*log_scale(len(node.get_fav_bits())) / log_scale(node.get_score())
+        return 10*log_scale(node.get_fav_count()) / log_scale(node.get_score())
 
     def score_speed(self, node):
         # payload runtime * length, lower is better
@@ -56,7 +56,7 @@ class Scheduler:
         # assign scheduler priority based on prio, and special stage/type buffs
         # consider total time already spend on this node to promote later discovered nodes
         prio = node.get_fav_factor()
-        time_spent = node.node_struct.get("attention_secs",0) / 60
+        time_spent = node.get_attention_secs() / 60
         time_buff = log_scale(time_spent)
 
         # assign special buff based on node type or stage
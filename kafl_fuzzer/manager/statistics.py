@@ -7,13 +7,90 @@
 Manage status outputs for Manager and Worker instances
 """
 
+import ctypes
+import mmap
 import msgpack
+import threading
 import time
 import sys
 
-from kafl_fuzzer.common.util import atomic_write, read_binary_file
+from kafl_fuzzer.common.util import atomic_write
 from kafl_fuzzer.common.color import FLUSH_LINE, FAIL, OKBLUE, ENDC
 
+
+class WorkerStatsSlot(ctypes.Structure):
+    _fields_ = [
+        ("start_time", ctypes.c_double),
+        ("run_time", ctypes.c_double),
+        ("total_execs", ctypes.c_uint64),
+        ("execs_per_sec", ctypes.c_uint64),
+        ("bb_seen", ctypes.c_uint64),
+        ("num_reload", ctypes.c_uint64),
+        ("num_funky", ctypes.c_uint64),
+        ("num_timeout", ctypes.c_uint64),
+        ("num_slow", ctypes.c_uint64),
+        ("executions_redqueen", ctypes.c_uint64),
+        ("node_id", ctypes.c_uint64),
+        ("reload_interval", ctypes.c_uint64),
+        ("stage", ctypes.c_char * 32),
+        ("method", ctypes.c_char * 32),
+    ]
+
+    def to_dict(self):
+        data = {
+            "start_time": self.start_time,
+            "run_time": self.run_time,
+            "total_execs": self.total_execs,
+            "execs/sec": self.execs_per_sec,
+            "bb_seen": self.bb_seen,
+            "num_reload": self.num_reload,
+            "num_funky": self.num_funky,
+            "num_timeout": self.num_timeout,
+            "num_slow": self.num_slow,
+            "executions_redqueen": self.executions_redqueen,
+            "node_id": self.node_id,
+            "reload_interval": self.reload_interval,
+        }
+        # strings may be torn by a concurrent update
+        if self.stage:
+            data["stage"] = self.stage.decode(errors="ignore")
+        if self.method:
+            data["method"] = self.method.decode(errors="ignore")
+        return data
+
+
+class WorkerStatsSegment:
+    """
+    Statistics of all Workers in a shared file mapping, one fixed slot per Worker.
+
+    Workers update their own slot in place. The Manager, kafl_gui and kafl_plot
+    take a copy of all slots at once, without reading or parsing any files.
+    """
+
+    def __init__(self, workdir, num_workers=0, create=False):
+        self.filename = workdir + "/worker_stats.shm"
+        if create:
+            with open(self.filename, 'wb') as f:
+                f.truncate(num_workers * ctypes.sizeof(WorkerStatsSlot))
+        with open(self.filename, 'r+b' if create else 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if not create else mmap.ACCESS_WRITE)
+        self.num_workers = len(self.mmap) // ctypes.sizeof(WorkerStatsSlot)
+
+    @staticmethod
+    def open_slot(workdir, pid):
+        # writable mapping of a single Worker's slot
+        with open(workdir + "/worker_stats.shm", 'r+b') as f:
+            segment = mmap.mmap(f.fileno(), 0)
+        return WorkerStatsSlot.from_buffer(segment, pid * ctypes.sizeof(WorkerStatsSlot))
+
+    def read(self, pid):
+        return WorkerStatsSlot.from_buffer_copy(self.mmap, pid * ctypes.sizeof(WorkerStatsSlot)).to_dict()
+
+    def read_all(self):
+        slots = (WorkerStatsSlot * self.num_workers).from_buffer_copy(self.mmap)
+        return [slot.to_dict() for slot in slots]
+
+
 class ManagerStatistics:
     def __init__(self, config):
         self.execs_last = 0
@@ -55,15 +132,11 @@ class ManagerStatistics:
 
         self.stats_file = self.work_dir + "/stats"
         self.plot_file  = self.work_dir + "/stats.csv"
+        self.worker_stats = WorkerStatsSegment(self.work_dir, self.num_workers, create=True)
         # write once so that we have a valid stats file
         self.write_plot_header()
         self.maybe_write_stats()
 
-    def read_worker_stats(self, pid):
-        # one-shot attempt to read + parse file - this can fail!
-        filename = self.work_dir + "/worker_stats_%d" % pid
-        return msgpack.unpackb(read_binary_file(filename), strict_map_key=False)
-
     def event_queue_cycle(self, queue):
         self.data["cycles"] += 1
 
@@ -97,7 +170,7 @@ class ManagerStatistics:
         node_id = node.get_id()
         plen = node.get_payload_len()
         perf = node.get_performance()
-        favs = len(node.get_fav_bits())
+        favs = node.get_fav_count()
         new_bytes = len(node.get_new_bytes())
         new_bits = len(node.get_new_bits())
         parent = node.get_parent_id()
@@ -156,18 +229,13 @@ class ManagerStatistics:
         sum_timeout = 0
         sum_slow = 0
         max_bb_cov = 0
-        try:
-            for pid in range(0, self.num_workers):
-                # FIXME: read + unpack just once!
-                sum_execs   += self.read_worker_stats(pid).get("total_execs", 0)
-                sum_funky   += self.read_worker_stats(pid).get("num_funky", 0)
-                sum_reload  += self.read_worker_stats(pid).get("num_reload", 0)
-                sum_timeout += self.read_worker_stats(pid).get("num_timeout", 0)
-                sum_slow    += self.read_worker_stats(pid).get("num_slow", 0)
-                max_bb_cov = max(max_bb_cov,
-                                 self.read_worker_stats(pid).get("bb_seen", 0))
-        except:
-            return # don't update on read failure
+        for worker in self.worker_stats.read_all():
+            sum_execs   += worker["total_execs"]
+            sum_funky   += worker["num_funky"]
+            sum_reload  += worker["num_reload"]
+            sum_timeout += worker["num_timeout"]
+            sum_slow    += worker["num_slow"]
+            max_bb_cov = max(max_bb_cov, worker["bb_seen"])
         self.data["total_execs"] = sum_execs
         self.data["num_funky"]   = sum_funky
         self.data["num_reload"]  = sum_reload
@@ -184,7 +252,7 @@ class ManagerStatistics:
                         self.data["favs_pending"] -= 1
 
     def update_yield(self, node):
-        method = node.node_struct["info"]["method"] # TODO: add node.get_method() API
+        method = node.get_method()
         if method not in self.data["yield"]:
             self.data["yield"][method] = 0
         self.data["yield"][method] += 1
@@ -240,71 +308,87 @@ class ManagerStatistics:
 
 
 class WorkerStatistics:
+    """
+    Worker status is published in our slot of the shared WorkerStatsSegment.
+
+    Rare events update the slot directly. Executions are only counted in plain
+    attributes and published by snapshot(), which is invoked every few
+    executions so as to keep time.time() and ctypes access out of the hot path.
+    A low-frequency timer thread also publishes snapshots, so that rates do not
+    freeze when executions become slow or the Worker is idle.
+    """
+
     def __init__(self, pid, config):
-        self.filename = "%s/worker_stats_%d" % (config.work_dir, pid)
-        self.write_last = 0
+        self.slot = WorkerStatsSegment.open_slot(config.work_dir, pid)
+        self.write_last = time.time()
         self.write_thres = 0.5
-        self.execs_new = 0
-        self.data = {
-            "start_time": time.time(),
-            "run_time": 0,
-            "total_execs": 0,
-            "execs/sec": 0,
-            "bb_seen" : 0,
-            "num_reload": 0,
-            "num_funky": 0,
-            "num_timeout": 0,
-            "num_slow": 0,
-            "executions_redqueen": 0,
-            "node_id": 0,
-        }
-        # write once so that we have a valid stats file
-        self.maybe_write_stats()
+        self.execs = 0
+        self.execs_last = 0
+        self.bb_seen = 0
+        self.check_interval = 1
+        self.check_execs = 1
+
+        self.slot.start_time = self.write_last
+
+        self.lock = threading.Lock()
+        self.timer = threading.Thread(target=self.snapshot_timer, daemon=True)
+        self.timer.start()
+
+    def snapshot_timer(self):
+        while True:
+            time.sleep(self.write_thres)
+            if time.time() - self.write_last >= self.write_thres:
+                self.snapshot()
 
     def event_stage(self, stage, nid):
-        self.data["stage"] = stage
-        self.data["node_id"] = nid
-        self.maybe_write_stats()
+        self.slot.stage = stage.encode()[:31]
+        self.slot.method = b""
+        self.slot.node_id = nid or 0
+        self.snapshot()
 
     def event_method(self, method):
-        self.data["method"] = method
-        self.maybe_write_stats()
+        self.slot.method = method.encode()[:31]
+        self.snapshot()
 
     def event_exec(self, bb_cov=0):
-        if self.data["bb_seen"] < bb_cov:
-            self.data["bb_seen"] = bb_cov
-        self.execs_new += 1
-        self.maybe_write_stats()
+        self.execs += 1
+        if bb_cov > self.bb_seen:
+            self.bb_seen = bb_cov
+        if self.execs >= self.check_execs:
+            self.snapshot()
 
     def event_reload(self, reason):
-        self.data["num_reload"] += 1
+        self.slot.num_reload += 1
         if reason == "timeout":
-            self.data["num_timeout"] += 1
+            self.slot.num_timeout += 1
         if reason == "slow":
-            self.data["num_slow"] += 1
-        self.maybe_write_stats()
+            self.slot.num_slow += 1
 
     def event_funky(self):
-        self.data["num_funky"] += 1
-        self.maybe_write_stats()
+        self.slot.num_funky += 1
+
+    def event_reload_interval(self, interval):
+        self.slot.reload_interval = interval
 
     def event_exec_redqueen(self):
-        self.data["executions_redqueen"] += 1
-        self.maybe_write_stats()
+        self.slot.executions_redqueen += 1
 
     def get_total_execs(self):
-        return self.data["total_execs"]
-
-    def maybe_write_stats(self):
-        cur_time = time.time()
-        if cur_time - self.write_last < self.write_thres:
-            return
-
-        self.data["run_time"] = cur_time - self.data["start_time"]
-        self.data["execs/sec"] = self.execs_new // (cur_time - self.write_last)
-        self.data["total_execs"] += self.execs_new
-        self.execs_new = 0
-
-        atomic_write(self.filename, msgpack.packb(self.data))
-        #print "execs/sec: %d" % ((self.data["executions"] + self.data["executions_redqueen"]) / self.data["duration"])
-        self.write_last = cur_time
+        return self.execs
+
+    def snapshot(self):
+        with self.lock:
+            slot = self.slot
+            slot.total_execs = self.execs
+            slot.bb_seen = self.bb_seen
+
+            # aim for about two time checks per write interval
+            execs = self.execs - self.execs_last
+            cur_time = time.time()
+            if cur_time - self.write_last >= self.write_thres:
+                slot.run_time = cur_time - slot.start_time
+                slot.execs_per_sec = int(execs / (cur_time - self.write_last))
+                self.write_last = cur_time
+                self.execs_last = self.execs
+                self.check_interval = max(1, min(4096, execs // 2))
+            self.check_execs = self.execs + self.check_interval
@@ -0,0 +1,79 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Soft timeout calibration based on the runtime of regular inputs.
+
+The Manager sees the runtime of each new regular input and of each node
+performance update. These are tracked in a histogram over logarithmic
+buckets, which gives approximate percentiles in O(1) space. The recommended
+soft timeout is a high percentile of this distribution times a safety margin,
+bounded by the configured soft and hard timeouts. Nodes that are known to be
+slower than that get a per-node timeout derived from their own runtime.
+"""
+
+import math
+
+BUCKET_BASE = 1.1        # relative bucket width, i.e. percentiles are accurate to 10%
+BUCKET_MIN = 1e-6        # runtimes below 1us go into the first bucket
+BUCKET_NUM = 256         # covers up to ~11h
+MIN_SAMPLES = 32         # use static timeouts until we have seen this many runtimes
+
+
+class TimeoutModel:
+
+    def __init__(self, t_soft, t_hard, quantile=0.99, margin=2.0):
+        self.t_soft = t_soft
+        self.t_hard = t_hard
+        self.quantile = quantile
+        self.margin = margin
+        self.buckets = [0] * BUCKET_NUM
+        self.count = 0
+        self.t_global = None
+
+    @staticmethod
+    def bucket(runtime):
+        if runtime <= BUCKET_MIN:
+            return 0
+        return min(BUCKET_NUM - 1, 1 + int(math.log(runtime / BUCKET_MIN, BUCKET_BASE)))
+
+    @staticmethod
+    def bucket_limit(index):
+        # upper bound of runtimes in bucket <index>
+        return BUCKET_MIN * BUCKET_BASE ** index
+
+    def add(self, runtime):
+        if not runtime or runtime < 0:
+            return
+        self.buckets[TimeoutModel.bucket(runtime)] += 1
+        self.count += 1
+        self.t_global = None
+
+    def percentile(self, quantile):
+        if self.count == 0:
+            return 0
+        rank = math.ceil(quantile * self.count)
+        total = 0
+        for index, num in enumerate(self.buckets):
+            total += num
+            if total >= rank:
+                return TimeoutModel.bucket_limit(index)
+        return TimeoutModel.bucket_limit(BUCKET_NUM - 1)
+
+    def recommend(self):
+        # global soft timeout, or None if there are not enough samples yet
+        if self.count < MIN_SAMPLES:
+            return None
+        if self.t_global is None:
+            t_dyn = self.margin * self.percentile(self.quantile)
+            self.t_global = min(self.t_hard, max(self.t_soft, t_dyn))
+        return self.t_global
+
+    def node_timeout(self, performance):
+        # static timeout for a node of given runtime, raised to the global recommendation
+        t_node = self.t_soft + 1.2 * performance
+        t_global = self.recommend()
+        if t_global:
+            t_node = max(t_node, t_global)
+        return min(self.t_hard, t_node)
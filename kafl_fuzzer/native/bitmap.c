@@ -10,6 +10,7 @@
 #include <stdio.h>
 #include <stdbool.h>
 #include <stdint.h>
+#include <string.h>
 #include <assert.h>
 
 static const uint8_t bucket_lut[256] = {
@@ -72,12 +73,322 @@ uint64_t are_new_bits_present_no_apply_lut(uint8_t* bitmap, uint8_t* new_bitmap,
   return (uint64_t)((byte_count << 32) + (bit_count));
 }
 
+/**
+ * @brief Collect indices of non-zero bytes in a bitmap.
+ * Zero regions are skipped one 64-bit word at a time.
+ * @param bitmap The bitmap to scan.
+ * @param bitmap_size The length of the bitmap.
+ * @param idx_out Receives the indices of non-zero bytes (must hold bitmap_size entries).
+ * @param val_out Receives the byte values at idx_out, may be NULL.
+ * @return number of non-zero bytes found.
+ */
+uint64_t bitmap_nonzero(uint8_t* bitmap, uint64_t bitmap_size, uint32_t* idx_out, uint8_t* val_out) {
+  uint64_t count = 0;
+  uint64_t i = 0;
+
+  while (i < bitmap_size) {
+		if (i + 8 <= bitmap_size) {
+			uint64_t word;
+			memcpy(&word, bitmap + i, sizeof(word));
+			if (!word) {
+				i += 8;
+				continue;
+			}
+		}
+		if (bitmap[i]) {
+			idx_out[count] = i;
+			if (val_out)
+				val_out[count] = bitmap[i];
+			count++;
+		}
+		i++;
+  }
+  return count;
+}
+
+/**
+ * @brief Determine offsets of new bytes and new bits in one pass.
+ * Only considers bytes that are non-zero in new_bitmap, skipping zero words.
+ * @param bitmap The global bitmap.
+ * @param new_bitmap A bitmap from a recent run, bucket lut already applied.
+ * @param bitmap_size The length of both bitmaps.
+ * @param byte_idx_out Receives indices of bytes not yet seen in the global bitmap.
+ * @param bit_idx_out Receives indices of bytes with new bucket bits.
+ * @return byte and bit counts, encoded as in are_new_bits_present_no_apply_lut().
+ */
+uint64_t bitmap_new_offsets(uint8_t* bitmap, uint8_t* new_bitmap, uint64_t bitmap_size,
+                            uint32_t* byte_idx_out, uint32_t* bit_idx_out) {
+  uint64_t bit_count = 0;
+  uint64_t byte_count = 0;
+  uint64_t i = 0;
+
+  while (i < bitmap_size) {
+		if (i + 8 <= bitmap_size) {
+			uint64_t word;
+			memcpy(&word, new_bitmap + i, sizeof(word));
+			if (!word) {
+				i += 8;
+				continue;
+			}
+		}
+		uint8_t a = new_bitmap[i];
+		if( (a | bitmap[i]) != bitmap[i] )  {
+			if (bitmap[i]==0){
+				byte_idx_out[byte_count++] = i;
+			} else {
+				bit_idx_out[bit_count++] = i;
+			}
+		}
+		i++;
+  }
+  return (uint64_t)((byte_count << 32) + (bit_count));
+}
+
+static inline uint64_t rotl64(uint64_t x, int8_t r) {
+  return (x << r) | (x >> (64 - r));
+}
+
+static inline uint64_t fmix64(uint64_t k) {
+  k ^= k >> 33;
+  k *= 0xff51afd7ed558ccdULL;
+  k ^= k >> 33;
+  k *= 0xc4ceb9fe1a85ec53ULL;
+  k ^= k >> 33;
+  return k;
+}
+
+static inline void classify_bytes(uint8_t* bitmap, uint8_t* new_bitmap, uint64_t len, uint8_t apply_lut,
+                                  uint64_t* byte_count, uint64_t* bit_count) {
+  for (uint64_t i = 0; i < len; i++) {
+		uint8_t a = apply_lut ? bucket_lut[new_bitmap[i]] : new_bitmap[i];
+		new_bitmap[i] = a;
+		if( (a | bitmap[i]) != bitmap[i] )  {
+			if (bitmap[i]==0){
+				(*byte_count)++;
+			} else {
+				(*bit_count)++;
+			}
+		}
+  }
+}
+
+/**
+ * @brief Apply bucket lut, count new bytes/bits and hash the result in a single pass.
+ * Zero blocks of new_bitmap are only fed to the hash.
+ * @param bitmap The global bitmap.
+ * @param new_bitmap A bitmap from a recent run, bucketized in place if apply_lut is set.
+ * @param bitmap_size The length of both bitmaps.
+ * @param apply_lut Whether the bucket lut must still be applied to new_bitmap.
+ * @param seed Hash seed.
+ * @param hash_out Receives the first 64 bits of MurmurHash3_x64_128 over the
+ * bucketized new_bitmap, same as mmh3.hash64(). May be NULL to skip hashing.
+ * @return byte and bit counts, encoded as in are_new_bits_present_no_apply_lut().
+ */
+uint64_t bitmap_classify_hash(uint8_t* bitmap, uint8_t* new_bitmap, uint64_t bitmap_size,
+                              uint8_t apply_lut, uint32_t seed, uint64_t* hash_out) {
+  const uint64_t c1 = 0x87c37b91114253d5ULL;
+  const uint64_t c2 = 0x4cf5ad432745937fULL;
+  uint64_t bit_count = 0;
+  uint64_t byte_count = 0;
+  uint64_t h1 = seed;
+  uint64_t h2 = seed;
+  uint64_t nblocks = bitmap_size / 16;
+
+  for (uint64_t b = 0; b < nblocks; b++) {
+		uint8_t* block = new_bitmap + 16*b;
+		uint64_t k1, k2;
+		memcpy(&k1, block, sizeof(k1));
+		memcpy(&k2, block + 8, sizeof(k2));
+		if (k1 | k2) {
+			classify_bytes(bitmap + 16*b, block, 16, apply_lut, &byte_count, &bit_count);
+			memcpy(&k1, block, sizeof(k1));
+			memcpy(&k2, block + 8, sizeof(k2));
+		}
+		if (!hash_out)
+			continue;
+
+		k1 *= c1; k1 = rotl64(k1, 31); k1 *= c2; h1 ^= k1;
+		h1 = rotl64(h1, 27); h1 += h2; h1 = h1*5 + 0x52dce729;
+		k2 *= c2; k2 = rotl64(k2, 33); k2 *= c1; h2 ^= k2;
+		h2 = rotl64(h2, 31); h2 += h1; h2 = h2*5 + 0x38495ab5;
+  }
+
+  uint8_t* tail = new_bitmap + 16*nblocks;
+  uint64_t tail_len = bitmap_size & 15;
+  classify_bytes(bitmap + 16*nblocks, tail, tail_len, apply_lut, &byte_count, &bit_count);
+
+  if (hash_out) {
+		uint64_t k1 = 0;
+		uint64_t k2 = 0;
+		for (uint64_t i = tail_len; i > 8; i--)
+			k2 ^= (uint64_t)tail[i-1] << ((i-9) * 8);
+		if (tail_len > 8) {
+			k2 *= c2; k2 = rotl64(k2, 33); k2 *= c1; h2 ^= k2;
+		}
+		for (uint64_t i = (tail_len > 8 ? 8 : tail_len); i > 0; i--)
+			k1 ^= (uint64_t)tail[i-1] << ((i-1) * 8);
+		if (tail_len > 0) {
+			k1 *= c1; k1 = rotl64(k1, 31); k1 *= c2; h1 ^= k1;
+		}
+
+		h1 ^= bitmap_size; h2 ^= bitmap_size;
+		h1 += h2; h2 += h1;
+		h1 = fmix64(h1); h2 = fmix64(h2);
+		h1 += h2;
+		*hash_out = h1;
+  }
+  return (uint64_t)((byte_count << 32) + (bit_count));
+}
+
+/**
+ * @brief Hash only, as in bitmap_classify_hash().
+ * Comparing the bitmap against itself yields no new bytes or bits.
+ */
+uint64_t bitmap_hash(uint8_t* bitmap, uint64_t bitmap_size, uint8_t apply_lut, uint32_t seed) {
+  uint64_t hash;
+  bitmap_classify_hash(bitmap, bitmap, bitmap_size, apply_lut, seed, &hash);
+  return hash;
+}
+
 void update_global_bitmap(uint8_t* bitmap, uint8_t* new_bitmap, uint64_t bitmap_size) {
   for (uint64_t i = 0; i < bitmap_size; i++) {
         bitmap[i] |= new_bitmap[i];
   }
 }
 
+/**
+ * @brief Sparse variant of bitmap_new_offsets().
+ * @param bitmap The global bitmap.
+ * @param idx Indices of non-zero entries of a recent run.
+ * @param val Bucketized byte values at idx.
+ * @param num Number of entries in idx/val.
+ * @param bitmap_size The length of the global bitmap. Out of range indices are ignored.
+ * @param byte_pos_out Receives positions in idx/val of bytes not yet seen in the global bitmap.
+ * @param bit_pos_out Receives positions in idx/val of bytes with new bucket bits.
+ * @return byte and bit counts, encoded as in are_new_bits_present_no_apply_lut().
+ */
+uint64_t sparse_new_offsets(uint8_t* bitmap, uint32_t* idx, uint8_t* val, uint64_t num, uint64_t bitmap_size,
+                            uint32_t* byte_pos_out, uint32_t* bit_pos_out) {
+  uint64_t bit_count = 0;
+  uint64_t byte_count = 0;
+
+  for (uint64_t i = 0; i < num; i++) {
+		uint32_t j = idx[i];
+		if (j >= bitmap_size)
+			continue;
+		if( (val[i] | bitmap[j]) != bitmap[j] )  {
+			if (bitmap[j]==0){
+				byte_pos_out[byte_count++] = i;
+			} else {
+				bit_pos_out[bit_count++] = i;
+			}
+		}
+  }
+  return (uint64_t)((byte_count << 32) + (bit_count));
+}
+
+void sparse_update_global_bitmap(uint8_t* bitmap, uint32_t* idx, uint8_t* val, uint64_t num, uint64_t bitmap_size) {
+  for (uint64_t i = 0; i < num; i++) {
+		if (idx[i] < bitmap_size)
+			bitmap[idx[i]] |= val[i];
+  }
+}
+
+void sparse_to_bitmap(uint8_t* bitmap, uint32_t* idx, uint8_t* val, uint64_t num, uint64_t bitmap_size) {
+  memset(bitmap, 0, bitmap_size);
+  for (uint64_t i = 0; i < num; i++) {
+		if (idx[i] < bitmap_size)
+			bitmap[idx[i]] = val[i];
+  }
+}
+
+/**
+ * @brief Compare a bitmap against a snapshot, word at a time.
+ * @param bitmap The bitmap, e.g. the shared trace buffer of a recent run.
+ * @param snapshot A copy of an earlier bitmap.
+ * @param bitmap_size The length of both bitmaps.
+ * @return offset of the first differing byte, or bitmap_size if both are equal.
+ */
+uint64_t bitmap_compare(uint8_t* bitmap, uint8_t* snapshot, uint64_t bitmap_size) {
+  uint64_t i = 0;
+
+  while (i + 8 <= bitmap_size) {
+		uint64_t a, b;
+		memcpy(&a, bitmap + i, sizeof(a));
+		memcpy(&b, snapshot + i, sizeof(b));
+		if (a != b)
+			break;
+		i += 8;
+  }
+  while (i < bitmap_size && bitmap[i] == snapshot[i])
+		i++;
+  return i;
+}
+
+/**
+ * @brief Update favorites index with the non-zero entries of a new node.
+ * An entry is taken over if the node has a higher bucket value at no worse
+ * score, or the same value at a better (lower) score.
+ * @param owner Favorite node ID per bitmap entry, 0 for none.
+ * @param value Bucket value of the favorite per bitmap entry.
+ * @param bitmap_size The length of owner and value.
+ * @param idx Indices of the new node's non-zero bitmap entries.
+ * @param val Values of the new node's non-zero bitmap entries.
+ * @param num Number of entries in idx and val.
+ * @param nid ID of the new node.
+ * @param scores Score per node ID.
+ * @param fav_count Number of owned entries per node ID, updated in place.
+ * @param prev_out Previous owner of each entry taken over, 0 for none.
+ * @param idx_out Index of each entry taken over.
+ * @return number of entries taken over by the new node.
+ */
+uint64_t fav_index_update(uint32_t* owner, uint8_t* value, uint64_t bitmap_size,
+                          uint32_t* idx, uint8_t* val, uint64_t num,
+                          uint32_t nid, double* scores, uint32_t* fav_count, uint32_t* prev_out,
+                          uint32_t* idx_out) {
+  uint64_t count = 0;
+  double score = scores[nid];
+
+  for (uint64_t i = 0; i < num; i++) {
+		uint32_t j = idx[i];
+		if (j >= bitmap_size)
+			continue;
+		uint32_t old = owner[j];
+		if (old) {
+			uint8_t better_bits = val[i] > value[j] && score <= scores[old];
+			uint8_t better_score = val[i] == value[j] && score < scores[old];
+			if (!better_bits && !better_score)
+				continue;
+			fav_count[old]--;
+		}
+		owner[j] = nid;
+		value[j] = val[i];
+		fav_count[nid]++;
+		prev_out[count] = old;
+		idx_out[count++] = j;
+  }
+  return count;
+}
+
+/**
+ * @brief Fill buffer with PCG32 (XSH-RR) output, for batched havoc schedules.
+ * @param state Generator state, updated in place.
+ * @param out Output buffer of num words.
+ * @param bits Number of random bits per word (1-32), upper bits are zero.
+ */
+void pcg32_fill(uint64_t* state, uint32_t* out, uint64_t num, uint8_t bits) {
+  uint64_t s = *state;
+
+  for (uint64_t i = 0; i < num; i++) {
+		uint64_t old = s;
+		s = old * 6364136223846793005ULL + 1442695040888963407ULL;
+		uint32_t xorshifted = ((old >> 18u) ^ old) >> 27u;
+		uint32_t rot = old >> 59u;
+		out[i] = ((xorshifted >> rot) | (xorshifted << ((-rot) & 31))) >> (32 - bits);
+  }
+  *state = s;
+}
+
 void apply_bucket_lut(uint8_t * bitmap, uint64_t bitmap_size) {
   for (uint64_t i = 0; i < bitmap_size; i++) {
 		bitmap[i] = bucket_lut[bitmap[i]];
@@ -126,7 +437,7 @@ uint8_t could_be_bitflip(uint32_t xor_val) {
   })
 
 /* Adopted from American Fuzzy Lop (AFL) by Michal Zalewski */
-uint8_t could_be_arith(uint32_t old_val, uint32_t new_val, uint8_t blen, uint8_t ARITH_MAX) {
+uint8_t could_be_arith(uint32_t old_val, uint32_t new_val, uint8_t blen, uint32_t ARITH_MAX) {
 
   uint32_t i, ov = 0, nv = 0, diffs = 0;
 
@@ -311,3 +622,128 @@ uint8_t could_be_interest(uint32_t old_val, uint32_t new_val, uint8_t blen, uint
   return 0;
 
 }
+
+/* add candidate value for current offset, unless already planned since index first */
+static inline uint64_t det_plan_add(uint32_t* off_out, uint32_t* val_out, uint64_t count,
+                                    uint64_t first, uint32_t offset, uint32_t value) {
+  for (uint64_t k = first; k < count; k++) {
+		if (val_out[k] == value)
+			return count;
+  }
+  off_out[count] = offset;
+  val_out[count] = value;
+  return count + 1;
+}
+
+/**
+ * @brief Plan AFL arithmetic or interesting value mutations of a payload.
+ *
+ * Emits the same candidates as the Python stages in arithmetic.py and
+ * interesting_values.py, minus duplicates at the same offset. Each candidate
+ * is an offset and a value to be written little-endian with <width> bytes.
+ *
+ * @param interest 0 for arithmetic, 1 for interesting values.
+ * @param width Width of mutation in bytes (1, 2 or 4).
+ * @param eff_map Effector map of len bytes, or NULL.
+ * @param values Interesting values for this width (unused for arithmetic).
+ * @param offset Payload offset to start at, updated to the first offset not planned yet.
+ * @param max_out Capacity of off_out and val_out.
+ * @return number of candidates written to off_out and val_out.
+ */
+uint64_t det_plan(uint8_t interest, uint8_t width, uint8_t* data, uint64_t len, uint8_t* eff_map,
+                  uint8_t skip_null, uint32_t arith_max, int32_t* values, uint32_t num_values,
+                  uint64_t* offset, uint32_t* off_out, uint32_t* val_out, uint64_t max_out) {
+  uint64_t count = 0;
+  uint64_t per_offset = interest ? 2*num_values : 4*arith_max;
+  uint64_t i;
+
+  for (i = *offset; i + width <= len; i++) {
+		if (max_out - count < per_offset)
+			break;
+
+		if (eff_map) {
+			uint8_t eff = 0;
+			for (uint8_t k = 0; k < width; k++)
+				eff |= eff_map[i+k];
+			if (!eff)
+				continue;
+		}
+
+		uint32_t num1 = data[i];
+		if (width == 2)
+			num1 = data[i] | (data[i+1] << 8);
+		if (width == 4)
+			num1 = data[i] | (data[i+1] << 8) | (data[i+2] << 16) | ((uint32_t)data[i+3] << 24);
+
+		if (skip_null && num1 == 0)
+			continue;
+
+		uint64_t first = count;
+
+		if (!interest && width == 1) {
+			for (uint32_t j = 1; j <= arith_max; j++) {
+				uint8_t r1 = num1 + j;
+				uint8_t r2 = num1 - j;
+				if (!could_be_bitflip(num1 ^ r1))
+					count = det_plan_add(off_out, val_out, count, first, i, r1);
+				if (!could_be_bitflip(num1 ^ r2))
+					count = det_plan_add(off_out, val_out, count, first, i, r2);
+			}
+		} else if (!interest && width == 2) {
+			uint16_t num2 = SWAP16(num1);
+			for (uint32_t j = 1; j <= arith_max; j++) {
+				uint16_t r1 = num1 + j;
+				uint16_t r2 = num1 - j;
+				uint16_t r3 = num2 + j;
+				uint16_t r4 = num2 - j;
+				if ((num1 ^ r1) > 0xff && !could_be_bitflip(num1 ^ r1))
+					count = det_plan_add(off_out, val_out, count, first, i, r1);
+				if ((num1 ^ r2) > 0xff && !could_be_bitflip(num1 ^ r2))
+					count = det_plan_add(off_out, val_out, count, first, i, r2);
+				if ((num2 ^ r3) > 0xff && (uint16_t)SWAP16(r1) != r3 && !could_be_bitflip(num2 ^ r3))
+					count = det_plan_add(off_out, val_out, count, first, i, (uint16_t)SWAP16(r3));
+				if ((num2 ^ r4) > 0xff && (uint16_t)SWAP16(r4) != r4 && !could_be_bitflip(num2 ^ r4))
+					count = det_plan_add(off_out, val_out, count, first, i, (uint16_t)SWAP16(r4));
+			}
+		} else if (!interest && width == 4) {
+			uint32_t num2 = SWAP32(num1);
+			for (uint32_t j = 1; j <= arith_max; j++) {
+				uint32_t r1 = num1 + j;
+				uint32_t r2 = num1 - j;
+				uint32_t r3 = num2 + j;
+				uint32_t r4 = num2 - j;
+				if ((num1 ^ r1) > 0xffff && !could_be_bitflip(num1 ^ r1))
+					count = det_plan_add(off_out, val_out, count, first, i, r1);
+				if ((num1 ^ r2) > 0xffff && !could_be_bitflip(num1 ^ r2))
+					count = det_plan_add(off_out, val_out, count, first, i, r2);
+				if ((num2 ^ r3) > 0xffff && !could_be_bitflip(num2 ^ r3))
+					count = det_plan_add(off_out, val_out, count, first, i, SWAP32(r3));
+				if ((num2 ^ r4) > 0xffff && !could_be_bitflip(num2 ^ r4))
+					count = det_plan_add(off_out, val_out, count, first, i, SWAP32(r4));
+			}
+		} else if (width == 1) {
+			for (uint32_t j = 0; j < num_values; j++) {
+				uint8_t value = values[j];
+				if (!could_be_bitflip(num1 ^ value) && !could_be_arith(num1, value, 1, arith_max))
+					count = det_plan_add(off_out, val_out, count, first, i, value);
+			}
+		} else {
+			uint32_t mask = width == 2 ? 0xffff : 0xffffffff;
+			for (uint32_t j = 0; j < num_values; j++) {
+				uint32_t value = values[j] & mask;
+				uint32_t swapped = width == 2 ? (uint16_t)SWAP16(value) : SWAP32(value);
+				if (!could_be_bitflip(num1 ^ value) &&
+				    !could_be_arith(num1, value, width, arith_max) &&
+				    !could_be_interest(num1, value, width, 0))
+					count = det_plan_add(off_out, val_out, count, first, i, value);
+				if (value != swapped &&
+				    !could_be_bitflip(num1 ^ swapped) &&
+				    !could_be_arith(num1, swapped, width, arith_max) &&
+				    !could_be_interest(num1, swapped, width, 1))
+					count = det_plan_add(off_out, val_out, count, first, i, swapped);
+			}
+		}
+  }
+  *offset = i;
+  return count;
+}
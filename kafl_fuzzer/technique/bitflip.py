@@ -5,11 +5,20 @@
 
 """
 AFL-style bitflip mutations (deterministic stage).
+
+All mutators only modify offsets in range [start:end], so that a stage can
+be resumed or split into multiple parts.
 """
 
-def mutate_seq_walking_bits(data, func, skip_null=False, effector_map=None):
+def stop_offset(data, end):
+    if end is None:
+        return len(data)
+    return min(end, len(data))
+
+
+def mutate_seq_walking_bits(data, func, skip_null=False, effector_map=None, start=0, end=None):
 
-    for i in range(len(data)):
+    for i in range(start, stop_offset(data, end)):
         orig = data[i]
 
         if effector_map:
@@ -24,10 +33,10 @@ def mutate_seq_walking_bits(data, func, skip_null=False, effector_map=None):
             data[i] = orig
 
 
-def mutate_seq_two_walking_bits(data, func, skip_null=False, effector_map=None):
+def mutate_seq_two_walking_bits(data, func, skip_null=False, effector_map=None, start=0, end=None):
     if len(data) == 0: return
 
-    for i in range(len(data)-1):
+    for i in range(start, min(stop_offset(data, end), len(data)-1)):
 
         if effector_map:
             if effector_map[i:i+2] == bytes(2):
@@ -52,6 +61,8 @@ def mutate_seq_two_walking_bits(data, func, skip_null=False, effector_map=None):
 
     # special round for last byte
     i=len(data)-1
+    if not start <= i < stop_offset(data, end):
+        return
     orig = data[i]
 
     if effector_map and not effector_map[i]:
@@ -66,10 +77,10 @@ def mutate_seq_two_walking_bits(data, func, skip_null=False, effector_map=None):
         data[i] = orig
 
 
-def mutate_seq_four_walking_bits(data, func, skip_null=False, effector_map=None):
+def mutate_seq_four_walking_bits(data, func, skip_null=False, effector_map=None, start=0, end=None):
     if len(data) == 0: return
 
-    for i in range(len(data)-1):
+    for i in range(start, min(stop_offset(data, end), len(data)-1)):
 
         if effector_map:
             if effector_map[i:i+2] == bytes(2):
@@ -103,6 +114,8 @@ def mutate_seq_four_walking_bits(data, func, skip_null=False, effector_map=None)
 
     # special round for last byte
     i=len(data)-1
+    if not start <= i < stop_offset(data, end):
+        return
     orig = data[i]
 
     if effector_map and not effector_map[i]:
@@ -117,12 +130,13 @@ def mutate_seq_four_walking_bits(data, func, skip_null=False, effector_map=None)
         data[i] = orig
 
 
-def mutate_seq_walking_byte(data, func, effector_map=None, limiter_map=None, skip_null=False):
+def mutate_seq_walking_byte(data, func, effector_map=None, limiter_map=None, skip_null=False, start=0, end=None, orig_bitmap=None):
 
-    if effector_map:
+    # callers resuming the stage can pass in a previous baseline
+    if effector_map and orig_bitmap is None:
         orig_bitmap, _ = func(data)
 
-    for i in range(len(data)):
+    for i in range(start, stop_offset(data, end)):
         if limiter_map:
             if not limiter_map[i]:
                 continue
@@ -137,11 +151,11 @@ def mutate_seq_walking_byte(data, func, effector_map=None, limiter_map=None, ski
         data[i] ^= 0xFF
 
 
-def mutate_seq_two_walking_bytes(data, func, effector_map=None, skip_null=False):
+def mutate_seq_two_walking_bytes(data, func, effector_map=None, skip_null=False, start=0, end=None):
     if len(data) <= 1:
         return
 
-    for i in range(0, len(data)-1):
+    for i in range(start, min(stop_offset(data, end), len(data)-1)):
         if effector_map:
             if effector_map[i:i+2] == bytes(2):
                 continue
@@ -156,11 +170,11 @@ def mutate_seq_two_walking_bytes(data, func, effector_map=None, skip_null=False)
         data[i+1] ^= 0xFF
 
 
-def mutate_seq_four_walking_bytes(data, func, effector_map=None, skip_null=False):
+def mutate_seq_four_walking_bytes(data, func, effector_map=None, skip_null=False, start=0, end=None):
     if len(data) <= 3:
         return
 
-    for i in range(0, len(data)-3):
+    for i in range(start, min(stop_offset(data, end), len(data)-3)):
 
         if effector_map:
             if effector_map[i:i+4] == bytes(4):
@@ -0,0 +1,93 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Progress tracking for the AFL-style deterministic stage.
+
+The stage is a fixed sequence of sub-stages, each walking over all payload
+offsets. Progress is recorded in the node's afl_det_info as the current
+sub-stage plus an offset cursor, so that Workers can stop after any slice of
+offsets and resume later. The Manager may also hand out disjoint offset
+ranges [start:end] of a sub-stage to multiple Workers, see DetShards.
+
+The effector map is built during flip_8/1 and used by all later sub-stages.
+"""
+
+from kafl_fuzzer.technique.helper import interesting_8_Bit, interesting_16_Bit, interesting_32_Bit
+
+STAGES = ["flip_1/1", "flip_2/1", "flip_4/1",
+          "flip_8/1", "flip_8/2", "flip_8/4",
+          "arith_1", "arith_2", "arith_4",
+          "int_1", "int_2", "int_4",
+          "done"]
+
+# stages recorded by previous versions, resume at their first sub-stage
+LEGACY_STAGES = {"flip_1": "flip_1/1", "flip_8": "flip_8/1", "arith": "arith_1", "intr": "int_1"}
+
+SLICE_EXECS = 1024       # approx. executions between checks for stage timeout
+EFFECTOR_MIN_LEN = 128   # build effector maps only for larger payloads
+
+
+def resume_info(det_info):
+    if not det_info:
+        return {"stage": STAGES[0], "offset": 0}
+    det_info = dict(det_info)
+    det_info["stage"] = LEGACY_STAGES.get(det_info["stage"], det_info["stage"])
+    det_info.setdefault("offset", 0)
+    return det_info
+
+def next_stage(stage):
+    return STAGES[STAGES.index(stage) + 1]
+
+def execs_per_offset(stage, arith_max):
+    # upper bound for number of executions per payload offset
+    if stage in ["flip_1/1", "flip_2/1", "flip_4/1"]:
+        return 8
+    if stage == "arith_1":
+        return 2*arith_max
+    if stage in ["arith_2", "arith_4"]:
+        return 4*arith_max
+    if stage == "int_1":
+        return len(interesting_8_Bit)
+    if stage == "int_2":
+        return 2*len(interesting_16_Bit)
+    if stage == "int_4":
+        return 2*len(interesting_32_Bit)
+    return 1
+
+def slice_len(stage, arith_max):
+    # number of offsets to process before checking for timeout again
+    return max(1, SLICE_EXECS // max(1, execs_per_offset(stage, arith_max)))
+
+def use_effector_map(config, payload_len):
+    return not config.afl_no_effector and payload_len > EFFECTOR_MIN_LEN
+
+def create_limiter_map(config, payload_len):
+    limiter_map = bytearray([1 for _ in range(payload_len)])
+    if config.afl_skip_range:
+        for ignores in config.afl_skip_range:
+            for i in range(min(ignores[0], payload_len), min(ignores[1], payload_len)):
+                limiter_map[i] = 0
+
+    return limiter_map
+
+def dilate_effector_map(effector_map, limiter_map):
+    ignore_limit = 2
+    effector_map[0] = 1
+    effector_map[-1] = 1
+    for i in range(len(effector_map) // ignore_limit):
+        base = i * ignore_limit
+        effector_slice = effector_map[base:base + ignore_limit]
+        limiter_slice = limiter_map[base:base + ignore_limit]
+        if any(effector_slice) and any(limiter_slice):
+            for j in range(len(effector_slice)):
+                effector_map[i + j] = 1
+
+def finish_effector_map(det_info, limiter_map):
+    # after flip_8/1, dilate the effector map or fall back to the limiter map
+    if "eff_map" in det_info:
+        det_info["eff_map"] = bytearray(det_info["eff_map"])
+        dilate_effector_map(det_info["eff_map"], limiter_map)
+    elif limiter_map:
+        det_info["eff_map"] = bytearray(limiter_map)
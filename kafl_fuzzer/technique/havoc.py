@@ -11,6 +11,9 @@ import glob
 
 from kafl_fuzzer.common.rand import rand
 from kafl_fuzzer.technique.havoc_handler import *
+from kafl_fuzzer.technique.splice import SplicePool
+
+splice_pool = None
 
 
 def load_dict(file_name):
@@ -27,7 +30,7 @@ def load_dict(file_name):
 
 
 def init_havoc(config):
-    global location_corpus
+    global location_corpus, splice_pool
     if config.dict:
         set_dict(load_dict(config.dict))
     # AFL havoc adds these at runtime as soon as available dicts are non-empty
@@ -36,6 +39,9 @@ def init_havoc(config):
         append_handler(havoc_dict_replace)
 
     location_corpus = config.work_dir + "/corpus/"
+    # filled with node IDs received from Manager, see Worker.loop()
+    # Workers behind a relay also receive the payloads, as they have no access to the corpus
+    splice_pool = SplicePool(None if config.relay else config.work_dir, config.splice_cache)
 
 
 def havoc_range(perf_score):
@@ -47,31 +53,44 @@ def havoc_range(perf_score):
     return max_iterations
 
 
-def mutate_seq_havoc_array(data, func, max_iterations, resize=False):
+def mutate_seq_havoc_array(data, func, max_iterations, resize=False, schedule=None):
+    # stacked mutations are applied in place, bytes are only created for func()
+    # with a HavocSchedule, the mutations only depend on data and its seed
     if resize:
-        data = data + data
+        buf = bytearray(data + data)
     else:
-        data = data
+        buf = bytearray(data)
 
-    stacking = rand.int(AFL_HAVOC_STACK_POW2)
+    rng = schedule or rand
+    stacking = rng.int(AFL_HAVOC_STACK_POW2)
     stacking = 1 << (stacking)
     for _ in range(1+max_iterations//stacking):
         for _ in range(stacking):
-            handler = rand.select(havoc_handler)
-            data = handler(data)[:KAFL_MAX_FILE]
-            func(data)
-
-def mutate_seq_splice_array(data, func, max_iterations, resize=False):
-    global location_corpus
+            handler = rng.select(havoc_handler)
+            havoc_apply_inplace(handler, buf, rng)
+            if len(buf) > KAFL_MAX_FILE:
+                del buf[KAFL_MAX_FILE:]
+            func(bytes(buf))
+
+def mutate_seq_splice_array(data, func, max_iterations, resize=False, schedule=None):
+    global location_corpus, splice_pool
     havoc_rounds = 4
     splice_rounds = max_iterations//havoc_rounds
-    files = glob.glob(location_corpus + "/regular/payload_*")
+    files = None
+    if not splice_pool:
+        # no node IDs received (--splice-cache 0), not supported with --corpus-store
+        files = glob.glob(location_corpus + "/regular/payload_*")
     for _ in range(splice_rounds):
-        spliced_data = havoc_splicing(data, files)
+        if files is None:
+            spliced_data = data if len(data) < 2 else \
+                    havoc_splice_with(data, splice_pool.partners(data, SPLICE_RETRY_LIMIT))
+        else:
+            spliced_data = havoc_splicing(data, files)
         if spliced_data is None:
             return # could not find any suitable splice pair for this file
         func(spliced_data)
         mutate_seq_havoc_array(spliced_data,
                                func,
                                havoc_rounds,
-                               resize=resize)
+                               resize=resize,
+                               schedule=schedule)
@@ -8,6 +8,7 @@ AFL-style havoc mutations (havoc stage)
 """
 
 import logging
+import struct
 from kafl_fuzzer.common.rand import rand
 from kafl_fuzzer.common.util import read_binary_file, find_diffs
 from kafl_fuzzer.technique.helper import *
@@ -220,20 +221,16 @@ def havoc_perform_byte_seq_extra2(data):
     pass
 
 
-def havoc_splicing(data, files):
-    if len(data) < 2 or files is None:
-        return data
+SPLICE_RETRY_LIMIT = 64
 
-    rand.shuffle(files)
-    retry_limit = 64
-
-    for file in files[:retry_limit]:
-        file_data = read_binary_file(file)
+def havoc_splice_with(data, partners):
+    # splice data with the first suitable payload from partners, or None
+    for file_data in partners:
         if len(file_data) < 2:
             continue
 
         first_diff, last_diff = find_diffs(data, file_data)
-        if last_diff < 2 or first_diff == last_diff:
+        if first_diff < 0 or last_diff < 2 or first_diff == last_diff:
             continue
 
         split_location = first_diff + rand.int(last_diff - first_diff)
@@ -243,6 +240,14 @@ def havoc_splicing(data, files):
     return None
 
 
+def havoc_splicing(data, files):
+    if len(data) < 2 or files is None:
+        return data
+
+    rand.shuffle(files)
+    return havoc_splice_with(data, (read_binary_file(file) for file in files[:SPLICE_RETRY_LIMIT]))
+
+
 dict_set = set()
 dict_import = []
 
@@ -307,45 +312,35 @@ def dict_replace_sequence(data, entry, entry_pos=None):
         entry_pos = rand.int(max([0, len(data) - len(entry)]))
     return b''.join([data[:entry_pos], entry, data[entry_pos:]])
 
-def havoc_dict_insert(data):
+def select_dict_entry(rng=rand):
     global redqueen_dict
     global dict_import
 
     has_redq = len(redqueen_dict) > 0
     has_dict = len(dict_import) > 0
-    coin = rand.int(2)
+    coin = rng.int(2)
 
     if not has_dict and has_redq and coin:
-        addr = rand.select(redqueen_addr_list)
+        addr = rng.select(redqueen_addr_list)
         dict_values = list(redqueen_dict[addr])
-        dict_entry = rand.select(dict_values)
-        return dict_insert_sequence(data, dict_entry)
+        return rng.select(dict_values)
 
     elif has_dict:
-        dict_entry = rand.select(dict_import)
         #dict_entry = dict_entry[:len(data)]
-        return dict_insert_sequence(data, dict_entry)
-    return data
-
-def havoc_dict_replace(data):
-    global redqueen_dict
-    global dict_import
-
-    has_redq = len(redqueen_dict) > 0
-    has_dict = len(dict_import) > 0
-    coin = rand.int(2)
+        return rng.select(dict_import)
+    return None
 
-    if not has_dict and has_redq and coin:
-        addr = rand.select(redqueen_addr_list)
-        dict_values = list(redqueen_dict[addr])
-        dict_entry = rand.select(dict_values)
-        return dict_replace_sequence(data, dict_entry)
+def havoc_dict_insert(data):
+    dict_entry = select_dict_entry()
+    if dict_entry is None:
+        return data
+    return dict_insert_sequence(data, dict_entry)
 
-    elif has_dict:
-        dict_entry = rand.select(dict_import)
-        #dict_entry = dict_entry[:len(data)]
-        return dict_replace_sequence(data, dict_entry)
-    return data
+def havoc_dict_replace(data):
+    dict_entry = select_dict_entry()
+    if dict_entry is None:
+        return data
+    return dict_replace_sequence(data, dict_entry)
 
 
 
@@ -372,3 +367,159 @@ havoc_handler = [havoc_perform_bit_flip,
                  # havoc_perform_byte_seq_extra2,
                  # havoc_insert_line,
                  ]
+
+
+# In-place variants of the above handlers, operating on a bytearray that is
+# reused for all stacked mutations of a havoc round. With the default rng, they
+# consume the same random numbers as their counterparts and produce the same
+# results. See havoc_schedule.py for the alternative rng.
+
+INPLACE_ORDER = (">", "<")  # same as ("big", "little")
+
+def inplace_bit_flip(buf, rng=rand):
+    if len(buf) < 1:
+        return
+    bit = rng.int(len(buf)*8)
+    buf[bit//8] ^= 0x80 >> (bit % 8)
+
+def inplace_interesting_value_8(buf, rng=rand):
+    if len(buf) < 1:
+        return
+    pos = rng.int(len(buf))
+    buf[pos] = rng.select(interesting_8_Bit) & 0xff
+
+def inplace_interesting_value_16(buf, rng=rand):
+    if len(buf) < 2:
+        return
+    order = rng.select(INPLACE_ORDER)
+    pos = rng.int(len(buf) - 1)
+    struct.pack_into(order + "h", buf, pos, rng.select(interesting_16_Bit))
+
+def inplace_interesting_value_32(buf, rng=rand):
+    if len(buf) < 4:
+        return
+    order = rng.select(INPLACE_ORDER)
+    pos = rng.int(len(buf) - 3)
+    struct.pack_into(order + "i", buf, pos, rng.select(interesting_32_Bit))
+
+def inplace_byte_subtraction_8(buf, rng=rand):
+    if len(buf) < 1:
+        return
+    pos = rng.int(len(buf))
+    buf[pos] = (buf[pos] - 1 - rng.int(AFL_ARITH_MAX)) % 0xff
+
+def inplace_byte_addition_8(buf, rng=rand):
+    if len(buf) < 1:
+        return
+    pos = rng.int(len(buf))
+    buf[pos] = (buf[pos] + 1 + rng.int(AFL_ARITH_MAX)) % 0xff
+
+def inplace_arith(buf, fmt, size, mask, sign, rng):
+    if len(buf) < size:
+        return
+    fmt = rng.select(INPLACE_ORDER) + fmt
+    pos = rng.int(len(buf) - size + 1)
+    value = struct.unpack_from(fmt, buf, pos)[0]
+    struct.pack_into(fmt, buf, pos, (value + sign*(1 + rng.int(AFL_ARITH_MAX))) % mask)
+
+def inplace_byte_subtraction_16(buf, rng=rand):
+    inplace_arith(buf, "H", 2, 0xffff, -1, rng)
+
+def inplace_byte_addition_16(buf, rng=rand):
+    inplace_arith(buf, "H", 2, 0xffff, 1, rng)
+
+def inplace_byte_subtraction_32(buf, rng=rand):
+    inplace_arith(buf, "I", 4, 0xffffffff, -1, rng)
+
+def inplace_byte_addition_32(buf, rng=rand):
+    inplace_arith(buf, "I", 4, 0xffffffff, 1, rng)
+
+def inplace_set_random_byte_value(buf, rng=rand):
+    if len(buf) < 1:
+        return
+    pos = rng.int(len(buf))
+    buf[pos] ^= 1 + rng.int(255)
+
+def inplace_delete_random_byte(buf, rng=rand):
+    if len(buf) < 2:
+        return
+    del_length = AFL_choose_block_len(len(buf) - 1, rng)
+    del_from = rng.int(len(buf) - del_length + 1)
+    del buf[del_from:del_from + del_length]
+
+def inplace_clone_random_byte(buf, rng=rand):
+    data_len = len(buf)
+    if data_len < 1 or data_len + HAVOC_BLK_XL >= KAFL_MAX_FILE:
+        return
+
+    if rng.int(4):
+        clone_len = AFL_choose_block_len(data_len, rng)
+        clone_from = rng.int(data_len - clone_len + 1)
+        body = buf[clone_from: clone_from + clone_len]
+    else:
+        clone_len = AFL_choose_block_len(HAVOC_BLK_XL, rng)
+        val = rng.int(256) if rng.int(2) else rng.select(buf)
+        body = bytes((val,)) * clone_len
+
+    clone_to = rng.int(data_len)
+    buf[clone_to:clone_to] = body
+
+def inplace_byte_seq_override(buf, rng=rand):
+    if len(buf) < 2:
+        return
+
+    copy_len = AFL_choose_block_len(len(buf) - 1, rng)
+    copy_from = rng.int(len(buf) - copy_len + 1)
+    copy_to = rng.int(len(buf) - copy_len + 1)
+
+    body = b''
+    if rng.int(4):
+        if copy_from != copy_to:
+            body = buf[copy_from: copy_from + copy_len]
+    else:
+        value = rng.int(256) if rng.int(2) else rng.select(buf)
+        body = bytes((value,)) * copy_len
+
+    buf[copy_to:copy_to+copy_len] = body
+
+def inplace_dict_insert(buf, rng=rand):
+    dict_entry = select_dict_entry(rng)
+    if dict_entry is None:
+        return
+    entry_pos = rng.int(max([0, len(buf) - len(dict_entry)]))
+    buf[entry_pos:entry_pos+len(dict_entry)] = dict_entry
+
+def inplace_dict_replace(buf, rng=rand):
+    dict_entry = select_dict_entry(rng)
+    if dict_entry is None:
+        return
+    entry_pos = rng.int(max([0, len(buf) - len(dict_entry)]))
+    buf[entry_pos:entry_pos] = dict_entry
+
+
+havoc_inplace = {havoc_perform_bit_flip: inplace_bit_flip,
+                 havoc_perform_insert_interesting_value_8: inplace_interesting_value_8,
+                 havoc_perform_insert_interesting_value_16: inplace_interesting_value_16,
+                 havoc_perform_insert_interesting_value_32: inplace_interesting_value_32,
+                 havoc_perform_byte_subtraction_8: inplace_byte_subtraction_8,
+                 havoc_perform_byte_addition_8: inplace_byte_addition_8,
+                 havoc_perform_byte_subtraction_16: inplace_byte_subtraction_16,
+                 havoc_perform_byte_addition_16: inplace_byte_addition_16,
+                 havoc_perform_byte_subtraction_32: inplace_byte_subtraction_32,
+                 havoc_perform_byte_addition_32: inplace_byte_addition_32,
+                 havoc_perform_set_random_byte_value: inplace_set_random_byte_value,
+                 havoc_perform_delete_random_byte: inplace_delete_random_byte,
+                 havoc_perform_clone_random_byte: inplace_clone_random_byte,
+                 havoc_perform_byte_seq_override: inplace_byte_seq_override,
+                 havoc_dict_insert: inplace_dict_insert,
+                 havoc_dict_replace: inplace_dict_replace,
+                 }
+
+
+def havoc_apply_inplace(handler, buf, rng=rand):
+    # apply handler to buf, falling back to the copying version if there is no in-place variant
+    inplace = havoc_inplace.get(handler, None)
+    if inplace:
+        inplace(buf, rng)
+    else:
+        buf[:] = handler(bytes(buf))
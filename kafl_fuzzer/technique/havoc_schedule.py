@@ -0,0 +1,56 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Seeded random schedule for havoc rounds.
+
+Random numbers for many stacking rounds are drawn in a single native call
+and then consumed by the in-place havoc handlers via the same int()/select()
+interface as common.rand. The mutations performed by a havoc stage only
+depend on the input and the seed, so a round can be replayed for debugging.
+"""
+
+import ctypes
+
+from kafl_fuzzer.native import loader as native_loader
+
+SCHEDULE_SIZE = 4096     # number of words drawn at once
+SCHEDULE_BITS = 30       # keep words in a single CPython int digit
+
+
+class HavocSchedule:
+
+    native_so = None
+
+    def __init__(self, seed):
+        if not HavocSchedule.native_so:
+            HavocSchedule.native_so = ctypes.CDLL(native_loader.bitmap_path())
+        self.seed = seed
+        # spread small seeds over the state space
+        self.state = ctypes.c_uint64((seed * 0x9e3779b97f4a7c15 + 1) & 0xffffffffffffffff)
+        self.words = (ctypes.c_uint32 * SCHEDULE_SIZE)()
+        self.next = iter(()).__next__
+
+    def draw(self):
+        HavocSchedule.native_so.pcg32_fill(ctypes.byref(self.state), self.words,
+                                           ctypes.c_uint64(SCHEDULE_SIZE), ctypes.c_uint8(SCHEDULE_BITS))
+        self.next = iter(self.words[:]).__next__
+
+    # return integer N := 0 <= n < limit
+    # modulo bias is negligible for the small limits used by havoc handlers
+    def int(self, limit):
+        try:
+            return self.next() % limit
+        except StopIteration:
+            self.draw()
+            return self.int(limit)
+        except ZeroDivisionError:
+            return 0
+
+    def select(self, arg):
+        try:
+            return arg[self.next() % len(arg)]
+        except StopIteration:
+            self.draw()
+            return self.select(arg)
@@ -10,7 +10,7 @@ Helper functions used by fuzzing inference and mutation algorithms
 import struct
 
 import ctypes
-from ctypes import c_uint8, c_uint32
+from ctypes import c_uint8, c_uint32, c_uint64
 
 from kafl_fuzzer.common.rand import rand
 from kafl_fuzzer.native import loader as native_loader
@@ -35,9 +35,12 @@ interesting_8_Bit = [-128, -1, 0, 1, 16, 32, 64, 100, 127]
 interesting_16_Bit = interesting_8_Bit + [-32768, -129, 128, 255, 256, 512, 1000, 1024, 4096, 32767]
 interesting_32_Bit = interesting_16_Bit + [-2147483648, -100663046, -32769, 32768, 65535, 65536, 100663045, 2147483647]
 
+# max number of candidates planned per native call
+DET_PLAN_CHUNK = 1 << 14
+
 
 # Todo
-def AFL_choose_block_len(limit):
+def AFL_choose_block_len(limit, rng=rand):
     global HAVOC_BLK_SMALL
     global HAVOC_BLK_MEDIUM
     global HAVOC_BLK_LARGE
@@ -48,7 +51,7 @@ def AFL_choose_block_len(limit):
     # u32 rlim = MIN(queue_cycle, 3);
     # if (!run_over10m) rlim = 1;
     rlim = 1
-    case = rand.int(rlim)
+    case = rng.int(rlim)
     if case == 0:
         min_value = 1
         max_value = HAVOC_BLK_SMALL
@@ -56,7 +59,7 @@ def AFL_choose_block_len(limit):
         min_value = HAVOC_BLK_SMALL
         max_value = HAVOC_BLK_MEDIUM
     else:
-        case = rand.int(10)
+        case = rng.int(10)
         if case == 0:
             min_value = HAVOC_BLK_LARGE
             max_value = HAVOC_BLK_XL
@@ -67,7 +70,7 @@ def AFL_choose_block_len(limit):
     if min_value >= limit:
         min_value = 1;
 
-    return min_value + rand.int(MIN(max_value, limit) - min_value + 1);
+    return min_value + rng.int(MIN(max_value, limit) - min_value + 1);
 
 
 # Todo
@@ -114,14 +117,62 @@ def helper_init():
         bitmap_native_so.could_be_bitflip.restype = c_uint8
         bitmap_native_so.could_be_arith.restype = c_uint8
         bitmap_native_so.could_be_interest.restype = c_uint8
+        bitmap_native_so.det_plan.restype = c_uint64
 
 def is_not_bitflip(value):
     return 0 == bitmap_native_so.could_be_bitflip(c_uint32(value))
 
 def is_not_arithmetic(value, new_value, num_bytes, arith_max=AFL_ARITH_MAX):
     return 0 == bitmap_native_so.could_be_arith(c_uint32(value), c_uint32(new_value),
-                                                c_uint8(num_bytes), c_uint8(arith_max))
+                                                c_uint8(num_bytes), c_uint32(arith_max))
 
 def is_not_interesting(value, new_value, num_bytes, le):
     return 0 == bitmap_native_so.could_be_interest(c_uint32(value), c_uint32(new_value),
                                                    c_uint8(num_bytes), c_uint8(le))
+
+def plan_deterministic(data, width, interest=False, effector_map=None, skip_null=False, arith_max=AFL_ARITH_MAX,
+                       start=0, end=None):
+    """
+    Yield the (offset, value) candidates of an AFL arithmetic or interesting
+    value stage over data[start:end], in the order of the reference loops but
+    without candidates that repeat a value at the same offset. The value is to
+    be written little-endian with <width> bytes.
+
+    Candidates are filtered and planned natively in chunks of DET_PLAN_CHUNK,
+    so the caller only loops over mutations that are actually executed.
+    """
+    # offsets before end may still write up to width-1 bytes past it
+    limit = len(data) if end is None else min(len(data), end + width - 1)
+    data = bytes(data[:limit])
+    if effector_map:
+        eff_map = bytes(effector_map[:limit])
+    else:
+        eff_map = None
+
+    table = {1: interesting_8_Bit, 2: interesting_16_Bit, 4: interesting_32_Bit}[width]
+    values = (ctypes.c_int32 * len(table))(*table)
+
+    offset = c_uint64(start)
+    off_out = (c_uint32 * DET_PLAN_CHUNK)()
+    val_out = (c_uint32 * DET_PLAN_CHUNK)()
+    while offset.value + width <= len(data):
+        num = bitmap_native_so.det_plan(c_uint8(interest), c_uint8(width), data, c_uint64(len(data)), eff_map,
+                                        c_uint8(skip_null), c_uint32(arith_max), values, c_uint32(len(table)),
+                                        ctypes.byref(offset), off_out, val_out, c_uint64(DET_PLAN_CHUNK))
+        yield from zip(off_out[:num], val_out[:num])
+
+def execute_plan(data, func, label, width, plan):
+    # apply planned (offset, value) mutations to data in place, restoring each offset when done
+    fmt = {1: "B", 2: "<H", 4: "<I"}[width]
+    cur = None
+    orig = None
+    for offset, value in plan:
+        if offset != cur:
+            if cur is not None:
+                data[cur:cur+width] = orig
+            cur = offset
+            orig = data[offset:offset+width]
+        struct.pack_into(fmt, data, offset, value)
+        func(data, label=label)
+    if cur is not None:
+        data[cur:cur+width] = orig
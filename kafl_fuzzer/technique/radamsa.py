@@ -5,42 +5,149 @@
 
 """
 Interface to Radamsa fuzzer (optional havoc stage)
+
+By default, a long-lived Radamsa process generates an endless stream of
+inputs, connecting to a local socket of the Worker for each one (-o host:port).
+Generated inputs are passed to the fuzzer directly, without temp files.
+If this fails, we fall back to rounds of Radamsa writing up to 512 files.
+
+Samples are taken from the Worker's splice pool of regular node IDs and
+written to a private sample directory, since payloads may not exist as
+files in the workdir (--corpus-store, or Workers behind a relay).
 """
 
+import atexit
 import glob
 import math
 import os
 import random
+import socket
 import subprocess
 import logging
 
-from kafl_fuzzer.common.util import read_binary_file
+from kafl_fuzzer.common.util import read_binary_file, atomic_write
+from kafl_fuzzer.technique import havoc
 from kafl_fuzzer.technique.helper import KAFL_MAX_FILE
 
 logger = logging.getLogger(__name__)
 
+RADAMSA_TIMEOUT = 10         # max seconds to wait for the next input
+RADAMSA_RESTART = 4096       # restart stream with new samples after this many inputs
+
+radamsa_stream = None
+
 def init_radamsa(config, pid):
     global corpus_dir
+    global sample_dir
     global input_dir
     global radamsa_path
+    global radamsa_stream
 
     corpus_dir = config.work_dir + "/corpus/"
     radamsa_path = config.radamsa_path
     input_dir = config.work_dir + "/radamsa_%d/" % pid
+    sample_dir = config.work_dir + "/radamsa_%d_samples/" % pid
 
-    if not os.path.isdir(input_dir):
-        os.makedirs(input_dir)
+    for path in [input_dir, sample_dir]:
+        if not os.path.isdir(path):
+            os.makedirs(path)
 
-def perform_radamsa_round(data, func, num_inputs):
+    if config.radamsa:
+        radamsa_stream = RadamsaStream(radamsa_path)
+
+def select_samples():
     global corpus_dir
-    global input_dir
-    global radamsa_path
+    global sample_dir
 
     last_n = 10
     rand_n = 40
-    files = sorted(glob.glob(corpus_dir + "/regular/payload_*"))
-    samples = files[-last_n:] + random.sample(files[:-last_n], max(0, min(rand_n, len(files) - last_n)))
+    if not havoc.splice_pool:
+        # no node IDs received (--splice-cache 0), use corpus files directly
+        files = sorted(glob.glob(corpus_dir + "/regular/payload_*"))
+        return files[-last_n:] + random.sample(files[:-last_n], max(0, min(rand_n, len(files) - last_n)))
+
+    ids = havoc.splice_pool.ids
+    ids = ids[-last_n:] + random.sample(ids[:-last_n], max(0, min(rand_n, len(ids) - last_n)))
+
+    for path in glob.glob(sample_dir + "sample_*"):
+        os.remove(path)
+    samples = []
+    for nid in ids:
+        payload = havoc.splice_pool.get_payload(nid)
+        if payload is None:
+            continue
+        path = sample_dir + "sample_%05d" % nid
+        atomic_write(path, payload)
+        samples.append(path)
+    return samples
+
+
+class RadamsaStream:
+    """
+    Long-lived Radamsa process in client output mode. Radamsa connects to our
+    listening socket once per generated input, writes it and disconnects.
+    The listen backlog throttles Radamsa while we are busy executing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.proc = None
+        self.served = 0
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.listener.settimeout(RADAMSA_TIMEOUT)
+        self.port = self.listener.getsockname()[1]
+        atexit.register(self.stop)
+
+    def start(self, samples):
+        self.stop()
+        cmd = [self.path,
+               "-T", str(KAFL_MAX_FILE),
+               "-o", "127.0.0.1:%d" % self.port,
+               "-n", "inf"] + samples
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, shell=False)
+        self.served = 0
+
+    def stop(self):
+        if self.proc:
+            self.proc.terminate()
+            self.proc.wait()
+            self.proc = None
+
+    def recv(self):
+        conn, _ = self.listener.accept()
+        with conn:
+            conn.settimeout(RADAMSA_TIMEOUT)
+            chunks = []
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        self.served += 1
+        return b''.join(chunks)[:KAFL_MAX_FILE]
+
+    def generate(self, num_inputs):
+        # yield num_inputs generated inputs, raises OSError if Radamsa fails
+        for _ in range(num_inputs):
+            if not self.proc or self.served >= RADAMSA_RESTART:
+                # replace samples only once Radamsa has stopped reading them
+                self.stop()
+                samples = select_samples()
+                if not samples:
+                    return
+                self.start(samples)
+            if self.proc.poll() is not None:
+                raise OSError("Radamsa exited with status %d" % self.proc.returncode)
+            yield self.recv()
+
+
+def perform_radamsa_round(data, func, num_inputs):
+    global input_dir
+    global radamsa_path
 
+    samples = select_samples()
     if not samples:
         return
 
@@ -75,7 +182,20 @@ def perform_radamsa_round(data, func, num_inputs):
         os.remove(input_dir+path)
 
 def mutate_seq_radamsa_array(data, func, num_inputs):
-    # avoid large amounts of temp files in radamsa (use socket I/O option?)
+    global radamsa_stream
+
+    if radamsa_stream:
+        try:
+            for payload in radamsa_stream.generate(num_inputs):
+                func(payload)
+                num_inputs -= 1
+            return
+        except OSError as e:
+            logger.warning("Radamsa stream failed (%s), falling back to temp files." % e)
+            radamsa_stream.stop()
+            radamsa_stream = None
+
+    # avoid large amounts of temp files in radamsa
     max_round_inputs = 512
     rounds = math.ceil(num_inputs / max_round_inputs)
 
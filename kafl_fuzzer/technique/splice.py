@@ -0,0 +1,92 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Splice partners for the havoc stage.
+
+The Manager attaches the IDs of new regular nodes to the tasks sent to each
+Worker, which collects them in a SplicePool instead of listing corpus/regular
+for every splice round. Partner payloads are read on demand and kept in a
+bounded LRU. A fingerprint (length, hash) is kept for every payload seen,
+so that duplicates of the input and too short payloads are skipped without
+reading them again.
+
+Remote Workers behind a relay have no access to the corpus. They receive the
+payloads along with the IDs and keep only the newest <cache_size> partners.
+"""
+
+import itertools
+import logging
+
+import mmh3
+
+from kafl_fuzzer.common.rand import rand
+from kafl_fuzzer.manager.communicator import PayloadCache
+from kafl_fuzzer.manager.node import QueueNode
+
+logger = logging.getLogger(__name__)
+
+def fingerprint(payload):
+    return (len(payload), mmh3.hash(payload))
+
+
+class SplicePool:
+
+    def __init__(self, workdir, cache_size):
+        self.workdir = workdir       # None if payloads are sent along with the IDs
+        self.ids = []
+        self.known = set()
+        self.cache = PayloadCache(cache_size)
+        self.fingerprints = dict()   # node ID => fingerprint
+        self.warned = False
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, ids, payloads=None):
+        for nid, payload in zip(ids, payloads or itertools.repeat(None)):
+            if nid in self.known:
+                continue
+            self.known.add(nid)
+            self.ids.append(nid)
+            if payload is not None:
+                # payloads cannot be read again once dropped, so drop their IDs as well
+                if len(self.ids) > self.cache.size:
+                    self.drop(self.ids.pop(0))
+                self.insert(nid, payload)
+
+    def insert(self, nid, payload):
+        self.cache.insert(nid, payload)
+        self.fingerprints[nid] = fingerprint(payload)
+
+    def drop(self, nid):
+        self.cache.entries.pop(nid, None)
+        self.fingerprints.pop(nid, None)
+
+    def get_payload(self, nid):
+        payload = self.cache.lookup(nid)
+        if payload is None and self.workdir:
+            try:
+                payload = QueueNode.get_payload(self.workdir, {"id": nid, "info": {"exit_reason": "regular"}})
+            except (OSError, KeyError):
+                if not self.warned:
+                    logger.warning("Failed to read splice partner %d from %s, skipping unreadable partners.",
+                                   nid, self.workdir)
+                    self.warned = True
+                return None
+            self.insert(nid, payload)
+        return payload
+
+    def partners(self, data, limit):
+        # yield up to <limit> random payloads that differ from data
+        own = fingerprint(data)
+        for _ in range(min(limit, len(self.ids))):
+            nid = rand.select(self.ids)
+            known = self.fingerprints.get(nid, None)
+            if known and (known[0] < 2 or known == own):
+                continue
+            payload = self.get_payload(nid)
+            if payload is None or len(payload) < 2 or self.fingerprints[nid] == own:
+                continue
+            yield payload
@@ -0,0 +1,149 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test kAFL bitmap handling against plain Python reference implementations
+"""
+
+import os
+import tempfile
+import mmh3
+from argparse import Namespace
+
+from kafl_fuzzer.common.rand import rand
+from kafl_fuzzer.manager.bitmap import GlobalBitmap, BitmapStorage
+from kafl_fuzzer.worker.execution_result import ExecutionResult
+
+BITMAP_SIZE = 1 << 16
+
+
+def make_config(work_dir):
+    os.makedirs(work_dir + "/bitmaps", exist_ok=True)
+    return Namespace(work_dir=work_dir, bitmap_size=BITMAP_SIZE)
+
+def random_bitmap(density):
+    bitmap = bytearray(BITMAP_SIZE)
+    for _ in range(density):
+        bitmap[rand.int(BITMAP_SIZE)] = 1 << rand.int(8)
+    return bitmap
+
+def reference_new_bytes(global_bitmap, local_bitmap):
+    new_bytes = {}
+    new_bits = {}
+    for index in range(len(global_bitmap)):
+        global_byte = global_bitmap[index]
+        local_byte = local_bitmap[index]
+        if (global_byte | local_byte) != global_byte:
+            if global_byte == 0:
+                new_bytes[index] = local_byte
+            else:
+                new_bits[index] = local_byte
+    return new_bytes, new_bits
+
+
+def test_nonzero_indices():
+    for density in [0, 1, 100, 5000]:
+        bitmap = random_bitmap(density)
+        res = ExecutionResult.bitmap_from_bytearray(bitmap, "regular", 0)
+        expect = [i for i, val in enumerate(bitmap) if val]
+        assert(res.nonzero_indices() == expect), "Mismatch in sparse index list"
+
+def test_determine_new_bytes():
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = make_config(work_dir)
+        global_bitmap = GlobalBitmap("test_bitmap", config, read_only=False)
+
+        for _ in range(8):
+            local = random_bitmap(2000)
+            res = ExecutionResult.bitmap_from_bytearray(local, "regular", 0)
+            res.lut_applied = True
+
+            expect = reference_new_bytes(bytearray(global_bitmap.c_bitmap), local)
+            new_bytes, new_bits = global_bitmap.get_new_byte_and_bit_offsets(res)
+            assert((new_bytes or {}, new_bits or {}) == expect), "Mismatch in new bytes/bits"
+
+            global_bitmap.update_with(res)
+
+def test_sparse_encoding():
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = make_config(work_dir)
+        dense_bitmap = GlobalBitmap("dense_bitmap", config, read_only=False)
+        sparse_bitmap = GlobalBitmap("sparse_bitmap", config, read_only=False)
+
+        for _ in range(8):
+            local = random_bitmap(2000)
+            res = ExecutionResult.bitmap_from_bytearray(local, "regular", 0)
+            res.lut_applied = True
+
+            indices, values = res.copy_to_sparse()
+            sparse = ExecutionResult.bitmap_from_sparse(indices, values, BITMAP_SIZE, "regular", 0)
+            assert(sparse.copy_to_array() == local), "Sparse round-trip failed"
+            assert(sparse.nonzero_items() == res.nonzero_items())
+
+            expect = dense_bitmap.get_new_byte_and_bit_offsets(res)
+            assert(sparse_bitmap.get_new_byte_and_bit_offsets(sparse) == expect), "Sparse diff mismatch"
+            assert(sparse_bitmap.get_new_byte_and_bit_counts(sparse) == dense_bitmap.get_new_byte_and_bit_counts(res))
+
+            dense_bitmap.update_with(res)
+            sparse_bitmap.update_with(sparse)
+            assert(bytearray(dense_bitmap.c_bitmap) == bytearray(sparse_bitmap.c_bitmap))
+
+def test_snapshot_compare():
+    res = ExecutionResult.bitmap_from_bytearray(random_bitmap(1000), "regular", 0)
+    snapshot = res.snapshot()
+    assert(res.equals(snapshot))
+    assert(bytes(res.view()) == bytes(snapshot))
+    assert(res.snapshot(snapshot) is snapshot)
+
+    for index in [0, 7, 8, 1000, BITMAP_SIZE-1]:
+        res.cbuffer[index] ^= 0x80
+        assert(res.compare(snapshot) == index)
+        res.cbuffer[index] ^= 0x80
+    assert(res.equals(snapshot))
+
+def test_classify_hash():
+    with tempfile.TemporaryDirectory() as work_dir:
+        global_bitmap = GlobalBitmap("test", make_config(work_dir), read_only=False)
+        global_bitmap.update_with(ExecutionResult.bitmap_from_bytearray(random_bitmap(500), "regular", 0).apply_lut())
+
+        for density in [0, 1, 100, 5000]:
+            bitmap = random_bitmap(density)
+            for index in range(0, BITMAP_SIZE, 997):
+                bitmap[index] = rand.int(256)
+            res = ExecutionResult.bitmap_from_bytearray(bitmap, "regular", 0)
+            ref = ExecutionResult.bitmap_from_bytearray(bitmap, "regular", 0).apply_lut()
+            ref_hash = "%016x" % mmh3.hash64(bytes(ref.cbuffer), seed=0xaaaaaaaa, x64arch=True, signed=False)[0]
+
+            new_bytes, new_bits = reference_new_bytes(global_bitmap.c_bitmap, ref.cbuffer)
+            assert(global_bitmap.get_new_byte_and_bit_counts(res) == (len(new_bytes), len(new_bits)))
+            assert(res.is_lut_applied() and bytes(res.cbuffer) == bytes(ref.cbuffer))
+            assert(res.hash() == ref_hash)
+            assert(ref.hash() == ref_hash)
+            assert(ExecutionResult.bitmap_from_bytearray(bitmap, "regular", 0).hash() == ref_hash)
+
+def test_bitmap_sync():
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = make_config(work_dir)
+        config.bitmap_sync = True
+        manager = BitmapStorage(config, "main", read_only=False)
+        manager.sync_log.max_records = 4
+        workers = [BitmapStorage(config, "worker", private=True) for _ in range(2)]
+        assert(manager.get_sync(0) is None)
+
+        for num in range(8):
+            exit_reason = ["regular", "crash"][num % 2]
+            res = ExecutionResult.bitmap_from_bytearray(random_bitmap(100), exit_reason, 0).apply_lut()
+            assert(manager.should_store_in_queue(res)[0])
+
+            # first Worker syncs every update, second one falls behind and gets a full copy
+            workers[0].apply_sync(manager.get_sync(workers[0].version))
+            assert("delta" in manager.get_sync(num))
+        assert("full" in manager.get_sync(workers[1].version))
+        workers[1].apply_sync(manager.get_sync(workers[1].version))
+
+        for worker in workers:
+            assert(worker.version == manager.sync_log.version)
+            assert(manager.get_sync(worker.version) is None)
+            for exit_reason in ["regular", "timeout", "crash", "kasan"]:
+                assert(bytes(worker.get_bitmap_for_node_type(exit_reason).c_bitmap) ==
+                       bytes(manager.get_bitmap_for_node_type(exit_reason).c_bitmap))
@@ -0,0 +1,129 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test kAFL Manager/Worker communication
+"""
+
+import random
+import tempfile
+import threading
+import msgpack
+from collections import deque
+from argparse import Namespace
+
+from kafl_fuzzer.manager.communicator import PayloadCache, ServerConnection, ClientConnection
+from kafl_fuzzer.manager.communicator import MSG_READY, MSG_BUSY, MSG_NEW_INPUT
+
+
+def test_payload_cache_mirror():
+    manager = PayloadCache(16)
+    worker = PayloadCache(16)
+    versions = [1] * 64
+    hits = 0
+
+    for _ in range(10000):
+        nid = random.randint(0, 63)
+        if random.random() < 0.05:
+            versions[nid] += 1
+        key = (nid, versions[nid])
+        payload = b"%d/%d" % key
+
+        if manager.lookup(key):
+            hits += 1
+            assert(worker.lookup(key) == payload)
+        else:
+            manager.insert(key, True)
+        worker.insert(key, payload)
+        assert(list(manager.entries) == list(worker.entries))
+
+    assert(hits > 0)
+
+def test_framed_messages():
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = Namespace(work_dir=work_dir, node_cache=0)
+        server = ServerConnection(config)
+        payload = bytes(random.getrandbits(8) for _ in range(1 << 20))
+
+        def worker(pid):
+            conn = ClientConnection(pid, config)
+            conn.send_ready()
+            conn.send_new_input(payload, b"\x01" * 16, {"pid": pid})
+            assert(conn.recv()["type"] == MSG_BUSY)
+
+        threads = [threading.Thread(target=worker, args=(pid,)) for pid in range(4)]
+        for thread in threads:
+            thread.start()
+
+        inputs = 0
+        while inputs < len(threads):
+            for conn, msg in server.wait(1):
+                if msg["type"] == MSG_READY:
+                    server.send_busy(conn)
+                elif msg["type"] == MSG_NEW_INPUT:
+                    assert(msg["input"]["payload"] == payload)
+                    inputs += 1
+
+        for thread in threads:
+            thread.join()
+
+def test_splice_ids():
+    with tempfile.TemporaryDirectory() as work_dir:
+        server = ServerConnection(Namespace(work_dir=work_dir, node_cache=0))
+        server.splice_ids = deque(maxlen=4)
+
+        class FakeClient:
+            def __init__(self):
+                self.msgs = []
+        server.send_bytes = lambda client, data: client.msgs.append(msgpack.unpackb(data))
+
+        client = FakeClient()
+        for nid in range(3):
+            server.add_splice_id(nid)
+        server.send_busy(client)
+        server.send_busy(client)
+        for nid in range(3, 10):
+            server.add_splice_id(nid)
+        server.send_busy(client)
+
+        # only new IDs are sent, and only the newest ones of those
+        assert(client.msgs[0]["splice_ids"] == [0, 1, 2])
+        assert("splice_ids" not in client.msgs[1])
+        assert(client.msgs[2]["splice_ids"] == [6, 7, 8, 9])
+
+        # remote Workers also get the payloads
+        remote = FakeClient()
+        server.splice_payload = lambda nid: b"payload %d" % nid
+        server.set_remote(remote, True)
+        server.send_busy(remote)
+        assert(remote.msgs[0]["splice_ids"] == [6, 7, 8, 9])
+        assert(remote.msgs[0]["splice_payloads"] == [b"payload %d" % nid for nid in range(6, 10)])
+        assert("splice_payloads" not in client.msgs[2])
+
+def test_nonblocking_send():
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = Namespace(work_dir=work_dir, node_cache=0)
+        server = ServerConnection(config)
+        payload = bytes(1 << 20)
+
+        conn = ClientConnection(0, config)
+        conn.send_ready()
+        clients = []
+        while not clients:
+            clients = [client for client, msg in server.wait(1) if msg["type"] == MSG_READY]
+
+        # Worker is not reading, sends must not block
+        for _ in range(16):
+            server.send_import(clients[0], {"type": "import", "payload": payload})
+        assert(clients[0].pending)
+
+        received = []
+        def worker():
+            for _ in range(16):
+                received.append(conn.recv()["task"]["payload"])
+        thread = threading.Thread(target=worker)
+        thread.start()
+        while clients[0].pending:
+            server.wait(1)
+        thread.join()
+        assert(received == [payload] * 16)
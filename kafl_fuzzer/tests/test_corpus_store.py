@@ -0,0 +1,53 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test kAFL log-structured corpus store
+"""
+
+import os
+import tempfile
+from argparse import Namespace
+
+from kafl_fuzzer.manager.node import QueueNode
+from kafl_fuzzer.manager.corpus_store import CorpusStore, INDEX_GROW
+
+
+def test_corpus_store():
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = Namespace(work_dir=work_dir, debug=False)
+        QueueNode.corpus_store = CorpusStore(work_dir, read_only=False)
+        reader = CorpusStore(work_dir, read_only=True)
+
+        try:
+            nodes = list()
+            for i in range(8):
+                node_struct = {"info": {"exit_reason": "regular"}, "state": {"name": "initial"}}
+                nodes.append(QueueNode(config, b"payload %d" % i, None, node_struct, write=False))
+                nodes[-1].write_metadata()
+            nodes[3].set_payload(b"new payload")
+            nodes[3].set_level(2)
+
+            for node in nodes:
+                assert(reader.read_metadata(node.get_id()) == node.pack_metadata())
+            assert(reader.read_payload(nodes[3].get_id()) == b"new payload")
+            assert(QueueNode.get_payload(work_dir, nodes[5].node_struct) == b"payload 5")
+            assert(not os.path.exists(QueueNode.get_metadata_filename(work_dir, nodes[0].get_id())))
+
+            # writes beyond the initial index size are picked up by readers
+            QueueNode.corpus_store.write_payload(INDEX_GROW + 1, b"far")
+            assert(reader.read_payload(INDEX_GROW + 1) == b"far")
+
+            # index can be recovered from segments
+            QueueNode.corpus_store.sync()
+            os.remove(work_dir + "/corpus/store/index")
+            store = CorpusStore(work_dir, read_only=False)
+            assert(store.read_metadata(nodes[3].get_id()) == nodes[3].pack_metadata())
+
+            with tempfile.TemporaryDirectory() as out_dir:
+                assert(store.export(out_dir) == len(nodes))
+                for node in nodes:
+                    with open("%s/corpus/regular/payload_%05d" % (out_dir, node.get_id()), 'rb') as f:
+                        assert(f.read() == QueueNode.get_payload(work_dir, node.node_struct))
+        finally:
+            QueueNode.corpus_store = None
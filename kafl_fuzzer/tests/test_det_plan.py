@@ -0,0 +1,122 @@
+# Copyright 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test native planning of deterministic mutations against the reference loops
+"""
+
+import random
+
+from kafl_fuzzer.technique.helper import *
+
+helper_init()
+
+
+def ref_arith(data, width, skip_null, eff_map, arith_max):
+    # reference: per-candidate checks as in the original arithmetic stages
+    mask = (1 << 8*width) - 1
+    low = {1: 0, 2: 0xff, 4: 0xffff}[width]
+    swap = {1: lambda x: x, 2: swap_16, 4: swap_32}[width]
+    for i in range(len(data) - width + 1):
+        if eff_map and not any(eff_map[i:i+width]):
+            continue
+        num1 = int.from_bytes(data[i:i+width], 'little')
+        num2 = int.from_bytes(data[i:i+width], 'big')
+        if skip_null and num1 == 0:
+            continue
+        for j in range(1, arith_max + 1):
+            r1 = (num1 + j) & mask
+            r2 = (num1 - j) & mask
+            r3 = (num2 + j) & mask
+            r4 = (num2 - j) & mask
+            if num1^r1 > low and is_not_bitflip(num1^r1):
+                yield i, r1
+            if num1^r2 > low and is_not_bitflip(num1^r2):
+                yield i, r2
+            if width == 1:
+                continue
+            if num2^r3 > low and (width == 4 or swap(r1) != r3) and is_not_bitflip(num2^r3):
+                yield i, swap(r3)
+            if num2^r4 > low and (width == 4 or swap(r4) != r4) and is_not_bitflip(num2^r4):
+                yield i, swap(r4)
+
+
+def ref_interesting(data, width, skip_null, eff_map, arith_max):
+    # reference: per-candidate checks as in the original interesting value stages
+    table = {1: interesting_8_Bit, 2: interesting_16_Bit, 4: interesting_32_Bit}[width]
+    mask = (1 << 8*width) - 1
+    swap = {1: lambda x: x, 2: swap_16, 4: swap_32}[width]
+    for i in range(len(data) - width + 1):
+        if eff_map and not any(eff_map[i:i+width]):
+            continue
+        oval = int.from_bytes(data[i:i+width], 'little')
+        if skip_null and oval == 0:
+            continue
+        for value in table:
+            num1 = value & mask
+            num2 = swap(num1)
+            if width == 1:
+                if is_not_bitflip(oval ^ num1) and is_not_arithmetic(oval, num1, 1):
+                    yield i, num1
+                continue
+            if (is_not_bitflip(oval ^ num1) and
+                is_not_arithmetic(oval, num1, width, arith_max=arith_max) and
+                is_not_interesting(oval, num1, width, 0)):
+                yield i, num1
+            if (num1 != num2 and
+                is_not_bitflip(oval ^ num2) and
+                is_not_arithmetic(oval, num2, width, arith_max=arith_max) and
+                is_not_interesting(oval, num2, width, 1)):
+                yield i, num2
+
+
+def dedupe(candidates):
+    seen = set()
+    for candidate in candidates:
+        if candidate not in seen:
+            seen.add(candidate)
+            yield candidate
+
+
+def test_det_plan_equivalence():
+
+    random.seed(0)
+    for _ in range(200):
+        length = random.randint(0, 12)
+        data = bytes(random.choice([0, 1, 0x7f, 0x80, 0xff, random.randint(0, 255)]) for _ in range(length))
+        eff_map = bytearray(random.choice([0, 1]) for _ in range(length)) if random.random() < 0.5 else None
+        skip_null = random.random() < 0.3
+        arith_max = random.choice([AFL_ARITH_MAX, 10, 300])
+
+        for width in [1, 2, 4]:
+            ref = ref_arith(data, width, skip_null, eff_map, arith_max)
+            plan = plan_deterministic(data, width, False, eff_map, skip_null, arith_max)
+            assert list(plan) == list(dedupe(ref))
+
+            # 8-bit interesting values always use the default arith_max
+            int_max = AFL_ARITH_MAX if width == 1 else arith_max
+            ref = ref_interesting(data, width, skip_null, eff_map, int_max)
+            plan = plan_deterministic(data, width, True, eff_map, skip_null, int_max)
+            assert list(plan) == list(dedupe(ref))
+
+
+def test_det_plan_chunks():
+
+    # payloads that need multiple native calls must be planned completely
+    data = rand.bytes(8*DET_PLAN_CHUNK//AFL_ARITH_MAX)
+    ref = list(dedupe(ref_arith(data, 2, False, None, AFL_ARITH_MAX)))
+    assert len(ref) > DET_PLAN_CHUNK
+    assert list(plan_deterministic(data, 2)) == ref
+
+
+def test_execute_plan():
+
+    data = bytearray(b'abcdefgh')
+    calls = []
+
+    def verifier(outdata, label=None):
+        calls.append((bytes(outdata), label))
+
+    execute_plan(data, verifier, "test", 2, [(0, 0x4142), (0, 0x4344), (3, 0xffff)])
+    assert data == b'abcdefgh'
+    assert calls == [(b'BAcdefgh', "test"), (b'DCcdefgh', "test"), (b'abc\xff\xfffgh', "test")]
@@ -0,0 +1,152 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from argparse import Namespace
+
+from kafl_fuzzer.common.rand import rand
+from kafl_fuzzer.manager.det_shards import DetShards
+from kafl_fuzzer.technique import bitflip, arithmetic, interesting_values, deterministic
+from kafl_fuzzer.technique.helper import helper_init
+
+helper_init()
+
+TIMES = ["attention_execs", "attention_secs", "state_time_initial", "state_time_redqueen",
+         "state_time_grimoire", "state_time_grimoire_inference", "state_time_havoc",
+         "state_time_splice", "state_time_radamsa"]
+
+
+class FakeNode:
+
+    def __init__(self, nid, payload_len):
+        self.nid = nid
+        self.payload_len = payload_len
+        self.data = {}
+
+    def get_id(self):
+        return self.nid
+
+    def get_state(self):
+        return "deterministic"
+
+    def get_payload_len(self):
+        return self.payload_len
+
+
+def test_det_ranges():
+    # mutators split into offset ranges must perform the same mutations as a single run
+    mutators = [bitflip.mutate_seq_walking_bits, bitflip.mutate_seq_two_walking_bits,
+                bitflip.mutate_seq_four_walking_bits, bitflip.mutate_seq_two_walking_bytes,
+                bitflip.mutate_seq_four_walking_bytes,
+                arithmetic.mutate_seq_8_bit_arithmetic, arithmetic.mutate_seq_16_bit_arithmetic,
+                arithmetic.mutate_seq_32_bit_arithmetic,
+                interesting_values.mutate_seq_8_bit_interesting, interesting_values.mutate_seq_16_bit_interesting,
+                interesting_values.mutate_seq_32_bit_interesting]
+
+    for payload in [rand.bytes(1), rand.bytes(5), rand.bytes(33)]:
+        eff_map = bytearray([1, 0, 0, 1] * len(payload))[:len(payload)]
+        for func in mutators:
+            full = []
+            func(bytearray(payload), lambda data, label=None: full.append(bytes(data)), effector_map=eff_map)
+
+            parts = []
+            bounds = [0, 1, 4, 17, len(payload)]
+            for start, end in zip(bounds, bounds[1:]):
+                func(bytearray(payload), lambda data, label=None: parts.append(bytes(data)),
+                     effector_map=eff_map, start=start, end=end)
+            assert parts == full, func.__name__
+
+
+def test_det_resume_info():
+    assert deterministic.resume_info(None) == {"stage": "flip_1/1", "offset": 0}
+    assert deterministic.resume_info({"stage": "arith"}) == {"stage": "arith_1", "offset": 0}
+    assert deterministic.next_stage("flip_8/4") == "arith_1"
+    assert deterministic.slice_len("arith_4", 35) == 1024 // 140
+    assert deterministic.slice_len("flip_8/1", 35) == 1024
+
+
+def test_det_shards():
+    config = Namespace(afl_dumb_mode=False, afl_no_effector=False, afl_skip_range=None)
+    payload_len = 1000
+    shards = DetShards(config, 300)
+
+    assert not shards.split(FakeNode(1, 300))
+    node = FakeNode(2, payload_len)
+    assert shards.split(node)
+
+    done = None
+    stages = []
+    covered = {}
+    timed_out = False
+    base_sent = []
+    while done is None:
+        assert shards.nodes[2]["outstanding"] > 0
+        shard_node, shard = shards.next()
+        assert shard_node is node
+        if not stages or stages[-1] != shard["stage"]:
+            stages.append(shard["stage"])
+
+        # Worker may run out of time once, and only gets to offset 700
+        result = dict(shard)
+        result["offset"] = shard["end"]
+        if not timed_out and shard["start"] == 600:
+            result["offset"] = 700
+            timed_out = True
+        covered.setdefault(shard["stage"], []).append((shard["start"], result["offset"]))
+
+        # effector map is built by flip_8/1 shards, only offsets 500-510 cause new coverage
+        if shard["stage"] == "flip_8/1":
+            result["eff_map"] = bytes([1 if 500 <= i < 510 else 0 for i in range(payload_len)])
+            result.setdefault("eff_base", "baseline")
+            base_sent.append("eff_base" in shard)
+        elif shard["stage"] in deterministic.STAGES[4:]:
+            assert "eff_base" not in shards.nodes[2]["det_info"]
+            assert shard["eff_map"][0] == 1 and shard["eff_map"][2] == 0
+            assert shard["eff_map"][500:510] == bytes([1] * 10)
+
+        results = {key: 1 for key in TIMES}
+        results.update({"state": {"name": "deterministic"}, "afl_det_info": result})
+        done = shards.complete(2, results)
+
+    # all sub-stages are covered in order, each offset exactly once
+    assert stages == deterministic.STAGES[:-1]
+    for stage, ranges in covered.items():
+        offsets = [i for start, end in ranges for i in range(start, end)]
+        assert sorted(offsets) == list(range(payload_len)), stage
+
+    # effector map baseline is only computed by the first shard
+    assert base_sent == [False, True, True, True]
+
+    num_shards = sum(len(ranges) for ranges in covered.values())
+    assert num_shards == 12 * 4 + 1
+    assert done["attention_execs"] == num_shards
+    assert done["state"] == {"name": "havoc"}
+    assert done["afl_det_info"]["stage"] == "done"
+    assert "eff_base" not in done["afl_det_info"]
+    assert 2 not in shards.nodes
+    assert shards.next() is None
+
+    # shards of aborted Workers are handed out again
+    assert shards.split(node)
+    _, shard = shards.next()
+    results = {key: 1 for key in TIMES}
+    results.update({"crashing": True, "afl_det_info": dict(shard)})
+    shards.abort(2, results)
+    assert shards.nodes[2]["outstanding"] == 4
+    offsets = []
+    for _ in range(4):
+        _, retry = shards.next()
+        offsets.append((retry["start"], retry["end"]))
+    assert sorted(offsets) == [(0, 300), (300, 600), (600, 900), (900, 1000)]
+    assert shards.next() is None
+
+    # results of shards from a previous split are ignored
+    results = {key: 1 for key in TIMES}
+    results["afl_det_info"] = dict(shard, serial=0)
+    assert shards.complete(2, results) is None
+    assert shards.nodes[2]["outstanding"] == 4
+
+    # shards sent to disconnected Workers are handed out again
+    shards.release(2, retry)
+    assert shards.nodes[2]["outstanding"] == 4
+    assert shards.next()[1]["start"] == retry["offset"]
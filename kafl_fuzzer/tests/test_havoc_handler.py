@@ -6,6 +6,7 @@ Test kAFL havoc mutations
 """
 
 import struct
+import fastrand
 from binascii import hexlify
 
 from kafl_fuzzer.technique.havoc_handler import *
@@ -126,6 +127,28 @@ def test_havoc_insert_line(v=False):
         if v:
             print("Outdata: %s" % hexlify(data_out))
 
+def test_havoc_inplace():
+    # in-place handlers must produce the same results from the same random sequence
+    set_dict([b'DICT', b'\xff\xfe'])
+    clear_redqueen_dict()
+    add_to_redqueen_dict(23, b'ABCDEFGH')
+
+    db = [b'', b'1', b'12', b'123134', b'adfakh\0adfkn\x23' * 16, bytes(range(256)) * 64]
+    for handler, inplace in havoc_inplace.items():
+        for seed in range(ITERATIONS//16):
+            for data_in in db:
+                if handler in [havoc_dict_insert, havoc_dict_replace] and len(data_in) <= 8:
+                    continue  # rand.int(0) on inputs shorter than dict entry
+                fastrand.pcg32_seed(seed)
+                data_out = handler(data_in)
+                fastrand.pcg32_seed(seed)
+                buf = bytearray(data_in)
+                havoc_apply_inplace(handler, buf)
+                assert(data_out == buf), "%s differs from %s" % (inplace.__name__, handler.__name__)
+
+    set_dict([])
+    clear_redqueen_dict()
+
 
 def havoc_main():
 
@@ -0,0 +1,37 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from kafl_fuzzer.common.rand import rand
+from kafl_fuzzer.technique.helper import helper_init
+from kafl_fuzzer.technique.havoc import mutate_seq_havoc_array
+from kafl_fuzzer.technique.havoc_schedule import HavocSchedule, SCHEDULE_SIZE
+
+helper_init()
+
+
+def test_havoc_schedule_range():
+    schedule = HavocSchedule(0)
+    for limit in [1, 2, 7, 256, 1 << 17]:
+        values = [schedule.int(limit) for _ in range(SCHEDULE_SIZE)]
+        assert min(values) >= 0 and max(values) < limit
+        if limit < 256:
+            assert len(set(values)) == limit
+    assert schedule.int(0) == 0
+    assert schedule.select([42]) == 42
+
+
+def test_havoc_schedule_replay():
+    def run(seed):
+        out = []
+        def execute(data):
+            # executions must not affect the schedule
+            rand.int(256)
+            out.append(data)
+        mutate_seq_havoc_array(b"ABCDEFGH" * 8, execute, 1024, schedule=HavocSchedule(seed))
+        return out
+
+    first = run(23)
+    assert len(first) >= 1024
+    assert first == run(23)
+    assert first != run(42)
@@ -0,0 +1,94 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test kAFL node metadata persistence
+"""
+
+import os
+import tempfile
+import msgpack
+from argparse import Namespace
+
+from kafl_fuzzer.manager.node import QueueNode, MetadataStore
+
+
+def make_node(config):
+    node_struct = {"info": {"exit_reason": "regular"}, "state": {"name": "initial"}}
+    return QueueNode(config, b"payload", None, node_struct, write=False)
+
+def test_metadata_write_behind():
+    with tempfile.TemporaryDirectory() as work_dir:
+        for folder in ["/corpus/regular", "/metadata"]:
+            os.makedirs(work_dir + folder)
+        config = Namespace(work_dir=work_dir, debug=False)
+        store = MetadataStore(work_dir, flush_interval=60)
+        QueueNode.metadata_store = store
+
+        try:
+            nodes = [make_node(config) for _ in range(4)]
+            for node in nodes:
+                node.set_level(3)
+                assert(store.is_dirty(node.get_id()))
+                assert(not os.path.exists(QueueNode.get_metadata_filename(work_dir, node.get_id())))
+
+            store.flush_node(nodes[0].get_id())
+            assert(QueueNode.get_metadata(work_dir, nodes[0].get_id())["level"] == 3)
+
+            store.flush()
+            for node in nodes:
+                assert(QueueNode.get_metadata(work_dir, node.get_id()) == msgpack.unpackb(node.pack_metadata(), strict_map_key=False))
+            assert(os.path.getsize(store.journal) == 0)
+        finally:
+            QueueNode.metadata_store = None
+
+def test_metadata_journal_replay():
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.makedirs(work_dir + "/metadata")
+        journal = work_dir + "/metadata/journal"
+
+        # complete batch followed by a truncated one, as left behind by a crash
+        batch_a = [(1, msgpack.packb({"id": 1})), (2, msgpack.packb({"id": 2}))]
+        batch_b = msgpack.packb([(3, msgpack.packb({"id": 3}))])
+        with open(journal, 'wb') as f:
+            f.write(msgpack.packb(batch_a))
+            f.write(batch_b[:-4])
+
+        MetadataStore.replay_journal(work_dir)
+
+        assert(QueueNode.get_metadata(work_dir, 1) == {"id": 1})
+        assert(QueueNode.get_metadata(work_dir, 2) == {"id": 2})
+        assert(not os.path.exists(QueueNode.get_metadata_filename(work_dir, 3)))
+        assert(os.path.getsize(journal) == 0)
+
+def test_node_table_fields():
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.makedirs(work_dir + "/corpus/regular")
+        config = Namespace(work_dir=work_dir, debug=False)
+        nodes = [make_node(config) for _ in range(64)]
+        node = nodes[-1]
+        assert(len(QueueNode.table) > node.get_id())
+
+        node.set_score(3)
+        node.set_fav_factor(1.5, write=False)
+        QueueNode.table.fav_count[node.get_id()] = 1
+        node.set_busy()
+        assert(node.get_fav_count() == 1 and node.is_favorite() and node.is_busy())
+        assert(not nodes[0].is_busy())
+
+        node_struct = node.node_struct
+        assert(node_struct["id"] == node.get_id())
+        assert(node_struct["state"] == {"name": "initial"})
+        assert(node_struct["score"] == 3 and node_struct["fav_factor"] == 1.5)
+        assert("fav_bits" not in node_struct)
+
+        update = {"state": {"name": "havoc"}, "attention_execs": 10, "attention_secs": 2.5,
+                  "state_time_initial": 0, "state_time_redqueen": 0, "state_time_grimoire": 0,
+                  "state_time_grimoire_inference": 0, "state_time_havoc": 1, "state_time_splice": 0,
+                  "state_time_radamsa": 0, "performance": 0.1}
+        node.update_metadata(update, write=False)
+        assert(node.get_state() == "havoc")
+        assert(node.get_attention_secs() == 2.5)
+        assert(node.get_performance() == 0.1)
+        assert(node.get_score() == 3 and node.get_fav_count() == 1)
+        assert(node.node_struct["attention_execs"] == 10)
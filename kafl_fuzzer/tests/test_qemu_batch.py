@@ -0,0 +1,136 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test batched execution protocol against the mock backend
+"""
+
+import tempfile
+from argparse import Namespace
+
+from kafl_fuzzer.manager.bitmap import BitmapStorage
+from kafl_fuzzer.worker import qemu_batch
+from kafl_fuzzer.worker.execution_result import ExecutionResult
+from kafl_fuzzer.worker.qemu_aux_buffer import QemuAuxBuffer
+from kafl_fuzzer.worker.worker import WorkerTask
+
+BITMAP_SIZE = 1 << 16
+
+
+def target(payload):
+    # one edge per distinct byte value, crash on b"!"
+    bitmap = bytearray(BITMAP_SIZE)
+    for i, c in enumerate(payload):
+        bitmap[c * 97] += 1 + (i & 1)
+    return ("crash" if b"!" in payload else "regular"), bitmap
+
+def test_batch_protocol():
+    with tempfile.TemporaryDirectory() as work_dir, tempfile.NamedTemporaryFile() as aux_file:
+        aux_file.truncate(0x2000)
+        aux = QemuAuxBuffer(aux_file.name)
+        input_buffer = bytearray(256)
+        storage = BitmapStorage(Namespace(work_dir=work_dir, bitmap_size=BITMAP_SIZE), "main", private=True)
+
+        assert(qemu_batch.get_batch_cap(aux.aux_buffer) == 0)
+        backend = qemu_batch.MockBatchBackend(aux.aux_buffer, input_buffer, target, storage, max_batch=8)
+        assert(qemu_batch.get_batch_cap(aux.aux_buffer) == 8)
+
+        # known coverage for payloads starting with "a"
+        storage.normal_bitmap.update_with(ExecutionResult.bitmap_from_bytearray(target(b"aaa")[1], "regular", 0).apply_lut())
+
+        payloads = [b"aaa", b"abc", b"aaa", b"!", b"x" * 100, b""] * 3
+        runs = []
+        def run():
+            runs.append(qemu_batch.get_batch_size(aux.aux_buffer))
+            backend.run()
+        results = qemu_batch.execute_batch(aux.aux_buffer, input_buffer, payloads, run)
+
+        # split by max batch size and input buffer size
+        assert(len(runs) > 2 and max(runs) <= 8 and sum(runs) == len(payloads))
+        assert(qemu_batch.get_batch_size(aux.aux_buffer) == 0)
+
+        assert(len(results) == len(payloads))
+        for payload, result in zip(payloads, results):
+            exit_reason, bitmap = target(payload)
+            res = ExecutionResult.bitmap_from_bytearray(bitmap, exit_reason, 0)
+            assert(result.exit_reason == exit_reason)
+            assert(result.new_coverage == storage.should_send_to_manager(res, exit_reason))
+            assert(result.hash == res.hash())
+        assert([r.new_coverage for r in results[:4]] == [False, True, False, True])
+
+
+class FakeQemu:
+
+    def __init__(self, aux, input_buffer, backend):
+        self.aux = aux
+        self.input_buffer = input_buffer
+        self.backend = backend
+        self.bb_seen = 0
+        self.reloads = 0
+
+    def get_batch_size(self):
+        return qemu_batch.get_batch_cap(self.aux.aux_buffer)
+
+    def execute_batch(self, payloads):
+        return qemu_batch.execute_batch(self.aux.aux_buffer, self.input_buffer, payloads, self.backend.run)
+
+    def reload(self):
+        self.reloads += 1
+
+
+class FakeStatistics:
+
+    def __init__(self):
+        self.execs = 0
+        self.reloads = []
+
+    def event_exec(self, bb_cov=0):
+        self.execs += 1
+
+    def event_reload(self, reason):
+        self.reloads.append(reason)
+
+
+class FakeReloadController:
+
+    def __init__(self):
+        self.crashes = []
+
+    def event_exec(self, crash):
+        self.crashes.append(crash)
+        return None
+
+
+def test_worker_batch_counts():
+    with tempfile.TemporaryDirectory() as work_dir, tempfile.NamedTemporaryFile() as aux_file:
+        aux_file.truncate(0x2000)
+        aux = QemuAuxBuffer(aux_file.name)
+        input_buffer = bytearray(256)
+        storage = BitmapStorage(Namespace(work_dir=work_dir, bitmap_size=BITMAP_SIZE), "main", private=True)
+        backend = qemu_batch.MockBatchBackend(aux.aux_buffer, input_buffer, target, storage, max_batch=8)
+        storage.normal_bitmap.update_with(ExecutionResult.bitmap_from_bytearray(target(b"aaa")[1], "regular", 0).apply_lut())
+
+        worker = WorkerTask.__new__(WorkerTask)
+        worker.q = FakeQemu(aux, input_buffer, backend)
+        worker.statistics = FakeStatistics()
+        worker.reload_ctl = FakeReloadController()
+        worker.payload_limit = 256
+        worker.t_check = False
+
+        # re-runs of flagged inputs count as executions in execute() only
+        rerun = []
+        def execute(data, info):
+            rerun.append(data)
+            worker.statistics.event_exec()
+            worker.reload_ctl.event_exec(False)
+            return None, True
+        worker.execute = execute
+
+        payloads = [b"aaa", b"abc", b"aaa", b"!", b"xyz", b"aaa"]
+        num_new = worker.execute_batch(payloads, {})
+
+        assert(rerun == [b"abc", b"!", b"xyz"])
+        assert(num_new == 3)
+        assert(worker.statistics.execs == len(payloads))
+        assert(len(worker.reload_ctl.crashes) == len(payloads))
+        assert(worker.statistics.reloads == [] and worker.q.reloads == 0)
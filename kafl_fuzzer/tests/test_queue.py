@@ -0,0 +1,113 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test kAFL favorites index against a plain Python reference implementation,
+and queue ordering
+"""
+
+import os
+import tempfile
+from argparse import Namespace
+
+from kafl_fuzzer.common.rand import rand
+from kafl_fuzzer.manager.node import QueueNode
+from kafl_fuzzer.manager.queue import FavIndex, InputQueue
+from kafl_fuzzer.worker.execution_result import ExecutionResult
+
+BITMAP_SIZE = 1 << 12
+
+
+def reference_update(favs, node, bitmap):
+    # previous dict-based InputQueue.update_best_input_for_bitmap_entry()
+    losers = set()
+    for index, val in bitmap.nonzero_items():
+        if index in favs:
+            old_node, old_val = favs[index]
+            better_bits = val > old_val and node.get_score() <= old_node.get_score()
+            better_score = val == old_val and node.get_score() < old_node.get_score()
+            if not better_bits and not better_score:
+                continue
+            losers.add(old_node.get_id())
+        favs[index] = (node, val)
+    return losers
+
+def test_fav_index():
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.makedirs(work_dir + "/corpus/regular")
+        config = Namespace(work_dir=work_dir, debug=False)
+        fav_index = FavIndex(BITMAP_SIZE)
+        favs = {}
+        nodes = []
+
+        for _ in range(32):
+            node_struct = {"info": {"exit_reason": "regular"}, "state": {"name": "initial"}}
+            node = QueueNode(config, b"payload", None, node_struct, write=False)
+            node.set_score(rand.int(4))
+            nodes.append(node)
+
+            bitmap = bytearray(BITMAP_SIZE)
+            for _ in range(200):
+                bitmap[rand.int(BITMAP_SIZE)] = 1 << rand.int(4)
+            res = ExecutionResult.bitmap_from_bytearray(bitmap, "regular", 0)
+
+            expect = reference_update(favs, node, res)
+            assert(fav_index.update(node, res) == expect)
+
+        for index in range(BITMAP_SIZE):
+            if index in favs:
+                assert(fav_index.get(index) == (favs[index][0].get_id(), favs[index][1]))
+            else:
+                assert(fav_index.get(index) == (0, 0))
+
+        for node in nodes:
+            expect = {index: 0 for index, (owner, _) in favs.items() if owner is node}
+            assert(fav_index.get_fav_bits(node.get_id()) == expect)
+            assert(node.get_fav_count() == len(expect))
+
+
+class FakeStatistics:
+
+    def __init__(self):
+        self.data = {"favs_total": 0}
+
+    def event_queue_cycle(self, queue):
+        pass
+
+    def event_node_new(self, node):
+        pass
+
+    def event_node_update(self, node, update):
+        pass
+
+    def event_node_remove_fav_bit(self, node):
+        pass
+
+
+def test_queue_pushback():
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.makedirs(work_dir + "/corpus/regular")
+        os.makedirs(work_dir + "/metadata")
+        config = Namespace(work_dir=work_dir, debug=False, processes=1, bitmap_size=BITMAP_SIZE)
+        queue = InputQueue(config, FakeStatistics())
+
+        def insert(offset, num_bits):
+            node_struct = {"info": {"exit_reason": "regular", "performance": 0.001, "parent": None},
+                           "state": {"name": "initial"}, "new_bytes": {0: 1}}
+            node = QueueNode(config, b"payload", None, node_struct, write=False)
+            bitmap = bytearray(BITMAP_SIZE)
+            bitmap[offset:offset+num_bits] = b"\x01" * num_bits
+            queue.insert_input(node, ExecutionResult.bitmap_from_bytearray(bitmap, "regular", 0))
+            return node
+
+        # many fav bits usually mean a higher priority, pushback must beat a much better fav_factor
+        small = insert(0, 4)
+        large = insert(100, 21)
+        small.set_fav_factor(1000, write=False)
+        queue.update_priority(small)
+        assert(queue.is_pushback(large) and not queue.is_pushback(small))
+
+        assert(queue.get_next() is large)
+        assert(queue.cycle_picks == 0)
+        assert(queue.get_next() is small)
+        assert(queue.cycle_picks == 1)
@@ -0,0 +1,73 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import os
+import sys
+import tempfile
+from argparse import Namespace
+
+from kafl_fuzzer.manager.corpus_store import CorpusStore
+from kafl_fuzzer.manager.node import QueueNode
+from kafl_fuzzer.technique import havoc, radamsa
+from kafl_fuzzer.technique.splice import SplicePool
+
+# stand-in for radamsa -o host:port -n inf, emitting each sample reversed
+FAKE_RADAMSA = """#!%s
+import socket, sys
+args = sys.argv[1:]
+host, port = args[args.index("-o") + 1].split(":")
+samples = args[args.index("-n") + 2:]
+while True:
+    for sample in samples:
+        with open(sample, "rb") as f:
+            data = f.read()[::-1]
+        with socket.create_connection((host, int(port))) as s:
+            s.sendall(data)
+"""
+
+
+def run_radamsa_stream(workdir):
+    fake_path = workdir + "/radamsa"
+    with open(fake_path, "w") as f:
+        f.write(FAKE_RADAMSA % sys.executable)
+    os.chmod(fake_path, 0o755)
+
+    config = Namespace(work_dir=workdir, radamsa=True, radamsa_path=fake_path)
+    radamsa.init_radamsa(config, 0)
+    stream = radamsa.radamsa_stream
+    try:
+        inputs = []
+        radamsa.mutate_seq_radamsa_array(b"", inputs.append, 12)
+        assert len(inputs) == 12
+        assert set(inputs) == {(b"sample%d" % i * 1000)[::-1] for i in range(3)}
+        assert not os.listdir(workdir + "/radamsa_0")
+        assert radamsa.radamsa_stream is stream
+    finally:
+        stream.stop()
+
+
+def test_radamsa_stream():
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(workdir + "/corpus/regular")
+        for i in range(3):
+            with open("%s/corpus/regular/payload_%05d" % (workdir, i), "wb") as f:
+                f.write(b"sample%d" % i * 1000)
+        run_radamsa_stream(workdir)
+
+
+def test_radamsa_corpus_store():
+    # samples are found via node IDs of the splice pool, without corpus files
+    with tempfile.TemporaryDirectory() as workdir:
+        store = CorpusStore(workdir, read_only=False)
+        for i in range(3):
+            store.write_payload(i, b"sample%d" % i * 1000)
+        QueueNode.corpus_store = store
+        havoc.splice_pool = SplicePool(workdir, 16)
+        havoc.splice_pool.add([0, 1, 2])
+        try:
+            run_radamsa_stream(workdir)
+            assert len(os.listdir(workdir + "/radamsa_0_samples")) == 3
+        finally:
+            QueueNode.corpus_store = None
+            havoc.splice_pool = None
@@ -0,0 +1,86 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test kAFL relay between local Workers and a central Manager via TCP
+"""
+
+import os
+import socket
+import tempfile
+import threading
+from argparse import Namespace
+
+from kafl_fuzzer.manager.communicator import ServerConnection, ClientConnection
+from kafl_fuzzer.manager.communicator import MSG_READY, MSG_NEW_INPUT_SPARSE
+from kafl_fuzzer.manager.relay import RelayTask
+
+BITMAP_SIZE = 1 << 16
+
+
+def make_config(work_dir, **kwargs):
+    os.makedirs(work_dir + "/bitmaps", exist_ok=True)
+    return Namespace(work_dir=work_dir, bitmap_size=BITMAP_SIZE, node_cache=16, quiet=True, processes=2,
+                     manager_listen=None, relay=None, **kwargs)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def test_relay():
+    with tempfile.TemporaryDirectory() as manager_dir, tempfile.TemporaryDirectory() as relay_dir:
+        address = "127.0.0.1:%d" % free_port()
+        manager_config = make_config(manager_dir)
+        manager_config.manager_listen = address
+        manager_config.node_cache = 0
+        manager = ServerConnection(manager_config)
+
+        relay_config = make_config(relay_dir)
+        relay_config.relay = address
+        relay = RelayTask(relay_config)
+
+        def relay_loop():
+            try:
+                relay.loop()
+            except SystemExit:
+                pass  # all Workers exited
+        threading.Thread(target=relay_loop, daemon=True).start()
+
+        imports = []
+        def worker(pid):
+            conn = ClientConnection(pid, relay_config)
+            conn.send_ready()
+            imports.append(conn.recv()["task"]["payload"])
+            # same coverage reported twice, from two Workers
+            indices = (b"\x10\x00\x00\x00", b"\x01")
+            conn.send_new_input_sparse(b"payload %d" % pid, *indices, BITMAP_SIZE, {"exit_reason": "regular", "performance": 0})
+            conn.send_ready()
+
+        threads = [threading.Thread(target=worker, args=(pid,)) for pid in range(2)]
+        for thread in threads:
+            thread.start()
+
+        workers = set()
+        inputs = []
+        ready = 0
+        while ready < 4:
+            for conn, msg in manager.wait(1):
+                if msg["type"] == MSG_READY:
+                    # remote Workers always get node data inline
+                    manager.set_payload_cache(conn, msg["node_cache"])
+                    assert(manager.wants_inline(conn))
+                    if msg["worker_id"] not in workers:
+                        manager.send_import(conn, {"type": "import", "payload": b"seed"})
+                    workers.add(msg["worker_id"])
+                    ready += 1
+                elif msg["type"] == MSG_NEW_INPUT_SPARSE:
+                    inputs.append(msg["input"]["payload"])
+
+        for thread in threads:
+            thread.join()
+
+        assert(imports == [b"seed", b"seed"])
+        assert(workers == {"%s/%d" % (socket.gethostname(), pid) for pid in range(2)})
+        assert(len(inputs) == 1)
+        assert(relay.num_dropped == 1)
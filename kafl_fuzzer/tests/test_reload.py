@@ -0,0 +1,49 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from kafl_fuzzer.worker.reload import ReloadController, WINDOW_SECS
+
+
+def run_window(ctl, execs, crashes=0, funky=0, validations=0):
+    # feed one evaluation window of <execs> executions, return new interval
+    now = ctl.window_start + WINDOW_SECS
+    ctl.execs += execs
+    ctl.crashes += crashes
+    ctl.funky += funky
+    ctl.validations += validations
+    ctl.evaluate(now)
+    return ctl.interval
+
+
+def test_reload_controller():
+    ctl = ReloadController(reload_max=64, interval=1)
+    assert ctl.step == 4
+
+    # additive increase while speed does not drop
+    assert run_window(ctl, 1000) == 5
+    assert run_window(ctl, 2000) == 9
+    assert ctl.reason == "faster"
+
+    # increase made things slower => revert and stay there
+    assert run_window(ctl, 1000) == 5
+    assert ctl.reason == "slower"
+    assert run_window(ctl, 1000) == 5
+
+    # multiplicative decrease on funky validations or crashes
+    assert run_window(ctl, 1000, funky=1, validations=4) == 2
+    assert ctl.reason == "funky"
+    assert run_window(ctl, 1000, crashes=100) == 1
+    assert ctl.reason == "crash"
+    assert run_window(ctl, 1000, crashes=100) == 1
+
+    # bounded by reload_max
+    ctl = ReloadController(reload_max=8, interval=100)
+    assert ctl.interval == 8
+    assert run_window(ctl, 1000) == 8
+
+    # window is only evaluated after enough time has passed
+    ctl = ReloadController(reload_max=64, interval=4)
+    for _ in range(100):
+        assert ctl.event_exec() is None
+    assert ctl.interval == 4
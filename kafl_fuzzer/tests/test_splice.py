@@ -0,0 +1,65 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import os
+import random
+import tempfile
+
+from kafl_fuzzer.common.util import find_diffs
+from kafl_fuzzer.technique.helper import helper_init
+from kafl_fuzzer.technique.havoc_handler import havoc_splice_with
+from kafl_fuzzer.technique.splice import SplicePool
+
+helper_init()
+
+
+def find_diffs_ref(data_a, data_b):
+    diffs = [i for i in range(min(len(data_a), len(data_b))) if data_a[i] != data_b[i]]
+    return (diffs[0], diffs[-1]) if diffs else (-1, -1)
+
+
+def test_find_diffs():
+    rand = random.Random(0)
+    assert find_diffs(b"", b"abc") == (-1, -1)
+    assert find_diffs(b"abc", b"abcdef") == (-1, -1)
+    assert find_diffs(b"abc", b"xbc") == (0, 0)
+    for _ in range(1000):
+        data_a = bytes(rand.choice(b"ab") for _ in range(rand.randint(0, 16)))
+        data_b = bytes(rand.choice(b"ab") for _ in range(rand.randint(0, 16)))
+        assert find_diffs(data_a, data_b) == find_diffs_ref(data_a, data_b)
+
+
+def test_splice_pool():
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(workdir + "/corpus/regular")
+        payloads = {1: b"AAAAAAAA", 2: b"AAAABBBB", 3: b"A", 4: b"BBBBBBBB"}
+        for nid, payload in payloads.items():
+            with open("%s/corpus/regular/payload_%05d" % (workdir, nid), "wb") as f:
+                f.write(payload)
+
+        pool = SplicePool(workdir, cache_size=2)
+        assert not pool
+        pool.add([1, 2, 3])
+        pool.add([2, 3, 4, 5])
+        assert len(pool) == 5
+
+        # never returns the input itself, too short or missing payloads
+        partners = list(pool.partners(b"AAAAAAAA", 64))
+        assert partners and set(partners) <= {b"AAAABBBB", b"BBBBBBBB"}
+        assert len(pool.cache.entries) == 2
+        assert pool.fingerprints[3][0] == 1
+
+        spliced = havoc_splice_with(b"AAAAAAAA", pool.partners(b"AAAAAAAA", 64))
+        assert spliced and len(spliced) == 8 and spliced != b"AAAAAAAA"
+
+
+def test_splice_pool_remote():
+    # payloads sent along with the IDs, only the newest are kept
+    pool = SplicePool(None, cache_size=2)
+    pool.add([1, 2], [b"AAAAAAAA", b"AAAABBBB"])
+    pool.add([2, 3], [b"AAAABBBB", b"BBBBBBBB"])
+    assert pool.ids == [2, 3]
+    assert list(pool.cache.entries) == [2, 3]
+    assert pool.get_payload(1) is None
+    assert set(pool.partners(b"AAAAAAAA", 64)) == {b"AAAABBBB", b"BBBBBBBB"}
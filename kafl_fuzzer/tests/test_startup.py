@@ -0,0 +1,48 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test coordination of parallel Qemu launches
+"""
+
+import tempfile
+import threading
+import time
+
+from kafl_fuzzer.worker.startup import LaunchCoordinator
+
+
+def test_snapshot_ready():
+    with tempfile.TemporaryDirectory() as work_dir:
+        creator = LaunchCoordinator(work_dir, 0, 2)
+        creator.signal_ready()
+        LaunchCoordinator.reset(work_dir)
+
+        waiter = LaunchCoordinator(work_dir, 1, 2)
+        assert(not waiter.wait_ready(timeout=0.1))
+
+        timer = threading.Timer(0.2, creator.signal_ready)
+        timer.start()
+        start = time.time()
+        assert(waiter.wait_ready(timeout=10))
+        # woken up by inotify, not by the once per second re-check
+        assert(time.time() - start < 0.9)
+        timer.join()
+
+def test_launch_slots():
+    with tempfile.TemporaryDirectory() as work_dir:
+        launchers = [LaunchCoordinator(work_dir, pid, 2) for pid in range(1, 4)]
+        launchers[0].acquire_slot()
+        launchers[1].acquire_slot()
+
+        # third launch must wait for a free slot
+        thread = threading.Thread(target=launchers[2].acquire_slot)
+        thread.start()
+        thread.join(timeout=0.2)
+        assert(thread.is_alive())
+
+        launchers[0].release_slot()
+        launchers[1].release_slot()
+        thread.join(timeout=5)
+        assert(not thread.is_alive())
+        launchers[2].release_slot()
@@ -0,0 +1,54 @@
+# Copyright (C) 2022 Intel Corporation
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Test kAFL shared Worker statistics
+"""
+
+import tempfile
+import time
+from argparse import Namespace
+
+from kafl_fuzzer.manager.statistics import ManagerStatistics, WorkerStatistics
+
+
+def test_worker_stats_segment():
+    with tempfile.TemporaryDirectory() as work_dir:
+        config = Namespace(work_dir=work_dir, quiet=True, processes=3)
+        manager = ManagerStatistics(config)
+        workers = [WorkerStatistics(pid, config) for pid in range(3)]
+
+        for pid, worker in enumerate(workers):
+            worker.event_stage("havoc", pid + 1)
+            for _ in range(10 * (pid + 1)):
+                worker.event_exec(bb_cov=pid)
+            worker.event_reload("timeout")
+            worker.snapshot()
+
+        manager.event_worker_poll()
+        assert(manager.data["total_execs"] == 60)
+        assert(manager.data["num_timeout"] == 3)
+        assert(manager.data["max_bb_cov"] == 2)
+
+        stats = manager.worker_stats.read_all()
+        assert([x["node_id"] for x in stats] == [1, 2, 3])
+        assert(stats[2]["stage"] == "havoc")
+        assert("method" not in stats[2])
+
+        # time-based fields are only updated by the snapshotter
+        worker = workers[0]
+        worker.write_last -= 1
+        worker.event_exec()
+        assert(worker.slot.run_time > 0 and worker.slot.execs_per_sec > 0)
+        assert(worker.check_execs > worker.get_total_execs())
+
+        # slow executions after a fast stage are still published on method change and by timer
+        worker.check_interval = 4096
+        worker.check_execs = worker.get_total_execs() + 4096
+        worker.event_exec()
+        worker.event_method("afl_havoc")
+        assert(worker.slot.total_execs == worker.get_total_execs())
+        worker.event_exec()
+        time.sleep(2 * worker.write_thres + 0.1)
+        assert(worker.slot.total_execs == worker.get_total_execs())
+        assert(time.time() - worker.write_last < 2 * worker.write_thres)
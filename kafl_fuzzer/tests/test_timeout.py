@@ -0,0 +1,37 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+import random
+
+from kafl_fuzzer.manager.timeout import TimeoutModel, MIN_SAMPLES
+
+
+def test_timeout_model():
+    model = TimeoutModel(t_soft=0.001, t_hard=4, quantile=0.99)
+
+    # static timeouts until enough samples are seen
+    assert model.recommend() is None
+    assert model.node_timeout(0.01) == 0.001 + 1.2 * 0.01
+
+    rand = random.Random(0)
+    runtimes = sorted(rand.uniform(0.001, 0.01) for _ in range(10000))
+    for runtime in runtimes:
+        model.add(runtime)
+    model.add(0)  # ignored
+
+    # percentiles are accurate to one bucket width
+    p99 = runtimes[int(0.99 * len(runtimes)) - 1]
+    assert p99 <= model.percentile(0.99) <= 1.1 * p99
+    assert model.recommend() == 2 * model.percentile(0.99)
+
+    # slow nodes keep their own timeout, everything is bounded by t_hard
+    assert model.node_timeout(0.001) == model.recommend()
+    assert model.node_timeout(1) == 0.001 + 1.2
+    assert model.node_timeout(10) == 4
+
+    # soft timeout is a lower bound
+    model = TimeoutModel(t_soft=1, t_hard=4)
+    for _ in range(MIN_SAMPLES):
+        model.add(0.001)
+    assert model.recommend() == 1
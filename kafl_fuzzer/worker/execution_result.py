@@ -8,8 +8,13 @@ import mmh3
 
 from kafl_fuzzer.native import loader as native_loader
 
+HASH_SEED = 0xaaaaaaaa
+
 class ExecutionResult:
     bitmap_native_so = None
+    hash_out = ctypes.c_uint64()
+    nonzero_scratch = None
+    values_scratch = None
 
     @staticmethod
     def bitmap_from_bytearray(bitmap, exitreason, performance):
@@ -17,14 +22,22 @@ class ExecutionResult:
         c_bitmap = (ctypes.c_uint8 * bitmap_size).from_buffer_copy(bitmap)
         return ExecutionResult(c_bitmap, bitmap_size, exitreason, performance)
 
+    @staticmethod
+    def bitmap_from_sparse(indices, values, bitmap_size, exitreason, performance):
+        return SparseExecutionResult(indices, values, bitmap_size, exitreason, performance)
+
     @staticmethod
     def get_null_hash(bitmap_size):
         # corresponds to libxdc_bitmap_get_hash()
-        return "%016x" % mmh3.hash64(bytes(bitmap_size), seed=0xaaaaaaaa, x64arch=True, signed=False)[0]
+        return "%016x" % mmh3.hash64(bytes(bitmap_size), seed=HASH_SEED, x64arch=True, signed=False)[0]
 
     def __init__(self, cbuffer, bitmap_size, exit_reason, performance):
         if not ExecutionResult.bitmap_native_so:
             ExecutionResult.bitmap_native_so = ctypes.CDLL(native_loader.bitmap_path())
+            ExecutionResult.bitmap_native_so.bitmap_nonzero.restype = ctypes.c_uint64
+            ExecutionResult.bitmap_native_so.bitmap_compare.restype = ctypes.c_uint64
+            ExecutionResult.bitmap_native_so.bitmap_classify_hash.restype = ctypes.c_uint64
+            ExecutionResult.bitmap_native_so.bitmap_hash.restype = ctypes.c_uint64
 
         self.bitmap_size = bitmap_size
         self.cbuffer = cbuffer
@@ -32,9 +45,13 @@ class ExecutionResult:
         self.exit_reason = exit_reason
         self.performance = performance
         self.starved = False
+        self.nonzero = None
+        self.hash_value = None
 
     def invalidate(self):
         self.cbuffer = None
+        self.nonzero = None
+        self.hash_value = None
         return self
     
     def set_starved(self, _starved):
@@ -55,17 +72,125 @@ class ExecutionResult:
     def copy_to_array(self):
         return bytearray(self.cbuffer)
 
+    def view(self):
+        # zero-copy view, only valid until the next execution
+        return memoryview(self.cbuffer)
+
+    def snapshot(self, buffer=None):
+        # copy that outlives the next execution, optionally reusing a prior snapshot buffer
+        if buffer is None or len(buffer) != self.bitmap_size:
+            buffer = (ctypes.c_uint8 * self.bitmap_size)()
+        ctypes.memmove(buffer, self.cbuffer, self.bitmap_size)
+        return buffer
+
+    def compare(self, snapshot):
+        # offset of first difference to snapshot, or bitmap_size if equal
+        return ExecutionResult.bitmap_native_so.bitmap_compare(self.cbuffer, snapshot,
+                                                               ctypes.c_uint64(self.bitmap_size))
+
+    def equals(self, snapshot):
+        return self.compare(snapshot) == self.bitmap_size
+
+    def is_sparse(self):
+        return False
+
+    def __scratch(self):
+        if not ExecutionResult.nonzero_scratch or len(ExecutionResult.nonzero_scratch) < self.bitmap_size:
+            ExecutionResult.nonzero_scratch = (ctypes.c_uint32 * self.bitmap_size)()
+            ExecutionResult.values_scratch = (ctypes.c_uint8 * self.bitmap_size)()
+        return ExecutionResult.nonzero_scratch, ExecutionResult.values_scratch
+
+    def nonzero_indices(self):
+        # sparse list of non-zero bitmap entries, cached for reuse by multiple consumers
+        # apply_lut() does not change which entries are non-zero so no need to invalidate
+        if self.nonzero is None:
+            idx, _ = self.__scratch()
+            num = ExecutionResult.bitmap_native_so.bitmap_nonzero(self.cbuffer, ctypes.c_uint64(self.bitmap_size),
+                                                                  idx, None)
+            self.nonzero = idx[:num]
+        return self.nonzero
+
+    def nonzero_items(self):
+        cbuffer = self.cbuffer
+        return [(index, cbuffer[index]) for index in self.nonzero_indices()]
+
+    def copy_to_sparse(self):
+        # encode as packed uint32 indices + uint8 values for sending to Manager
+        idx, val = self.__scratch()
+        num = ExecutionResult.bitmap_native_so.bitmap_nonzero(self.cbuffer, ctypes.c_uint64(self.bitmap_size),
+                                                              idx, val)
+        return ctypes.string_at(idx, 4*num), ctypes.string_at(val, num)
+
     def hash(self, pre_lut=False):
         # libxdc_bitmap_get_hash() is computed prior to apply_lut()
         # For debug, set pre_lut=True to get a compatible hash or die trying
         if self.lut_applied:
             assert not pre_lut, "Request pre-LUT hash but LUT has been applied already."
-        else:
-            self.apply_lut()
-        return "%016x" % mmh3.hash64(self.cbuffer, seed=0xaaaaaaaa, x64arch=True, signed=False)[0]
+        if self.hash_value is None:
+            self.hash_value = ExecutionResult.bitmap_native_so.bitmap_hash(self.cbuffer, ctypes.c_uint64(self.bitmap_size),
+                                                                           ctypes.c_uint8(not self.lut_applied),
+                                                                           ctypes.c_uint32(HASH_SEED))
+            self.lut_applied = True
+        return "%016x" % self.hash_value
+
+    def classify(self, c_bitmap):
+        # apply lut, count new bytes/bits against c_bitmap and cache the hash in a single pass
+        result = ExecutionResult.bitmap_native_so.bitmap_classify_hash(c_bitmap, self.cbuffer,
+                                                                       ctypes.c_uint64(self.bitmap_size),
+                                                                       ctypes.c_uint8(not self.lut_applied),
+                                                                       ctypes.c_uint32(HASH_SEED),
+                                                                       ctypes.byref(ExecutionResult.hash_out))
+        self.lut_applied = True
+        self.hash_value = ExecutionResult.hash_out.value
+        return result >> 32, result & 0xFFFFFFFF
 
     def apply_lut(self):
         if not self.lut_applied:
             ExecutionResult.bitmap_native_so.apply_bucket_lut(self.cbuffer, ctypes.c_uint64(self.bitmap_size))
             self.lut_applied = True
         return self
+
+
+class SparseExecutionResult(ExecutionResult):
+    """
+    Execution result in index/value encoding, as received from Worker.
+
+    The dense bitmap is only materialized if some consumer accesses cbuffer.
+    """
+
+    def __init__(self, indices, values, bitmap_size, exit_reason, performance):
+        assert len(indices) == 4*len(values), "Malformed sparse bitmap"
+        self.num_entries = len(values)
+        self.c_indices = (ctypes.c_uint32 * self.num_entries).from_buffer_copy(indices)
+        self.c_values = (ctypes.c_uint8 * self.num_entries).from_buffer_copy(values)
+        self.dense = None
+        super().__init__(None, bitmap_size, exit_reason, performance)
+        # sparse bitmaps are produced from bucketized Worker results
+        self.lut_applied = True
+
+    @property
+    def cbuffer(self):
+        if self.dense is None:
+            self.dense = (ctypes.c_uint8 * self.bitmap_size)()
+            ExecutionResult.bitmap_native_so.sparse_to_bitmap(self.dense, self.c_indices, self.c_values,
+                                                              ctypes.c_uint64(self.num_entries),
+                                                              ctypes.c_uint64(self.bitmap_size))
+        return self.dense
+
+    @cbuffer.setter
+    def cbuffer(self, cbuffer):
+        self.dense = cbuffer
+
+    def is_sparse(self):
+        return True
+
+    def nonzero_indices(self):
+        if self.nonzero is None:
+            self.nonzero = self.c_indices[:]
+        return self.nonzero
+
+    def nonzero_items(self):
+        return list(zip(self.c_indices, self.c_values))
+
+    def copy_to_sparse(self):
+        return bytes(self.c_indices), bytes(self.c_values)
@@ -20,9 +20,11 @@ import logging
 
 from kafl_fuzzer.common.util import strdump, print_hprintf
 from kafl_fuzzer.technique.redqueen.workdir import RedqueenWorkdir
+from kafl_fuzzer.worker import qemu_batch
 from kafl_fuzzer.worker.execution_result import ExecutionResult
 from kafl_fuzzer.worker.qemu_aux_buffer import QemuAuxBuffer
 from kafl_fuzzer.worker.qemu_aux_buffer import QemuAuxRC as RC
+from kafl_fuzzer.worker.startup import LaunchCoordinator
 from kafl_fuzzer.common.logger import WorkerLogAdapter
 
 class QemuIOException(Exception):
@@ -51,6 +53,7 @@ class qemu:
         self.process = None
         self.control = None
         self.persistent_runs = 0
+        self.reload_interval = config.reload
 
         work_dir = self.config.work_dir
 
@@ -75,6 +78,7 @@ class qemu:
 
         self.starved = False
         self.exiting = False
+        self.resume = resume
 
         # TODO: list append should work better than string concatenation, especially for str.replace() and later popen()
         self.cmd = self.config.qemu_base
@@ -140,7 +144,8 @@ class qemu:
         self.cmd.append("-fast_vm_reload")
         snapshot_path = work_dir + "/snapshot/"
 
-        if pid == 0 or pid == 1337 and not resume:
+        self.snapshot_creator = pid == 0 or pid == 1337 and not resume
+        if self.snapshot_creator:
             # boot and create snapshot
             if self.config.qemu_snapshot:
                 self.cmd.append("path=%s,load=off,pre_path=%s" % (snapshot_path, self.config.qemu_snapshot))
@@ -249,9 +254,14 @@ class qemu:
                 else:
                     final_cmdline += ' ' + arg
 
-        # delayed Qemu startup - some nasty race condition when launching too many at once
+        # other instances load the snapshot created by the first one, and launching
+        # too many at once is racy - wait for the snapshot and a free launch slot
+        launcher = LaunchCoordinator(self.config.work_dir, self.pid, self.config.qemu_launch)
         if self.pid not in [0, 1337]:
-            time.sleep(4 + 0.1*self.pid)
+            if not self.resume and not launcher.wait_ready(timeout=self.config.qemu_ready_timeout):
+                self.logger.error("Snapshot not ready after %ds, check Worker 0. Exit.", self.config.qemu_ready_timeout)
+                return False
+            launcher.acquire_slot()
 
         self.logger.info("Launching virtual machine...%s", final_cmdline)
 
@@ -274,11 +284,18 @@ class qemu:
                 self.logger.error("Failed to connect to Qemu: %s", str(e))
                 self.async_exit()
             return False
+        finally:
+            launcher.release_slot()
 
-        self.logger.debug("Handshake done.")
+        if self.snapshot_creator:
+            launcher.signal_ready()
+
+        t_total, t_snapshot, t_slot = launcher.latency()
+        self.logger.info("Qemu ready after %.1fs (waited %.1fs for snapshot, %.1fs for launch slot).",
+                         t_total, t_snapshot, t_slot)
 
         # for -R = {0,1}, set reload_mode here just once
-        if self.config.reload == 1:
+        if self.reload_interval == 1:
             self.qemu_aux_buffer.set_reload_mode(True)
         else:
             self.qemu_aux_buffer.set_reload_mode(False)
@@ -327,9 +344,11 @@ class qemu:
         self.control.setblocking(1)
 
         # Wait for the socket to appear. Fail early if Qemu is done and we get no socket.
+        # Poll quickly at first, then back off.
         retry_timeout = 6
-        retry_interval = 0.1
-        for _ in range(int(retry_timeout/retry_interval)):
+        retry_interval = 0.005
+        deadline = time.time() + retry_timeout
+        while time.time() < deadline:
             try:
                 self.control.connect(self.control_filename)
                 return True
@@ -339,6 +358,7 @@ class qemu:
                     raise e
             self.logger.debug("Waiting for Qemu connect..")
             time.sleep(retry_interval)
+            retry_interval = min(2*retry_interval, 0.2)
 
     def store_crashlogs(self, label, stamp):
         # Collect current/accumulated logs
@@ -416,11 +436,11 @@ class qemu:
             sys.exit(0)
 
         # for -R > 1, count and toggle reload_mode at runtime
-        if self.config.reload > 1:
+        if self.reload_interval > 1:
             self.persistent_runs += 1
             if self.persistent_runs == 1:
                 self.qemu_aux_buffer.set_reload_mode(False)
-            if self.persistent_runs >= self.config.reload:
+            if self.persistent_runs >= self.reload_interval:
                 self.qemu_aux_buffer.set_reload_mode(True)
                 self.persistent_runs = 0
 
@@ -428,9 +448,62 @@ class qemu:
             # flush crashlogs after VM state reset (persistent_runs=0)
             self.flush_crashlogs()
 
+        start_time = time.time()
+        result = self.__run_until_done()
+
+        # record highest seen BBs
+        self.bb_seen = max(self.bb_seen, result.bb_cov)
+
+        #runtime = result.runtime_sec + result.runtime_usec/1000/1000
+        res = ExecutionResult(
+                self.c_bitmap, self.bitmap_size,
+                self.exit_reason(result), time.time() - start_time)
+
+        if result.exec_code == RC.STARVED:
+            res.starved = True
+
+        #self.audit(res.copy_to_array())
+        #self.audit(bytearray(self.c_bitmap))
+
+        return res
+
+    def set_reload_interval(self, interval):
+        # change -R at runtime, starting a new persistent cycle
+        self.reload_interval = interval
+        self.persistent_runs = 0
+        self.qemu_aux_buffer.set_reload_mode(interval == 1)
+
+    def get_batch_size(self):
+        # max number of payloads per execute_batch(), 0 if not supported by backend
+        return qemu_batch.get_batch_cap(self.qemu_aux_buffer.aux_buffer)
+
+    def execute_batch(self, payloads):
+        # Execute payloads in a single Qemu round trip per batch, see qemu_batch.py.
+        # Returns a batch_result for each payload.
+        if self.exiting:
+            sys.exit(0)
+
+        # reload mode is applied per batch
+        if self.reload_interval > 1:
+            self.persistent_runs += len(payloads)
+            self.qemu_aux_buffer.set_reload_mode(self.persistent_runs >= self.reload_interval)
+            self.persistent_runs %= self.reload_interval
+
+        def run():
+            result = self.__run_until_done()
+            self.bb_seen = max(self.bb_seen, result.bb_cov)
+
+        try:
+            return qemu_batch.execute_batch(self.qemu_aux_buffer.aux_buffer, self.fs_shm, payloads, run)
+        except ValueError:
+            if self.exiting:
+                sys.exit(0)
+            self.logger.error("Failed to set batch payloads - Qemu crash?")
+            raise
+
+    def __run_until_done(self):
         result = None
         old_address = 0
-        start_time = time.time()
 
         while True:
             self.run_qemu()
@@ -458,21 +531,7 @@ class qemu:
                 old_address = result.page_fault_addr
                 self.qemu_aux_buffer.dump_page(result.page_fault_addr)
 
-        # record highest seen BBs
-        self.bb_seen = max(self.bb_seen, result.bb_cov)
-
-        #runtime = result.runtime_sec + result.runtime_usec/1000/1000
-        res = ExecutionResult(
-                self.c_bitmap, self.bitmap_size,
-                self.exit_reason(result), time.time() - start_time)
-
-        if result.exec_code == RC.STARVED:
-            res.starved = True
-
-        #self.audit(res.copy_to_array())
-        #self.audit(bytearray(self.c_bitmap))
-
-        return res
+        return result
 
     def audit(self, bitmap):
 
@@ -62,7 +62,9 @@ class QemuAuxBuffer:
 
     def __init__(self, file):
         self.aux_buffer_fd = os.open(file, os.O_RDWR | os.O_SYNC)
-        self.aux_buffer = mmap.mmap(self.aux_buffer_fd, 0x1000, mmap.MAP_SHARED, mmap.PROT_WRITE | mmap.PROT_READ) # fix this later
+        # backends supporting batched execution provide a larger buffer, see qemu_batch.py
+        size = max(0x1000, os.fstat(self.aux_buffer_fd).st_size)
+        self.aux_buffer = mmap.mmap(self.aux_buffer_fd, size, mmap.MAP_SHARED, mmap.PROT_WRITE | mmap.PROT_READ)
         self.current_timeout = None
 
     def validate_header(self):
@@ -0,0 +1,142 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Batched execution protocol between Worker and Qemu backend.
+
+Instead of one control socket round trip per payload, the Worker packs
+several payloads into the shared input buffer, sets the batch size in the
+aux buffer config and releases Qemu once. The backend executes all payloads
+and stores one result record per payload in the extended aux buffer:
+
+  input buffer:  BATCH_HDR (magic, count), then per payload BATCH_ENTRY
+                 (length) + payload, padded to 4 bytes
+  aux buffer:    BATCH_CAP_OFFSET   max batch size supported by backend (0 = none)
+                 BATCH_SIZE_OFFSET  number of payloads in current batch (0 = single payload mode)
+                 BATCH_RESULT_OFFSET  one BATCH_RESULT per payload
+
+Result records only hold exit code, bitmap hash and a flag for new coverage
+against the bitmaps given to the backend, so the Worker only has to re-run
+the interesting ones to get at the full bitmap.
+
+MockBatchBackend implements the backend side in Python, for testing.
+"""
+
+import struct
+import time
+from collections import namedtuple
+
+from kafl_fuzzer.worker.execution_result import ExecutionResult
+from kafl_fuzzer.worker.qemu_aux_buffer import QemuAuxRC as RC
+from kafl_fuzzer.worker.qemu_aux_buffer import CAP_OFFSET, CONFIG_OFFSET
+
+BATCH_MAGIC = 0x6b62746368
+BATCH_HDR = struct.Struct("<QI")              # magic, number of payloads
+BATCH_ENTRY = struct.Struct("<I")             # payload length
+BATCH_RESULT = struct.Struct("<BBHIQ")        # exit code, new coverage, reserved, runtime (usec), hash
+
+BATCH_CAP_OFFSET = CAP_OFFSET + 64
+BATCH_SIZE_OFFSET = CONFIG_OFFSET + 64
+BATCH_RESULT_OFFSET = 0x1000
+BATCH_CAP = struct.Struct("<H")
+
+batch_result = namedtuple('batch_result', ['exit_reason', 'new_coverage', 'runtime', 'hash'])
+
+EXIT_REASONS = {RC.SUCCESS: "regular", RC.STARVED: "regular", RC.CRASH: "crash",
+                RC.TIMEOUT: "timeout", RC.SANITIZER: "kasan"}
+EXIT_CODES = {"regular": RC.SUCCESS, "crash": RC.CRASH, "timeout": RC.TIMEOUT, "kasan": RC.SANITIZER}
+
+
+def max_results(aux_buffer):
+    return (len(aux_buffer) - BATCH_RESULT_OFFSET) // BATCH_RESULT.size
+
+def get_batch_cap(aux_buffer):
+    # 0 if backend or aux buffer size do not support batches
+    if max_results(aux_buffer) <= 0:
+        return 0
+    cap = BATCH_CAP.unpack_from(aux_buffer, BATCH_CAP_OFFSET)[0]
+    return min(cap, max_results(aux_buffer))
+
+def set_batch_size(aux_buffer, num):
+    BATCH_CAP.pack_into(aux_buffer, BATCH_SIZE_OFFSET, num)
+
+def get_batch_size(aux_buffer):
+    return BATCH_CAP.unpack_from(aux_buffer, BATCH_SIZE_OFFSET)[0]
+
+def pack_batch(input_buffer, payloads, max_num):
+    # pack as many payloads as fit, return their number
+    offset = BATCH_HDR.size
+    num = 0
+    for payload in payloads[:max_num]:
+        end = offset + BATCH_ENTRY.size + len(payload)
+        if end > len(input_buffer):
+            break
+        BATCH_ENTRY.pack_into(input_buffer, offset, len(payload))
+        input_buffer[offset + BATCH_ENTRY.size:end] = payload
+        offset = (end + 3) & ~3
+        num += 1
+    BATCH_HDR.pack_into(input_buffer, 0, BATCH_MAGIC, num)
+    return num
+
+def unpack_batch(input_buffer):
+    magic, num = BATCH_HDR.unpack_from(input_buffer, 0)
+    assert magic == BATCH_MAGIC, "Invalid batch header"
+    offset = BATCH_HDR.size
+    payloads = []
+    for _ in range(num):
+        length = BATCH_ENTRY.unpack_from(input_buffer, offset)[0]
+        start = offset + BATCH_ENTRY.size
+        payloads.append(bytes(input_buffer[start:start + length]))
+        offset = (start + length + 3) & ~3
+    return payloads
+
+def read_results(aux_buffer, num):
+    results = []
+    for i in range(num):
+        exit_code, new, _, usec, hash_value = BATCH_RESULT.unpack_from(aux_buffer, BATCH_RESULT_OFFSET + i*BATCH_RESULT.size)
+        results.append(batch_result(EXIT_REASONS[exit_code], bool(new), usec/1000/1000, "%016x" % hash_value))
+    return results
+
+def write_result(aux_buffer, index, exit_code, new, runtime, hash_value):
+    BATCH_RESULT.pack_into(aux_buffer, BATCH_RESULT_OFFSET + index*BATCH_RESULT.size,
+                           exit_code, int(new), 0, int(runtime*1000*1000), hash_value)
+
+def execute_batch(aux_buffer, input_buffer, payloads, run):
+    # run payloads in batches of the supported size, run() releases the backend once
+    max_num = get_batch_cap(aux_buffer)
+    assert max_num > 0, "Backend does not support batched execution"
+    results = []
+    while len(results) < len(payloads):
+        num = pack_batch(input_buffer, payloads[len(results):], max_num)
+        assert num > 0, "Payload does not fit into input buffer"
+        set_batch_size(aux_buffer, num)
+        run()
+        results.extend(read_results(aux_buffer, num))
+    set_batch_size(aux_buffer, 0)
+    return results
+
+
+class MockBatchBackend:
+    """
+    Backend side of the batch protocol, executing payloads with a Python
+    target function that returns (exit_reason, bitmap).
+    """
+
+    def __init__(self, aux_buffer, input_buffer, target, bitmap_storage, max_batch=64):
+        self.aux_buffer = aux_buffer
+        self.input_buffer = input_buffer
+        self.target = target
+        self.bitmap_storage = bitmap_storage
+        BATCH_CAP.pack_into(aux_buffer, BATCH_CAP_OFFSET, max_batch)
+
+    def run(self):
+        num = get_batch_size(self.aux_buffer)
+        payloads = unpack_batch(self.input_buffer)
+        assert len(payloads) == num, "Batch size mismatch"
+        for index, payload in enumerate(payloads):
+            start = time.time()
+            exit_reason, bitmap = self.target(payload)
+            res = ExecutionResult.bitmap_from_bytearray(bitmap, exit_reason, time.time() - start)
+            new = self.bitmap_storage.should_send_to_manager(res, exit_reason)
+            write_result(self.aux_buffer, index, EXIT_CODES[exit_reason], new, res.performance, int(res.hash(), 16))
@@ -0,0 +1,98 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Auto-tune the snapshot reload interval (-R) of a Worker.
+
+Persistent runs are much faster than snapshot reloads, but accumulate state
+in the target. This shows as funky inputs failing validation, or crashes
+that only occur in a particular sequence of executions.
+
+The controller evaluates a window of executions every few seconds. If the
+rate of funky validations or crashes is too high, the interval is halved.
+Otherwise it is increased by a fixed step, as long as this does not make
+execution slower than at the previous interval (AIMD).
+"""
+
+import time
+
+WINDOW_SECS = 2       # minimum time per evaluation window
+FUNKY_MAX = 0.05      # max ratio of funky input validations
+CRASH_MAX = 0.01      # max ratio of crashing executions
+SPEED_TOL = 0.1       # tolerated slowdown when increasing the interval
+
+
+class ReloadController:
+
+    def __init__(self, reload_max, interval=1):
+        self.reload_max = max(1, reload_max)
+        self.step = max(1, self.reload_max // 16)
+        self.interval = min(self.reload_max, max(1, interval))
+        self.limit = self.reload_max
+        self.prev_interval = self.interval
+        self.prev_speed = 0
+        self.reason = "init"
+
+        self.window_start = time.time()
+        self.check_execs = self.interval
+        self.execs = 0
+        self.crashes = 0
+        self.validations = 0
+        self.funky = 0
+
+    def event_exec(self, crash=False):
+        # returns the new interval on change, otherwise None
+        self.execs += 1
+        if crash:
+            self.crashes += 1
+        if self.execs < self.check_execs:
+            return None
+        return self.evaluate(time.time())
+
+    def event_validate(self, stable):
+        self.validations += 1
+        if not stable:
+            self.funky += 1
+
+    def reset_window(self, now):
+        self.window_start = now
+        self.execs = 0
+        self.crashes = 0
+        self.validations = 0
+        self.funky = 0
+
+    def evaluate(self, now):
+        elapsed = now - self.window_start
+        if elapsed < WINDOW_SECS:
+            # check time again after about the same number of execs, covering at least one reload
+            self.check_execs = self.execs + max(self.interval, self.execs // max(1, int(elapsed * 4)))
+            return None
+
+        speed = self.execs / elapsed
+        funky_rate = self.funky / self.validations if self.validations else 0
+        crash_rate = self.crashes / self.execs
+
+        interval = self.interval
+        if funky_rate > FUNKY_MAX or crash_rate > CRASH_MAX:
+            interval = max(1, interval // 2)
+            self.limit = self.reload_max
+            self.reason = "funky" if funky_rate > FUNKY_MAX else "crash"
+        elif speed < self.prev_speed * (1 - SPEED_TOL) and self.prev_interval < interval:
+            # last increase did not pay off
+            interval = self.prev_interval
+            self.limit = self.prev_interval
+            self.reason = "slower"
+        elif interval < self.limit:
+            interval = min(self.limit, interval + self.step)
+            self.reason = "faster"
+
+        self.prev_interval = self.interval
+        self.prev_speed = speed
+        self.reset_window(now)
+        self.check_execs = interval
+
+        if interval == self.interval:
+            return None
+        self.interval = interval
+        return interval
@@ -0,0 +1,96 @@
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Coordinate Qemu startup of multiple Workers.
+
+The first instance boots the VM and creates the snapshot, signaling completion
+by creating a marker file in the workdir. All other instances wait for this
+marker via inotify and then launch in parallel, limited to a number of launch
+slots held as file locks for the duration of the Qemu launch and handshake.
+"""
+
+import fcntl
+import os
+import time
+import logging
+
+import inotify.adapters
+import inotify.constants
+
+SNAPSHOT_READY = "/snapshot_ready"
+LAUNCH_SLOT = "/launch_slot_%d.lock"
+
+logger = logging.getLogger(__name__)
+
+
+class LaunchCoordinator:
+
+    def __init__(self, work_dir, pid, parallel):
+        self.work_dir = work_dir
+        self.pid = pid
+        self.parallel = max(1, parallel)
+        self.slot_fd = None
+        self.t_start = time.time()
+        self.t_ready = self.t_start
+        self.t_slot = self.t_start
+
+    @staticmethod
+    def reset(work_dir):
+        # remove marker of a previous run, before any Workers are launched
+        try:
+            os.remove(work_dir + SNAPSHOT_READY)
+        except FileNotFoundError:
+            pass
+
+    def signal_ready(self):
+        with open(self.work_dir + SNAPSHOT_READY, 'w') as f:
+            f.write("%d\n" % self.pid)
+
+    def is_ready(self):
+        return os.path.exists(self.work_dir + SNAPSHOT_READY)
+
+    def wait_ready(self, timeout=None):
+        # returns False if the snapshot did not become ready within timeout
+        notifier = inotify.adapters.Inotify()
+        notifier.add_watch(self.work_dir, mask=inotify.constants.IN_CREATE | inotify.constants.IN_MOVED_TO)
+        try:
+            while not self.is_ready():
+                waited = time.time() - self.t_start
+                if timeout is not None and waited > timeout:
+                    return False
+                # wake up on any file creation in workdir, re-check at least once per second
+                for _ in notifier.event_gen(timeout_s=1, yield_nones=False):
+                    break
+        finally:
+            notifier.remove_watch(self.work_dir)
+        self.t_ready = time.time()
+        return True
+
+    def acquire_slot(self):
+        # try all slots starting at our own, then block on our own
+        for i in range(self.parallel):
+            slot = (self.pid + i) % self.parallel
+            fd = os.open(self.work_dir + LAUNCH_SLOT % slot, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.slot_fd = fd
+                break
+            except BlockingIOError:
+                os.close(fd)
+        else:
+            fd = os.open(self.work_dir + LAUNCH_SLOT % (self.pid % self.parallel), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self.slot_fd = fd
+        self.t_slot = time.time()
+
+    def release_slot(self):
+        if self.slot_fd is not None:
+            os.close(self.slot_fd)
+            self.slot_fd = None
+
+    def latency(self):
+        # (total, snapshot wait, slot wait) in seconds
+        now = time.time()
+        return now - self.t_start, self.t_ready - self.t_start, self.t_slot - self.t_ready
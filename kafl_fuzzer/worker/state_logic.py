@@ -15,6 +15,8 @@ from kafl_fuzzer.technique.redqueen.colorize import ColorizerStrategy
 from kafl_fuzzer.technique.redqueen.mod import RedqueenInfoGatherer
 from kafl_fuzzer.technique.redqueen.workdir import RedqueenWorkdir
 from kafl_fuzzer.technique import trim, bitflip, arithmetic, interesting_values, havoc, radamsa
+from kafl_fuzzer.technique import deterministic
+from kafl_fuzzer.technique.havoc_schedule import HavocSchedule
 from kafl_fuzzer.technique import grimoire_mutations as grimoire
 #from kafl_fuzzer.technique.trim import perform_trim, perform_center_trim, perform_extend
 #import kafl_fuzzer.technique.bitflip as bitflip
@@ -44,20 +46,13 @@ class FuzzingStateLogic:
         self.attention_secs_start = None
         self.attention_execs_start = None
 
+        # havoc payloads queued for batched execution, see execute_batched()
+        self.batch = []
+        self.batch_size = config.exec_batch
+
     def __str__(self):
         return str(self.worker)
 
-    def create_limiter_map(self, payload):
-        limiter_map = bytearray([1 for _ in range(len(payload))])
-        if self.config.afl_skip_range:
-            for ignores in self.config.afl_skip_range:
-                self.logger.debug("AFL ignore-range 0: " + str(ignores[0]) + " " + str(min(ignores[0], len(payload))))
-                self.logger.debug("AFL ignore-range 1: " + str(ignores[1]) + " " + str(min(ignores[1], len(payload))))
-                for i in range(min(ignores[0], len(payload)), min(ignores[1], len(payload))):
-                    limiter_map[i] = 0
-
-        return limiter_map
-
     def stage_timeout_reached(self, limit=20):
         if time.time() - self.stage_info_start_time > limit:
             return True
@@ -108,11 +103,11 @@ class FuzzingStateLogic:
                 return self.create_update({"name": "deterministic"}, {"afl_det_info": afl_det_info}), None
             return self.create_update({"name": "havoc"}, {"afl_det_info": afl_det_info}), None
         elif metadata["state"]["name"] == "havoc":
-            self.handle_havoc(payload, metadata)
-            return self.create_update({"name": "final"}, None), None
+            havoc_seed = self.handle_havoc(payload, metadata)
+            return self.create_update({"name": "final"}, {"havoc_seed": havoc_seed}), None
         elif metadata["state"]["name"] == "final":
-            self.handle_havoc(payload, metadata)
-            return self.create_update({"name": "final"}, None), None
+            havoc_seed = self.handle_havoc(payload, metadata)
+            return self.create_update({"name": "final"}, {"havoc_seed": havoc_seed}), None
         else:
             raise ValueError("Unknown task stage %s" % metadata["state"]["name"])
 
@@ -264,6 +259,12 @@ class FuzzingStateLogic:
         self.redqueen_time += time.time() - redqueen_start_time
 
     def handle_havoc(self, payload, metadata):
+        # AFL havoc/splice mutations only depend on payload and seed, returned for replay
+        havoc_seed = self.config.havoc_seed
+        if havoc_seed is None:
+            havoc_seed = rand.int(0xffffffff)
+        schedule = HavocSchedule(havoc_seed)
+
         havoc_afl = True
         havoc_splice = True
         havoc_radamsa = self.config.radamsa
@@ -290,15 +291,16 @@ class FuzzingStateLogic:
 
             if havoc_afl:
                 havoc_start_time = time.time()
-                self.__perform_havoc(payload, metadata, use_splicing=False)
+                self.__perform_havoc(payload, metadata, schedule, use_splicing=False)
                 self.havoc_time += time.time() - havoc_start_time
 
             if havoc_splice:
                 splice_start_time = time.time()
-                self.__perform_havoc(payload, metadata, use_splicing=True)
+                self.__perform_havoc(payload, metadata, schedule, use_splicing=True)
                 self.splice_time += time.time() - splice_start_time
 
         self.logger.debug("HAVOC times: afl: %.1f, splice: %.1f, grim: %.1f, rdmsa: %.1f", self.havoc_time, self.splice_time, self.grimoire_time, self.radamsa_time)
+        return havoc_seed
 
 
     def validate_bytes(self, payload, metadata, extra_info=None):
@@ -321,6 +323,26 @@ class FuzzingStateLogic:
         return bitmap, is_new
 
 
+    def execute_hashed(self, payload, label=None):
+        # same as execute(), but returns the bitmap hash for comparison across executions
+        bitmap, is_new = self.execute(payload, label=label)
+        return bitmap.hash(), is_new
+
+    def execute_batched(self, payload):
+        # queue payload for Worker.execute_batch(), results are not returned
+        self.batch.append(bytes(payload))
+        if len(self.batch) >= self.batch_size:
+            self.flush_batch()
+
+    def flush_batch(self):
+        if not self.batch:
+            return
+        batch = self.batch
+        self.batch = []
+        self.stage_info_execs += len(batch)
+        parent_info = self.get_parent_info()
+        self.stage_info_findings += self.worker.execute_batch(batch, parent_info)
+
     def execute_redqueen(self, payload):
         # one regular execution to ensure all pages cached
         # also colored payload may yield new findings(?)
@@ -386,88 +408,94 @@ class FuzzingStateLogic:
         # self.redqueen_state.update_redqueen_blacklist(RedqueenWorkdir(0))
 
 
-    def dilate_effector_map(self, effector_map, limiter_map):
-        ignore_limit = 2
-        effector_map[0] = 1
-        effector_map[-1] = 1
-        for i in range(len(effector_map) // ignore_limit):
-            base = i * ignore_limit
-            effector_slice = effector_map[base:base + ignore_limit]
-            limiter_slice = limiter_map[base:base + ignore_limit]
-            if any(effector_slice) and any(limiter_slice):
-                for j in range(len(effector_slice)):
-                    effector_map[i + j] = 1
-
     def handle_deterministic(self, payload, metadata):
         if self.config.afl_dumb_mode:
             return False, {}
 
-        skip_zero = self.config.afl_skip_zero
-        arith_max = self.config.afl_arith_max
-        use_effector_map = not self.config.afl_no_effector and len(payload) > 128
-        limiter_map = self.create_limiter_map(payload)
-        effector_map = None
+        use_effector_map = deterministic.use_effector_map(self.config, len(payload))
+        limiter_map = deterministic.create_limiter_map(self.config, len(payload))
 
         # Mutable payload allows faster bitwise manipulations
         payload_array = bytearray(payload)
-        
-        default_info = {"stage": "flip_1"}
-        det_info = metadata.get("afl_det_info", default_info)
 
-        # Walking bitflips
-        if det_info["stage"] == "flip_1":
-            bitflip.mutate_seq_walking_bits(payload_array,      self.execute, skip_null=skip_zero, effector_map=limiter_map)
-            bitflip.mutate_seq_two_walking_bits(payload_array,  self.execute, skip_null=skip_zero, effector_map=limiter_map)
-            bitflip.mutate_seq_four_walking_bits(payload_array, self.execute, skip_null=skip_zero, effector_map=limiter_map)
+        # Resume at offset cursor of current sub-stage. Shards handed out by
+        # the Manager only cover offsets [start:end] of a single sub-stage.
+        det_info = deterministic.resume_info(metadata.get("afl_det_info", None))
+        end = det_info.get("end", len(payload))
+
+        while det_info["stage"] != "done":
+            stage = det_info["stage"]
+            offset = det_info["offset"]
+
+            if offset >= end:
+                if "end" in det_info:
+                    break
+                if stage == "flip_8/1":
+                    deterministic.finish_effector_map(det_info, limiter_map)
+                    # baseline is not needed by later sub-stages
+                    det_info.pop("eff_base", None)
+                det_info["stage"] = deterministic.next_stage(stage)
+                det_info["offset"] = 0
+                continue
+
+            if stage == "flip_8/1" and use_effector_map:
+                det_info["eff_map"] = bytearray(det_info.get("eff_map", limiter_map))
+
+            slice_end = min(end, offset + deterministic.slice_len(stage, self.config.afl_arith_max))
+            self.__perform_deterministic(payload_array, det_info, limiter_map, offset, slice_end)
+            det_info["offset"] = slice_end
 
-            det_info["stage"] = "flip_8"
             if self.stage_timeout_reached():
-                return True, det_info
-
-        # Walking byte sets..
-        if det_info["stage"] == "flip_8":
-            # Generate AFL-style effector map based on walking_bytes()
-            if use_effector_map:
-                self.logger.debug("Preparing effector map..")
-                effector_map = bytearray(limiter_map)
-
-            bitflip.mutate_seq_walking_byte(payload_array, self.execute, skip_null=skip_zero, limiter_map=limiter_map, effector_map=effector_map)
+                break
 
-            if use_effector_map:
-                self.dilate_effector_map(effector_map, limiter_map)
-            else:
-                effector_map = limiter_map
+        # effector map is only reported back from the shards that build it
+        if "end" in det_info and det_info["stage"] != "flip_8/1":
+            det_info.pop("eff_map", None)
+        return det_info["stage"] != "done", det_info
 
-            bitflip.mutate_seq_two_walking_bytes(payload_array,  self.execute, effector_map=effector_map)
-            bitflip.mutate_seq_four_walking_bytes(payload_array, self.execute, effector_map=effector_map)
+    def __perform_deterministic(self, payload_array, det_info, limiter_map, start, end):
+        skip_zero = self.config.afl_skip_zero
+        arith_max = self.config.afl_arith_max
+        effector_map = det_info.get("eff_map", None)
+        stage = det_info["stage"]
 
-            det_info["stage"] = "arith"
-            if effector_map:
-                det_info["eff_map"] = bytearray(effector_map)
-            if self.stage_timeout_reached():
-                return True, det_info
+        # Walking bitflips
+        if stage == "flip_1/1":
+            bitflip.mutate_seq_walking_bits(payload_array,      self.execute, skip_null=skip_zero, effector_map=limiter_map, start=start, end=end)
+        elif stage == "flip_2/1":
+            bitflip.mutate_seq_two_walking_bits(payload_array,  self.execute, skip_null=skip_zero, effector_map=limiter_map, start=start, end=end)
+        elif stage == "flip_4/1":
+            bitflip.mutate_seq_four_walking_bits(payload_array, self.execute, skip_null=skip_zero, effector_map=limiter_map, start=start, end=end)
+
+        # Walking byte sets, first one generates AFL-style effector map
+        elif stage == "flip_8/1":
+            if effector_map and "eff_base" not in det_info:
+                # baseline is computed once per node and passed on to later slices and shards
+                det_info["eff_base"], _ = self.execute_hashed(payload_array)
+            bitflip.mutate_seq_walking_byte(payload_array, self.execute_hashed, skip_null=skip_zero, limiter_map=limiter_map,
+                                            effector_map=effector_map, start=start, end=end, orig_bitmap=det_info.get("eff_base", None))
+        elif stage == "flip_8/2":
+            bitflip.mutate_seq_two_walking_bytes(payload_array,  self.execute, effector_map=effector_map, start=start, end=end)
+        elif stage == "flip_8/4":
+            bitflip.mutate_seq_four_walking_bytes(payload_array, self.execute, effector_map=effector_map, start=start, end=end)
 
         # Arithmetic mutations..
-        if det_info["stage"] == "arith":
-            effector_map = det_info.get("eff_map", None)
-            arithmetic.mutate_seq_8_bit_arithmetic(payload_array,  self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max)
-            arithmetic.mutate_seq_16_bit_arithmetic(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max)
-            arithmetic.mutate_seq_32_bit_arithmetic(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max)
-
-            det_info["stage"] = "intr"
-            if self.stage_timeout_reached():
-                return True, det_info
+        elif stage == "arith_1":
+            arithmetic.mutate_seq_8_bit_arithmetic(payload_array,  self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max, start=start, end=end)
+        elif stage == "arith_2":
+            arithmetic.mutate_seq_16_bit_arithmetic(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max, start=start, end=end)
+        elif stage == "arith_4":
+            arithmetic.mutate_seq_32_bit_arithmetic(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max, start=start, end=end)
 
         # Interesting value mutations..
-        if det_info["stage"] == "intr":
-            effector_map = det_info.get("eff_map", None)
-            interesting_values.mutate_seq_8_bit_interesting(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map)
-            interesting_values.mutate_seq_16_bit_interesting(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max)
-            interesting_values.mutate_seq_32_bit_interesting(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max)
-
-            det_info["stage"] = "done"
-
-        return False, det_info
+        elif stage == "int_1":
+            interesting_values.mutate_seq_8_bit_interesting(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, start=start, end=end)
+        elif stage == "int_2":
+            interesting_values.mutate_seq_16_bit_interesting(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max, start=start, end=end)
+        elif stage == "int_4":
+            interesting_values.mutate_seq_32_bit_interesting(payload_array, self.execute, skip_null=skip_zero, effector_map=effector_map, arith_max=arith_max, start=start, end=end)
+        else:
+            raise ValueError("Unknown deterministic stage %s" % stage)
 
 
     def __perform_rq_dict(self, payload_array, metadata):
@@ -499,16 +527,18 @@ class FuzzingStateLogic:
         self.stage_update_label("radamsa")
         radamsa.mutate_seq_radamsa_array(payload_array, self.execute, radamsa_amount)
 
-    def __perform_havoc(self, payload_array, metadata, use_splicing):
+    def __perform_havoc(self, payload_array, metadata, schedule, use_splicing):
         perf = metadata["performance"]
         havoc_amount = havoc.havoc_range(self.HAVOC_MULTIPLIER / perf)
+        execute = self.execute_batched if self.batch_size else self.execute
 
         if use_splicing:
             self.stage_update_label("afl_splice")
-            havoc.mutate_seq_splice_array(payload_array, self.execute, havoc_amount)
+            havoc.mutate_seq_splice_array(payload_array, execute, havoc_amount, schedule=schedule)
         else:
             self.stage_update_label("afl_havoc")
-            havoc.mutate_seq_havoc_array(payload_array, self.execute, havoc_amount)
+            havoc.mutate_seq_havoc_array(payload_array, execute, havoc_amount, schedule=schedule)
+        self.flush_batch()
 
 
     def __check_colorization(self, orig_hash, payload_array, min, max):
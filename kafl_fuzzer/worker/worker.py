@@ -22,12 +22,15 @@ import lz4.frame as lz4
 #from kafl_fuzzer.common.config import FuzzerConfiguration
 from kafl_fuzzer.common.rand import rand
 from kafl_fuzzer.manager.bitmap import BitmapStorage, GlobalBitmap
-from kafl_fuzzer.manager.communicator import ClientConnection, MSG_IMPORT, MSG_RUN_NODE, MSG_BUSY
+from kafl_fuzzer.manager.communicator import ClientConnection, PayloadCache, MSG_IMPORT, MSG_RUN_NODE, MSG_BUSY
 from kafl_fuzzer.manager.node import QueueNode
+from kafl_fuzzer.manager.corpus_store import CorpusStore
 from kafl_fuzzer.manager.statistics import WorkerStatistics
 from kafl_fuzzer.worker.state_logic import FuzzingStateLogic
+from kafl_fuzzer.technique import havoc
 from kafl_fuzzer.worker.qemu import QemuIOException
 from kafl_fuzzer.worker.qemu import qemu as Qemu
+from kafl_fuzzer.worker.reload import ReloadController
 from kafl_fuzzer.common.logger import WorkerLogAdapter
 
 def worker_loader(pid, config):
@@ -46,13 +49,27 @@ class WorkerTask:
         self.conn = ClientConnection(pid, config)
         self.statistics = WorkerStatistics(self.pid, config)
         self.logic = FuzzingStateLogic(self, config)
-        self.bitmap_storage = BitmapStorage(self.config, "main")
+        self.bitmap_storage = BitmapStorage(self.config, "main", private=config.bitmap_sync)
+
+        if config.corpus_store:
+            QueueNode.corpus_store = CorpusStore(config.work_dir, read_only=True)
+
+        self.payload_cache = None
+        if config.node_cache:
+            self.payload_cache = PayloadCache(config.node_cache)
 
         self.payload_limit = self.q.get_payload_limit()
         self.t_hard = config.timeout_hard
         self.t_soft = config.timeout_soft
         self.t_check = config.timeout_check
         self.num_funky = 0
+        self.bitmap_snapshot = None
+
+        self.reload_ctl = None
+        if config.reload_max:
+            self.reload_ctl = ReloadController(config.reload_max, config.reload)
+            self.q.reload_interval = self.reload_ctl.interval
+        self.statistics.event_reload_interval(self.q.reload_interval)
 
     def handle_import(self, msg):
         meta_data = {"state": {"name": "import"}, "id": 0}
@@ -79,12 +96,34 @@ class WorkerTask:
             time.sleep(busy_timeout)
         self.conn.send_ready()
 
+    def get_node_inline(self, task):
+        # node struct is sent inline, payload only if not in our cache
+        meta_data = task["node"]
+        key = (task["nid"], task["version"])
+        payload = task.get("payload", None)
+        if payload is None:
+            payload = self.payload_cache.lookup(key)
+        if payload is None:
+            self.logger.debug("Payload cache miss for node %d, reading from disk.", task["nid"])
+            payload = QueueNode.get_payload(self.config.work_dir, meta_data)
+        self.payload_cache.insert(key, payload)
+        return meta_data, payload
+
     def handle_node(self, msg):
-        meta_data = QueueNode.get_metadata(self.config.work_dir, msg["task"]["nid"])
-        payload = QueueNode.get_payload(self.config.work_dir, meta_data)
+        if "node" in msg["task"]:
+            meta_data, payload = self.get_node_inline(msg["task"])
+        else:
+            meta_data = QueueNode.get_metadata(self.config.work_dir, msg["task"]["nid"])
+            payload = QueueNode.get_payload(self.config.work_dir, meta_data)
 
-        # fixme: determine globally based on all seen regulars
-        t_dyn = self.t_soft + 1.2 * meta_data["info"]["performance"]
+        # Manager may hand out a shard of the node's deterministic stage
+        if "det_shard" in msg["task"]:
+            meta_data["afl_det_info"] = msg["task"]["det_shard"]
+
+        # Manager may recommend a timeout based on all seen regulars
+        t_dyn = msg["task"].get("timeout", None)
+        if t_dyn is None:
+            t_dyn = self.t_soft + 1.2 * meta_data["info"]["performance"]
         self.q.set_timeout(min(self.t_hard, t_dyn))
 
         try:
@@ -93,6 +132,9 @@ class WorkerTask:
             # mark node as crashing and free it before escalating
             self.logger.info("Qemu execution failed for node %d." % meta_data["id"])
             results = self.logic.create_update(meta_data["state"], {"crashing": True})
+            if "det_shard" in msg["task"]:
+                # let the Manager hand out this shard again
+                results["afl_det_info"] = msg["task"]["det_shard"]
             self.conn.send_node_abort(meta_data["id"], results)
             raise
 
@@ -150,6 +192,11 @@ class WorkerTask:
                 self.logger.error("Lost connection to Manager. Shutting down.")
                 return
 
+            if "bitmap_sync" in msg and self.bitmap_storage.private:
+                self.bitmap_storage.apply_sync(msg["bitmap_sync"])
+            if "splice_ids" in msg:
+                havoc.splice_pool.add(msg["splice_ids"], msg.get("splice_payloads", None))
+
             if msg["type"] == MSG_RUN_NODE:
                 self.handle_node(msg)
             elif msg["type"] == MSG_IMPORT:
@@ -159,10 +206,13 @@ class WorkerTask:
             else:
                 raise ValueError("Unknown message type {}".format(msg))
 
-    def quick_validate(self, data, old_res, trace=False):
+    def quick_validate(self, data, old_res, trace=False, refresh=True):
         # Validate in persistent mode. Faster but problematic for very funky targets
+        # old_res is overwritten by the next execution, so compare against a snapshot.
+        # Set refresh=False if old_res still matches the previous snapshot.
         self.statistics.event_exec()
-        old_array = old_res.copy_to_array()
+        if refresh:
+            self.bitmap_snapshot = old_res.snapshot(self.bitmap_snapshot)
 
         if trace:
             self.q.set_trace_mode(True)
@@ -171,13 +221,12 @@ class WorkerTask:
             self.q.set_timeout(self.t_hard*2)
 
         new_res = self.__execute(data).apply_lut()
-        new_array = new_res.copy_to_array()
 
         if trace:
             self.q.set_trace_mode(False)
             self.q.set_timeout(dyn_timeout)
 
-        if new_array == old_array:
+        if new_res.equals(self.bitmap_snapshot):
             return True, new_res.performance
 
         return False, new_res.performance
@@ -190,9 +239,11 @@ class WorkerTask:
         runtime_avg = 0
         num = 0
         trace_round=False
+        stable = False
 
         for num in range(validations):
-            stable, runtime = self.quick_validate(data, old_res, trace=trace_round)
+            # a stable run leaves the same bitmap in old_res, no need to take a new snapshot
+            stable, runtime = self.quick_validate(data, old_res, trace=trace_round, refresh=not stable)
             if stable:
                 confirmations += 1
                 runtime_avg += runtime
@@ -248,8 +299,17 @@ class WorkerTask:
         info["performance"] = exec_res.performance
         info["hash"]        = exec_res.hash()
         info["starved"]     = exec_res.starved
-        if self.conn is not None:
-            self.conn.send_new_input(data, exec_res.copy_to_array(), info)
+        if self.conn is None:
+            return
+        # send sparse encoding (5 bytes per entry) unless the bitmap is densely populated
+        if 5*len(exec_res.nonzero_indices()) < exec_res.bitmap_size:
+            indices, values = exec_res.copy_to_sparse()
+            self.conn.send_new_input_sparse(data, indices, values, exec_res.bitmap_size, info)
+        else:
+            self.conn.send_new_input(data, exec_res.view(), info)
+        # private bitmap: skip duplicates of this input until the Manager's update arrives
+        if self.bitmap_storage.private:
+            self.bitmap_storage.get_bitmap_for_node_type(exec_res.exit_reason).update_with(exec_res)
 
     def trace_payload(self, data, info):
         # Legacy implementation of -trace (now -trace_cb) using libxdc_edge_callback hook.
@@ -338,6 +398,45 @@ class WorkerTask:
         return self.__execute(data, retry=retry+1)
 
 
+    def execute_batch(self, payloads, info):
+        # Execute payloads as a batch and re-run those flagged by the backend through
+        # execute() for validation and reporting. Returns the number of new inputs.
+        payloads = [data[:self.payload_limit] for data in payloads]
+        if not self.q.get_batch_size():
+            results = [self.execute(data, info.copy())[1] for data in payloads]
+            return sum(results)
+
+        try:
+            results = self.q.execute_batch(payloads)
+        except (ValueError, BrokenPipeError, ConnectionResetError) as e:
+            self.statistics.event_reload("shm/socket error")
+            if not self.q.restart():
+                raise QemuIOException("Qemu restart failure.") from e
+            return sum([self.execute(data, info.copy())[1] for data in payloads])
+
+        num_new = 0
+        for data, result in zip(payloads, results):
+            if result.new_coverage or (result.exit_reason == "timeout" and self.t_check):
+                # execute() accounts for the execution
+                _, is_new = self.execute(data, info.copy())
+                num_new += is_new
+                continue
+            self.statistics.event_exec(bb_cov=self.q.bb_seen)
+            if self.reload_ctl:
+                self.tune_reload(result.exit_reason in ["crash", "kasan"])
+            if result.exit_reason != "regular":
+                # restart Qemu on crash, same as execute()
+                self.statistics.event_reload(result.exit_reason)
+                self.q.reload()
+        return num_new
+
+    def tune_reload(self, crash):
+        interval = self.reload_ctl.event_exec(crash)
+        if interval:
+            self.logger.debug("Reload interval set to %d (%s)", interval, self.reload_ctl.reason)
+            self.q.set_reload_interval(interval)
+            self.statistics.event_reload_interval(interval)
+
     def execute(self, data, info, hard_timeout=False):
 
         if len(data) > self.payload_limit:
@@ -345,6 +444,8 @@ class WorkerTask:
 
         exec_res = self.__execute(data)
         self.statistics.event_exec(bb_cov=self.q.bb_seen)
+        if self.reload_ctl:
+            self.tune_reload(exec_res.is_crash())
 
         is_new_input = self.bitmap_storage.should_send_to_manager(exec_res, exec_res.exit_reason)
         crash = exec_res.is_crash()
@@ -373,8 +474,9 @@ class WorkerTask:
                         with tempfile.NamedTemporaryFile(delete=False,dir=self.config.work_dir + "/traces") as f:
                             shutil.move(trace_in, f.name)
                             info['pt_dump'] = f.name
+                if self.reload_ctl:
+                    self.reload_ctl.event_validate(stable)
                 if not stable:
-                    # TODO: auto-throttle persistent runs based on funky rate?
                     self.logger.debug("Input validation failed! Target funky?..")
                     self.statistics.event_funky()
             if exec_res.exit_reason == "timeout" and not hard_timeout:
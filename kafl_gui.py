@@ -23,6 +23,7 @@ import msgpack
 import psutil
 
 from kafl_fuzzer.common.util import read_binary_file
+from kafl_fuzzer.manager.statistics import WorkerStatsSegment
 
 class Interface:
     def __init__(self, stdscr):
@@ -466,14 +467,12 @@ class GuiData:
             raise FileNotFoundError("$workdir/stats")
 
         print("Waiting for Workers to launch..")
-        num_workers = self.stats["num_workers"]
-        for pid in range(0, num_workers):
-            while True:
-                init_data = self.read_file("worker_stats_%d" % pid)
-                if init_data:
-                    self.worker_stats.append(init_data)
-                    break
-                time.sleep(0.2)
+        self.worker_segment = WorkerStatsSegment(self.workdir)
+        while True:
+            self.worker_stats = self.worker_segment.read_all()
+            if all([x["start_time"] for x in self.worker_stats]):
+                break
+            time.sleep(0.2)
 
         self.starttime = min([x["start_time"] for x in self.worker_stats])
 
@@ -771,8 +770,8 @@ class GuiData:
         filename = self.workdir + "/corpus/%s/payload_%05d" % (exit_reason, nid)
         return read_binary_file(filename)[0:1024]  # TODO remove path traversal vuln
 
-    def load_worker(self, id):
-        self.worker_stats[id] = self.read_file("worker_stats_%d" % id)
+    def load_workers(self):
+        self.worker_stats = self.worker_segment.read_all()
 
     def load_global(self):
         self.stats = self.read_file("stats")
@@ -781,11 +780,10 @@ class GuiData:
         if "node_" in filename:
             self.load_node(pathname + "/" + filename)
             self.aggregate()
-        elif "worker_stats" in filename:
-            for i in range(0, self.num_workers()):
-                self.load_worker(i)
         elif filename == "stats":
+            # Manager writes stats after polling Worker slots
             self.load_global()
+            self.load_workers()
 
     def read_file(self, name):
         retry = 4
@@ -11,6 +11,7 @@ Optionally also visualize this output using an xdot graph.
 
 """
 
+import os
 import sys
 import time
 import glob
@@ -19,6 +20,7 @@ import msgpack
 import pygraphviz as pgv
 
 from kafl_fuzzer.common.util import read_binary_file, strdump, print_banner
+from kafl_fuzzer.manager.statistics import WorkerStatsSegment
 
 class Graph:
 
@@ -43,8 +45,8 @@ class Graph:
     def process_once(self):
 
         try:
-            for worker_stats in sorted(glob.glob(self.workdir + "/worker_stats_*")):
-                self.__process_worker(worker_stats)
+            for worker in WorkerStatsSegment(self.workdir).read_all():
+                self.__process_worker(worker)
             for nodefile in sorted(glob.glob(self.workdir + "/metadata/node_*")):
                 self.__process_node(nodefile)
         except:
@@ -66,10 +68,8 @@ class Graph:
         payload_file = self.workdir + "/corpus/" + exit_reason + "/payload_%05d" % node_id
         return read_binary_file(payload_file)
 
-    def __process_worker(self, worker_stats):
+    def __process_worker(self, worker):
 
-        worker = self.__read_msgpack(worker_stats)
-        
         self.global_tasks += 1
 
         self.global_executions += worker["total_execs"]
@@ -125,7 +125,7 @@ class Graph:
 
 def main(workdir, outfile=None):
 
-    if glob.glob(workdir + "/worker_stats_*") == []:
+    if not os.path.exists(workdir + "/worker_stats.shm"):
         print("No kAFL statistics found. Invalid workdir?")
 
     dot = Graph(workdir, outfile)
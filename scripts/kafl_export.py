@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+#
+# Copyright 2022 Intel Corporation
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+"""
+Export a kAFL corpus store (--corpus-store) to the classic workdir layout
+of corpus/<exit>/payload_N and metadata/node_N files.
+"""
+
+import sys
+
+from kafl_fuzzer.manager.corpus_store import CorpusStore
+
+if len(sys.argv) not in [2, 3]:
+    print("Usage: %s <workdir> [<outdir>]" % sys.argv[0])
+    sys.exit(1)
+
+workdir = sys.argv[1]
+outdir = sys.argv[2] if len(sys.argv) == 3 else workdir
+
+num_nodes = CorpusStore(workdir, read_only=True).export(outdir)
+print("Exported %d nodes to %s" % (num_nodes, outdir))
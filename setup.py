@@ -23,7 +23,7 @@ setup(name='kafl_fuzzer',
           ],
       scripts = ['kafl_fuzz.py', 'kafl_debug.py',
           'kafl_cov.py', 'kafl_plot.py',
-          'kafl_gui.py', 'scripts/mcat.py'],
+          'kafl_gui.py', 'scripts/mcat.py', 'scripts/kafl_export.py'],
 
 	  classifiers=[
 		  'Development Status :: 4 - Beta',